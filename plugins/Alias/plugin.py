@@ -270,6 +270,7 @@ class Alias(callbacks.Plugin):
         conf.supybot.plugins.Alias.aliases.get(name).register('locked',
                                                     registry.Boolean(lock, ''))
         self.aliases[name] = [alias, lock, f]
+        callbacks.commandIndex.addCommand(self, [name])
 
     def removeAlias(self, name, evenIfLocked=False):
         name = callbacks.canonicalName(name)
@@ -277,6 +278,7 @@ class Alias(callbacks.Plugin):
             if evenIfLocked or not self.aliases[name][1]:
                 del self.aliases[name]
                 conf.supybot.plugins.Alias.aliases.unregister(name)
+                callbacks.commandIndex.removeCommand(self, [name])
             else:
                 raise AliasError, 'That alias is locked.'
         else:
@@ -69,6 +69,11 @@ conf.registerChannelValue(ChannelLogger, 'filenameTimestamp',
     for your logs to be rotated, you'll also have to enable
     supybot.plugins.ChannelLogger.rotateLogs."""))
 
+conf.registerGlobalValue(ChannelLogger, 'maximumOpenLogs',
+    registry.PositiveInteger(256, """Determines how many logfiles the bot will
+    keep open at once.  When it has to open another, it closes the one it
+    wrote to least recently."""))
+
 conf.registerGlobalValue(ChannelLogger, 'directories',
     registry.Boolean(True, """Determines whether the bot will partition its
     channel logs into separate directories based on different criteria."""))
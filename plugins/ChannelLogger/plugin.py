@@ -30,6 +30,8 @@
 
 import os
 import time
+import threading
+import collections
 from cStringIO import StringIO
 
 import supybot.conf as conf
@@ -39,6 +41,7 @@ import supybot.ircmsgs as ircmsgs
 import supybot.ircutils as ircutils
 import supybot.registry as registry
 import supybot.callbacks as callbacks
+from supybot.utils.structures import LRUCache
 
 class FakeLog(object):
     def flush(self):
@@ -48,68 +51,106 @@ class FakeLog(object):
     def write(self, s):
         return
 
+class LogFiles(LRUCache):
+    """The open logfiles, as (irc, channel) -> (name, file).  Only so many
+    are kept open; the least recently written to are closed first."""
+    def dropped(self, key, value):
+        (name, log) = value
+        log.close()
+
+    def closeAll(self):
+        for key in self.keys():
+            (name, log) = self[key]
+            log.close()
+        self.clear()
+
 class ChannelLogger(callbacks.Plugin):
     noIgnore = True
     def __init__(self, irc):
         self.__parent = super(ChannelLogger, self)
         self.__parent.__init__(irc)
-        self.lastMsgs = {}
-        self.lastStates = {}
-        self.logs = {}
+        self.logs = LogFiles(self.registryValue('maximumOpenLogs'))
+        # doLog only appends lines to this, for the writer thread to write.
+        self.records = collections.deque()
+        self.wakeup = threading.Event()
+        self.flushing = False
+        self.resetting = False
+        self.dying = False
+        self.timestamps = {} # format -> (second, formatted timestamp)
+        self.writer = world.SupyThread(target=self._write,
+                                       name='ChannelLogger writer')
+        self.writer.setDaemon(True)
+        self.writer.start()
         self.flusher = self.flush
         world.flushers.append(self.flusher)
 
     def die(self):
-        for log in self._logs():
-            log.close()
+        self.dying = True
+        self.wakeup.set()
+        self.writer.join(10)
         world.flushers = [x for x in world.flushers if x is not self.flusher]
 
-    def __call__(self, irc, msg):
-        try:
-            # I don't know why I put this in, but it doesn't work, because it
-            # doesn't call doNick or doQuit.
-            # if msg.args and irc.isChannel(msg.args[0]):
-            self.__parent.__call__(irc, msg)
-            if irc in self.lastMsgs:
-                if irc not in self.lastStates:
-                    self.lastStates[irc] = irc.state.copy()
-                self.lastStates[irc].addMsg(irc, self.lastMsgs[irc])
-        finally:
-            # We must make sure this always gets updated.
-            self.lastMsgs[irc] = msg
-
     def reset(self):
-        for log in self._logs():
-            log.close()
-        self.logs.clear()
-        self.lastMsgs.clear()
-        self.lastStates.clear()
-
-    def _logs(self):
-        for logs in self.logs.itervalues():
-            for log in logs.itervalues():
-                yield log
+        self.resetting = True
+        self.wakeup.set()
 
     def flush(self):
-        self.checkLogNames()
-        for log in self._logs():
+        self.flushing = True
+        self.wakeup.set()
+
+    def _write(self):
+        while not self.dying:
+            self.wakeup.wait()
+            self.wakeup.clear()
+            try:
+                self.writeRecords()
+                if self.resetting:
+                    self.resetting = False
+                    self.logs.closeAll()
+                if self.flushing:
+                    self.flushing = False
+                    self.checkLogNames()
+                    self.flushLogs()
+            except Exception:
+                self.log.exception('Uncaught exception in ChannelLogger '
+                                   'writer:')
+        try:
+            self.writeRecords()
+        finally:
+            self.logs.closeAll()
+
+    def flushLogs(self):
+        for key in self.logs.keys():
+            (name, log) = self.logs[key]
             try:
                 log.flush()
             except ValueError, e:
                 if e.args[0] != 'I/O operation on a closed file':
                     self.log.exception('Odd exception:')
 
-    def logNameTimestamp(self, channel):
+    def strftime(self, format, t=None):
+        """Returns time.strftime(format) for t (or now), formatting it only
+        once a second.  Only the writer thread may use this."""
+        if t is None:
+            t = time.time()
+        second = int(t)
+        cached = self.timestamps.get(format)
+        if cached is None or cached[0] != second:
+            cached = (second, time.strftime(format, time.localtime(second)))
+            self.timestamps[format] = cached
+        return cached[1]
+
+    def logNameTimestamp(self, channel, t=None):
         format = self.registryValue('filenameTimestamp', channel)
-        return time.strftime(format)
+        return self.strftime(format, t)
 
-    def getLogName(self, channel):
+    def getLogName(self, channel, t=None):
         if self.registryValue('rotateLogs', channel):
-            return '%s.%s.log' % (channel, self.logNameTimestamp(channel))
+            return '%s.%s.log' % (channel, self.logNameTimestamp(channel, t))
         else:
             return '%s.log' % channel
 
-    def getLogDir(self, irc, channel):
+    def getLogDir(self, irc, channel, t=None):
         logDir = conf.supybot.directories.log.dirize(self.name())
         if self.registryValue('directories'):
             if self.registryValue('directories.network'):
@@ -118,46 +159,72 @@ class ChannelLogger(callbacks.Plugin):
                 logDir = os.path.join(logDir, channel)
             if self.registryValue('directories.timestamp'):
                 format = self.registryValue('directories.timestamp.format')
-                timeDir =time.strftime(format)
+                timeDir = self.strftime(format, t)
                 logDir = os.path.join(logDir, timeDir)
         if not os.path.exists(logDir):
             os.makedirs(logDir)
         return logDir
 
     def checkLogNames(self):
-        for (irc, logs) in self.logs.items():
-            for (channel, log) in logs.items():
-                if self.registryValue('rotateLogs', channel):
-                    name = self.getLogName(channel)
-                    if name != log.name:
-                        log.close()
-                        del logs[channel]
+        for key in self.logs.keys():
+            (irc, channel) = key
+            if self.registryValue('rotateLogs', channel):
+                (name, log) = self.logs[key]
+                if name != self.getLogName(channel):
+                    log.close()
+                    del self.logs[key]
 
-    def getLog(self, irc, channel):
-        self.checkLogNames()
+    def getLog(self, irc, channel, name=None, t=None):
+        if name is None:
+            name = self.getLogName(channel, t)
+        key = (irc, channel)
+        entry = self.logs.get(key)
+        if entry is not None:
+            if entry[0] == name:
+                return entry[1]
+            entry[1].close() # It's been rotated.
+            del self.logs[key]
         try:
-            logs = self.logs[irc]
-        except KeyError:
-            logs = ircutils.IrcDict()
-            self.logs[irc] = logs
-        if channel in logs:
-            return logs[channel]
-        else:
-            try:
-                name = self.getLogName(channel)
-                logDir = self.getLogDir(irc, channel)
-                log = file(os.path.join(logDir, name), 'a')
-                logs[channel] = log
-                return log
-            except IOError:
-                self.log.exception('Error opening log:')
-                return FakeLog()
+            logDir = self.getLogDir(irc, channel, t)
+            log = file(os.path.join(logDir, name), 'a')
+            self.logs[key] = (name, log)
+            return log
+        except IOError:
+            self.log.exception('Error opening log:')
+            return FakeLog()
 
-    def timestamp(self, log):
-        format = conf.supybot.log.timestampFormat()
-        if format:
-            log.write(time.strftime(format))
-            log.write('  ')
+    def writeRecords(self):
+        """Writes the lines doLog has queued, joining each log's lines into
+        one write."""
+        self.logs.max = self.registryValue('maximumOpenLogs')
+        timestampFormat = conf.supybot.log.timestampFormat()
+        settings = {} # channel -> (stripFormatting, timestamp)
+        batches = {} # (irc, channel, log name) -> (time, [lines])
+        order = []
+        while self.records:
+            (irc, channel, t, s) = self.records.popleft()
+            if channel not in settings:
+                settings[channel] = \
+                    (self.registryValue('stripFormatting', channel),
+                     self.registryValue('timestamp', channel))
+            (stripFormatting, timestamp) = settings[channel]
+            if stripFormatting:
+                s = ircutils.stripFormatting(s)
+            if timestamp and timestampFormat:
+                s = '%s  %s' % (self.strftime(timestampFormat, t), s)
+            key = (irc, channel, self.getLogName(channel, t))
+            if key not in batches:
+                batches[key] = (t, [])
+                order.append(key)
+            batches[key][1].append(s)
+        flushImmediately = self.registryValue('flushImmediately')
+        for key in order:
+            (irc, channel, name) = key
+            (t, lines) = batches[key]
+            log = self.getLog(irc, channel, name, t)
+            log.write(''.join(lines))
+            if flushImmediately:
+                log.flush()
 
     def normalizeChannel(self, irc, channel):
         return ircutils.toLower(channel)
@@ -167,14 +234,9 @@ class ChannelLogger(callbacks.Plugin):
             return
         s = format(s, *args)
         channel = self.normalizeChannel(irc, channel)
-        log = self.getLog(irc, channel)
-        if self.registryValue('timestamp', channel):
-            self.timestamp(log)
-        if self.registryValue('stripFormatting', channel):
-            s = ircutils.stripFormatting(s)
-        log.write(s)
-        if self.registryValue('flushImmediately'):
-            log.flush()
+        self.records.append((irc, channel, time.time(), s))
+        if not self.wakeup.isSet():
+            self.wakeup.set()
 
     def doPrivmsg(self, irc, msg):
         (recipients, text) = msg.args
@@ -199,10 +261,9 @@ class ChannelLogger(callbacks.Plugin):
     def doNick(self, irc, msg):
         oldNick = msg.nick
         newNick = msg.args[0]
-        for (channel, c) in irc.state.channels.iteritems():
-            if newNick in c.users:
-                self.doLog(irc, channel,
-                           '*** %s is now known as %s\n', oldNick, newNick)
+        for channel in irc.state.channelsOf(newNick):
+            self.doLog(irc, channel,
+                       '*** %s is now known as %s\n', oldNick, newNick)
     def doJoin(self, irc, msg):
         for channel in msg.args[0].split(','):
             self.doLog(irc, channel,
@@ -246,9 +307,8 @@ class ChannelLogger(callbacks.Plugin):
     def doQuit(self, irc, msg):
         if not isinstance(irc, irclib.Irc):
             irc = irc.getRealIrc()
-        for (channel, chan) in self.lastStates[irc].channels.iteritems():
-            if msg.nick in chan.users:
-                self.doLog(irc, channel, '*** %s has quit IRC\n', msg.nick)
+        for channel in irc.state.whichChannelsHad(msg.nick):
+            self.doLog(irc, channel, '*** %s has quit IRC\n', msg.nick)
 
     def outFilter(self, irc, msg):
         # Gotta catch my own messages *somehow* :)
@@ -29,8 +29,70 @@
 
 from supybot.test import *
 
+import os
+
 class ChannelLoggerTestCase(PluginTestCase):
     plugins = ('ChannelLogger',)
+    def setUp(self):
+        PluginTestCase.setUp(self)
+        self.cb = self.irc.getCallback('ChannelLogger')
+
+    def logContents(self, channel):
+        filename = os.path.join(conf.supybot.directories.log(),
+                                'ChannelLogger', self.irc.network,
+                                channel, channel + '.log')
+        try:
+            fd = file(filename)
+        except IOError:
+            return ''
+        try:
+            return fd.read()
+        finally:
+            fd.close()
+
+    def waitForLog(self, channel, s):
+        for _ in xrange(200):
+            self.cb.flush()
+            time.sleep(0.01)
+            if s in self.logContents(channel):
+                return
+        self.fail('%r never got logged in %s.' % (s, channel))
+
+    def testLinesAreWritten(self):
+        self.irc.feedMsg(ircmsgs.privmsg('#logged', 'hello',
+                                         prefix=self.prefix))
+        self.irc.feedMsg(ircmsgs.privmsg('#logged', '\x02bold\x02',
+                                         prefix=self.prefix))
+        self.waitForLog('#logged', '<%s> bold\n' % self.nick)
+        self.failUnless('<%s> hello\n' % self.nick in
+                        self.logContents('#logged'))
+
+    def testOpenLogsAreLimited(self):
+        original = conf.supybot.plugins.ChannelLogger.maximumOpenLogs()
+        try:
+            conf.supybot.plugins.ChannelLogger.maximumOpenLogs.setValue(1)
+            for (i, channel) in enumerate(['#one', '#two', '#one']):
+                s = 'line %s' % i
+                self.irc.feedMsg(ircmsgs.privmsg(channel, s,
+                                                 prefix=self.prefix))
+                self.waitForLog(channel, s)
+            self.failUnless(len(self.cb.logs) <= 1)
+        finally:
+            conf.supybot.plugins.ChannelLogger.maximumOpenLogs.setValue(
+                original)
+
+    def testLogDirUsesRecordTime(self):
+        config = conf.supybot.plugins.ChannelLogger.directories.timestamp
+        original = (config(), config.format())
+        try:
+            config.setValue(True)
+            config.format.setValue('%Y')
+            t = 400 * 86400 # Some time in 1971, in any timezone.
+            logDir = self.cb.getLogDir(self.irc, '#logged', t)
+            self.assertEqual(os.path.basename(logDir), '1971')
+        finally:
+            config.setValue(original[0])
+            config.format.setValue(original[1])
 
 
 # vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
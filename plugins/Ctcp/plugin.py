@@ -39,6 +39,7 @@ import supybot.callbacks as callbacks
 
 class Ctcp(callbacks.PluginRegexp):
     public = False
+    commutative = True
     regexps = ('ctcpPing', 'ctcpVersion', 'ctcpUserinfo',
                'ctcpTime', 'ctcpFinger', 'ctcpSource')
     def __init__(self, irc):
@@ -134,7 +135,7 @@ class Ctcp(callbacks.PluginRegexp):
         def doReply():
             if self.versions:
                 L = []
-                for (reply, nicks) in self.versions.iteritems():
+                for (reply, nicks) in self.versions.items():
                     if nicks:
                         L.append(format('%L responded with %q', nicks, reply))
                     else:
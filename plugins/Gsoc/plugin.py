@@ -33,7 +33,7 @@ from supybot.commands import *
 import supybot.plugins as plugins
 import supybot.ircutils as ircutils
 import supybot.callbacks as callbacks
-from urllib import urlencode, urlopen
+from urllib import urlencode
 
 class Gsoc(callbacks.Plugin):
     """Provide some gsoc-specific commands that need to be more than just
@@ -46,7 +46,7 @@ class Gsoc(callbacks.Plugin):
         cookie = self.registryValue("secretCookie")
         query = [('factoid', factoid), ('cookie', cookie)]
         data = urlencode(query)
-        urlopen(self.address, data)
+        utils.web.getUrl(utils.web.Request(self.address, data))
 
     def next(self, irc, msg, args, redirect):
         """[<redirect>]
@@ -239,9 +239,9 @@ class Misc(callbacks.Plugin):
         userHostmask = msg.prefix.split('!', 1)[1]
         if nick:
             try:
-                (private, L) = irc._mores[nick]
+                (private, L) = irc._mores.get(nick)
                 if not private:
-                    irc._mores[userHostmask] = L[:]
+                    irc._mores.put(userHostmask, L.copy())
                 else:
                     irc.error('%s has no public mores.' % nick)
                     return
@@ -249,7 +249,7 @@ class Misc(callbacks.Plugin):
                 irc.error('Sorry, I can\'t find any mores for %s' % nick)
                 return
         try:
-            L = irc._mores[userHostmask]
+            (_, L) = irc._mores.get(userHostmask)
             chunk = L.pop()
             if L:
                 chunk += format(' \x02(%n)\x0F', (len(L), 'more', 'message'))
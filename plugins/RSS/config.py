@@ -65,6 +65,10 @@ conf.registerGlobalValue(RSS, 'waitPeriod',
 conf.registerGlobalValue(RSS, 'feeds',
     FeedNames([], """Determines what feeds should be accessible as
     commands."""))
+conf.registerGlobalValue(RSS, 'fetchThreads',
+    registry.PositiveInteger(2, """Determines how many threads the bot will
+    use to check announced feeds for new headlines.  This only takes effect
+    when the plugin is (re)loaded."""))
 conf.registerChannelValue(RSS, 'showLinks',
     registry.Boolean(False, """Determines whether the bot will list the link
     along with the title of the feed when the rss command is called.
@@ -30,6 +30,7 @@
 
 import new
 import time
+import Queue
 import socket
 import sgmllib
 import threading
@@ -38,7 +39,9 @@ import supybot.conf as conf
 import supybot.utils as utils
 import supybot.world as world
 from supybot.commands import *
+import supybot.ircmsgs as ircmsgs
 import supybot.ircutils as ircutils
+import supybot.schedule as schedule
 import supybot.registry as registry
 import supybot.callbacks as callbacks
 
@@ -56,12 +59,67 @@ def getFeedName(irc, msg, args, state):
     state.args.append(callbacks.canonicalName(args.pop(0)))
 addConverter('feedName', getFeedName)
 
+class FetchPool(object):
+    """A bounded pool of threads fetching feeds.  A feed that's already
+    waiting or being fetched isn't queued again."""
+    def __init__(self, size, fetch, log):
+        self.size = size
+        self.fetch = fetch
+        self.log = log
+        self.queue = Queue.Queue()
+        self.pending = set()
+        self.threads = []
+        self.lock = threading.Lock()
+
+    def add(self, url):
+        self.lock.acquire()
+        try:
+            if url in self.pending:
+                return False
+            self.pending.add(url)
+            self.threads = [t for t in self.threads if t.isAlive()]
+            if len(self.threads) < self.size:
+                t = world.SupyThread(target=self._run,
+                                     name='RSS fetcher #%s' %
+                                     world.threadsSpawned)
+                t.setDaemon(True)
+                t.start()
+                self.threads.append(t)
+        finally:
+            self.lock.release()
+        self.queue.put(url)
+        return True
+
+    def _run(self):
+        while 1:
+            url = self.queue.get()
+            if url is None:
+                return
+            try:
+                try:
+                    self.fetch(url)
+                except Exception:
+                    self.log.exception('Uncaught exception fetching %u:', url)
+            finally:
+                self.lock.acquire()
+                try:
+                    self.pending.discard(url)
+                finally:
+                    self.lock.release()
+
+    def stop(self):
+        for _ in self.threads:
+            self.queue.put(None)
+
+
 class RSS(callbacks.Plugin):
     """This plugin is useful both for announcing updates to RSS feeds in a
     channel, and for retrieving the headlines of RSS feeds via command.  Use
     the "add" command to add feeds to this plugin, and use the "announce"
     command to determine what feeds should be announced in a given channel."""
     threaded = True
+    # How often (in seconds) we look for feeds newly announced in a channel.
+    checkPeriod = 60
     def __init__(self, irc):
         self.__parent = super(RSS, self)
         self.__parent.__init__(irc)
@@ -70,7 +128,18 @@ class RSS(callbacks.Plugin):
         self.locks = {}
         self.lastRequest = {}
         self.cachedFeeds = {}
+        # For conditional GETs.
+        self.etags = {}
+        self.modified = {}
+        # url : set of the headlines we've already seen in the feed.
+        self.seen = {}
+        # url : (name, [(irc, channel), ...]) for the announced feeds.
+        self.announced = {}
+        # The urls for which we've scheduled an announcement.
+        self.feedEvents = set()
         self.gettingLockLock = threading.Lock()
+        self.pool = FetchPool(self.registryValue('fetchThreads'),
+                              self._announceFeed, self.log)
         for name in self.registryValue('feeds'):
             self._registerFeed(name)
             try:
@@ -79,7 +148,16 @@ class RSS(callbacks.Plugin):
                 self.log.warning('%s is not a registered feed, removing.',name)
                 continue
             self.makeFeedCommand(name, url)
-            self.getFeed(url) # So announced feeds don't announce on startup.
+        schedule.addPeriodicEvent(self._checkAnnouncements, self.checkPeriod,
+                                  name='RSS.checkAnnouncements', now=False)
+
+    def die(self):
+        schedule.removePeriodicEvent('RSS.checkAnnouncements')
+        for url in self.feedEvents:
+            schedule.removeEvent(self._feedEventName(url))
+        self.feedEvents.clear()
+        self.pool.stop()
+        self.__parent.die()
 
     def isCommandMethod(self, name):
         if not self.__parent.isCommandMethod(name):
@@ -102,40 +180,65 @@ class RSS(callbacks.Plugin):
     def _registerFeed(self, name, url=''):
         self.registryValue('feeds').add(name)
         group = self.registryValue('feeds', value=False)
-        group.register(name, registry.String(url, ''))
-
-    def __call__(self, irc, msg):
-        self.__parent.__call__(irc, msg)
-        irc = callbacks.SimpleProxy(irc, msg)
-        newFeeds = {}
-        for channel in irc.state.channels:
-            feeds = self.registryValue('announce', channel)
-            for name in feeds:
-                commandName = callbacks.canonicalName(name)
-                if self.isCommandMethod(commandName):
-                    url = self.feedNames[commandName][0]
-                else:
-                    url = name
-                if self.willGetNewFeed(url):
-                    newFeeds.setdefault((url, name), []).append(channel)
-        for ((url, name), channels) in newFeeds.iteritems():
-            # We check if we can acquire the lock right here because if we
-            # don't, we'll possibly end up spawning a lot of threads to get
-            # the feed, because this thread may run for a number of bytecodes
-            # before it switches to a thread that'll get the lock in
-            # _newHeadlines.
-            if self.acquireLock(url, blocking=False):
-                try:
-                    t = threading.Thread(target=self._newHeadlines,
-                                         name=format('Fetching %u', url),
-                                         args=(irc, channels, name, url))
-                    self.log.info('Checking for announcements at %u', url)
-                    world.threadsSpawned += 1
-                    t.setDaemon(True)
-                    t.start()
-                finally:
-                    self.releaseLock(url)
-                    time.sleep(0.1) # So other threads can run.
+        feed = group.register(name, registry.String(url, ''))
+        conf.registerGlobalValue(feed, 'waitPeriod',
+            registry.NonNegativeInteger(0, """Indicates how many seconds the
+            bot will wait between retrieving this feed to announce it.  If
+            this is 0, supybot.plugins.RSS.waitPeriod is used."""))
+
+    def _getWaitPeriod(self, name):
+        """Returns how long to wait between announcement checks of the feed
+        announced as name, which may be a url."""
+        commandName = callbacks.canonicalName(name)
+        if commandName in self.feedNames:
+            wait = self.registryValue(registry.join(['feeds', commandName,
+                                                     'waitPeriod']))
+            if wait:
+                return wait
+        return self.registryValue('waitPeriod')
+
+    def _getAnnouncedFeeds(self):
+        announced = {}
+        for irc in world.ircs:
+            for channel in irc.state.channels:
+                for name in self.registryValue('announce', channel):
+                    commandName = callbacks.canonicalName(name)
+                    if commandName in self.feedNames:
+                        url = self.feedNames[commandName][0]
+                    else:
+                        url = name
+                    targets = announced.setdefault(url, (name, []))[1]
+                    targets.append((irc, channel))
+        return announced
+
+    def _feedEventName(self, url):
+        return 'RSS: %s' % url
+
+    def _checkAnnouncements(self):
+        """Makes sure every announced feed, and no other, has an event
+        scheduled to check it for new headlines."""
+        self.announced = self._getAnnouncedFeeds()
+        now = time.time()
+        for (url, (name, _)) in self.announced.iteritems():
+            if url not in self.feedEvents:
+                when = self.lastRequest.get(url, 0) + self._getWaitPeriod(name)
+                self._scheduleFeed(url, max(now, when))
+        for url in list(self.feedEvents):
+            if url not in self.announced:
+                schedule.removeEvent(self._feedEventName(url))
+                self.feedEvents.remove(url)
+
+    def _scheduleFeed(self, url, when):
+        def check():
+            self.feedEvents.discard(url)
+            if url in self.announced:
+                (name, _) = self.announced[url]
+                self.log.debug('Checking for announcements at %u', url)
+                self.pool.add(url)
+                wait = self._getWaitPeriod(name)
+                self._scheduleFeed(url, time.time() + wait)
+        schedule.addEvent(check, when, self._feedEventName(url))
+        self.feedEvents.add(url)
 
     def buildHeadlines(self, headlines, channel, config='announce.showLinks'):
         newheadlines = []
@@ -152,53 +255,56 @@ class RSS(callbacks.Plugin):
                 newheadlines = [format('%s', h[0]) for h in headlines]
         return newheadlines
 
-    def _newHeadlines(self, irc, channels, name, url):
+    def _newHeadlines(self, url, headlines):
+        """Returns the headlines we haven't seen before in the feed at url.
+        The first time we see a feed, everything in it is considered old, so
+        we don't announce a feed's entire backlog."""
+        def canonize(headline):
+            return (tuple(headline[0].lower().split()), headline[1])
+        current = set(map(canonize, headlines))
         try:
-            # We acquire the lock here so there's only one announcement thread
-            # in this code at any given time.  Otherwise, several announcement
-            # threads will getFeed (all blocking, in turn); then they'll all
-            # want to send their news messages to the appropriate channels.
-            # Note that we're allowed to acquire this lock twice within the
-            # same thread because it's an RLock and not just a normal Lock.
-            self.acquireLock(url)
-            try:
-                oldresults = self.cachedFeeds[url]
-                oldheadlines = self.getHeadlines(oldresults)
-            except KeyError:
-                oldheadlines = []
-            newresults = self.getFeed(url)
-            newheadlines = self.getHeadlines(newresults)
-            if len(newheadlines) == 1:
-                s = newheadlines[0][0]
-                if s in ('Timeout downloading feed.',
-                         'Unable to download feed.'):
-                    self.log.debug('%s %u', s, url)
-                    return
-            def canonize(headline):
-                return (tuple(headline[0].lower().split()), headline[1])
-            oldheadlines = set(map(canonize, oldheadlines))
-            for (i, headline) in enumerate(newheadlines):
-                if canonize(headline) in oldheadlines:
-                    newheadlines[i] = None
-            newheadlines = filter(None, newheadlines) # Removes Nones.
-            if newheadlines:
-                for channel in channels:
-                    bold = self.registryValue('bold', channel)
-                    sep = self.registryValue('headlineSeparator', channel)
-                    prefix = self.registryValue('announcementPrefix', channel)
-                    pre = format('%s%s: ', prefix, name)
-                    if bold:
-                        pre = ircutils.bold(pre)
-                        sep = ircutils.bold(sep)
-                    headlines = self.buildHeadlines(newheadlines, channel)
-                    irc.replies(headlines, prefixer=pre, joiner=sep,
-                                to=channel, prefixNick=False, private=True)
-        finally:
-            self.releaseLock(url)
-
-    def willGetNewFeed(self, url):
+            seen = self.seen[url]
+        except KeyError:
+            self.seen[url] = current
+            return []
+        self.seen[url] = current
+        return [headline for headline in headlines
+                if canonize(headline) not in seen]
+
+    def _announceFeed(self, url):
+        try:
+            (name, targets) = self.announced[url]
+        except KeyError:
+            return # No longer announced.
+        feed = self.getFeed(url, self._getWaitPeriod(name))
+        headlines = self.getHeadlines(feed)
+        if len(headlines) == 1:
+            s = headlines[0][0]
+            if s in ('Timeout downloading feed.',
+                     'Unable to download feed.'):
+                self.log.debug('%s %u', s, url)
+                return
+        newheadlines = self._newHeadlines(url, headlines)
+        if not newheadlines:
+            return
+        for (irc, channel) in targets:
+            bold = self.registryValue('bold', channel)
+            sep = self.registryValue('headlineSeparator', channel)
+            prefix = self.registryValue('announcementPrefix', channel)
+            pre = format('%s%s: ', prefix, name)
+            if bold:
+                pre = ircutils.bold(pre)
+                sep = ircutils.bold(sep)
+            headlines = self.buildHeadlines(newheadlines, channel)
+            msg = ircmsgs.privmsg(channel, '', prefix=irc.prefix)
+            proxy = callbacks.SimpleProxy(irc, msg)
+            proxy.replies(headlines, prefixer=pre, joiner=sep, to=channel,
+                          prefixNick=False, private=True)
+
+    def willGetNewFeed(self, url, wait=None):
         now = time.time()
-        wait = self.registryValue('waitPeriod')
+        if wait is None:
+            wait = self.registryValue('waitPeriod')
         if url not in self.lastRequest or now - self.lastRequest[url] > wait:
             return True
         else:
@@ -219,7 +325,7 @@ class RSS(callbacks.Plugin):
     def releaseLock(self, url):
         self.locks[url].release()
 
-    def getFeed(self, url):
+    def getFeed(self, url, wait=None):
         def error(s):
             return {'items': [{'title': s}]}
         try:
@@ -227,10 +333,17 @@ class RSS(callbacks.Plugin):
             # malicious user could conceivably flood the bot with rss commands
             # and DoS the website in question.
             self.acquireLock(url)
-            if self.willGetNewFeed(url):
+            if self.willGetNewFeed(url, wait):
                 try:
                     self.log.debug('Downloading new feed from %u', url)
-                    results = feedparser.parse(url)
+                    if url in self.cachedFeeds:
+                        # We only ask for changes since our cached copy.
+                        etag = self.etags.get(url)
+                        modified = self.modified.get(url)
+                    else:
+                        etag = modified = None
+                    results = feedparser.parse(url, etag=etag,
+                                               modified=modified)
                     if 'bozo_exception' in results:
                         raise results['bozo_exception']
                 except sgmllib.SGMLParseError:
@@ -242,8 +355,13 @@ class RSS(callbacks.Plugin):
                     # These seem mostly harmless.  We'll need reports of a
                     # kind that isn't.
                     self.log.debug('Allowing bozo_exception %r through.', e)
-                if results.get('feed', {}):
+                if results.get('status') == 304:
+                    self.log.debug('%u has not changed.', url)
+                    self.lastRequest[url] = time.time()
+                elif results.get('feed', {}):
                     self.cachedFeeds[url] = results
+                    self.etags[url] = results.get('etag')
+                    self.modified[url] = results.get('modified')
                     self.lastRequest[url] = time.time()
                 else:
                     self.log.debug('Not caching results; feed is empty.')
@@ -301,6 +419,7 @@ class RSS(callbacks.Plugin):
         f = new.instancemethod(f, self, RSS)
         self.feedNames[name] = (url, f)
         self._registerFeed(name, url)
+        callbacks.commandIndex.addCommand(self, [name])
 
     def add(self, irc, msg, args, name, url):
         """<name> <url>
@@ -324,6 +443,7 @@ class RSS(callbacks.Plugin):
         del self.feedNames[name]
         conf.supybot.plugins.RSS.feeds().remove(name)
         conf.supybot.plugins.RSS.feeds.unregister(name)
+        callbacks.commandIndex.removeCommand(self, [name])
         irc.replySuccess()
     remove = wrap(remove, ['feedName'])
 
@@ -30,9 +30,55 @@
 
 from supybot.test import *
 
+import supybot.conf as conf
+import supybot.schedule as schedule
+
 url = 'http://www.advogato.org/rss/articles.xml'
+feedTemplate = """<?xml version="1.0"?>
+<rss version="2.0"><channel><title>Test</title>%s</channel></rss>
+"""
+itemTemplate = """<item><title>%s</title></item>"""
 class RSSTestCase(ChannelPluginTestCase):
     plugins = ('RSS','Plugin')
+    feedFilename = conf.supybot.directories.data.dirize('RSSTestCase.xml')
+    def writeFeed(self, *titles):
+        fd = file(self.feedFilename, 'w')
+        fd.write(feedTemplate % ''.join([itemTemplate % t for t in titles]))
+        fd.close()
+
+    def announceFeed(self):
+        announce = conf.supybot.plugins.RSS.announce.get(self.channel)
+        announce.setValue(set([self.feedFilename]))
+        cb = self.irc.getCallback('RSS')
+        cb._checkAnnouncements()
+        return cb
+
+    def testAnnouncesOnlyNewHeadlines(self):
+        self.writeFeed('foo', 'bar')
+        cb = self.announceFeed()
+        try:
+            # The first check just learns what's already in the feed.
+            cb._announceFeed(self.feedFilename)
+            self.assertEqual(self.irc.takeMsg(), None)
+            self.writeFeed('baz', 'foo', 'bar')
+            cb.lastRequest.clear()
+            cb._announceFeed(self.feedFilename)
+            m = self.irc.takeMsg()
+            self.assertEqual(m.args[0], self.channel)
+            self.failUnless('baz' in m.args[1])
+            self.failIf('foo' in m.args[1])
+        finally:
+            conf.supybot.plugins.RSS.announce.get(self.channel).setValue([])
+
+    def testAnnouncementsAreScheduled(self):
+        self.writeFeed('foo')
+        cb = self.announceFeed()
+        name = cb._feedEventName(self.feedFilename)
+        self.failUnless(name in schedule.schedule.events)
+        conf.supybot.plugins.RSS.announce.get(self.channel).setValue([])
+        cb._checkAnnouncements()
+        self.failIf(name in schedule.schedule.events)
+
     def testRssAddBadName(self):
         self.assertError('rss add "foo bar" %s' % url)
 
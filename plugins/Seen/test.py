@@ -56,6 +56,12 @@ class ChannelDBTestCase(ChannelPluginTestCase):
         self.assertRegexp('seen any %s' % self.nick,
                           '^%s was last seen' % self.nick)
 
+    def testAnyQuit(self):
+        prefix = 'qux!quux@corge'
+        self.irc.feedMsg(ircmsgs.join(self.channel, prefix=prefix))
+        self.irc.feedMsg(ircmsgs.quit('bye', prefix=prefix))
+        self.assertRegexp('seen any qux', 'qux has quit')
+
     def testSeen(self):
         self.assertNotError('seen last')
         self.assertNotError('list')
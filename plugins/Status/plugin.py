@@ -34,7 +34,9 @@ import threading
 
 import supybot.conf as conf
 import supybot.utils as utils
+import supybot.ircdb as ircdb
 import supybot.world as world
+import supybot.registry as registry
 from supybot.commands import *
 import supybot.callbacks as callbacks
 
@@ -76,6 +78,11 @@ class Status(callbacks.Plugin):
         L = [format('I am connected to %L.', networks)]
         if world.profiling:
             L.append('I am currently in code profiling mode.')
+            lookups = [format('%s (%.1f/s)', name, rate)
+                       for (name, rate) in registry.lookupReport(3)]
+            if lookups:
+                L.append(format('My most frequent registry lookups are %L.',
+                                lookups))
         irc.reply('  '.join(L))
     status = wrap(status)
 
@@ -89,9 +96,59 @@ class Status(callbacks.Plugin):
         s = format('I have spawned %n; %n %b still currently active: %L.',
                    (world.threadsSpawned, 'thread'),
                    (len(threads), 'thread'), len(threads), threads)
+        stats = callbacks.threadPool.stats()
+        s += format('  My command thread pool has %i of %n busy, with '
+                    '%n waiting; it has run %n (refusing %i), with an '
+                    'average wait of %.3f seconds and a utilization of '
+                    '%.1f%%.',
+                    stats['busy'], (stats['size'], 'worker'),
+                    (stats['queued'], 'job'), (stats['jobs'], 'job'),
+                    stats['rejected'], stats['averageWait'],
+                    stats['utilization'] * 100)
         irc.reply(s)
     threads = wrap(threads)
 
+    def _seconds(self, t):
+        if t < 1:
+            return '%.2fms' % (t * 1000)
+        return '%.2fs' % t
+
+    def latency(self, irc, msg, args, cb):
+        """[<plugin>]
+
+        Returns how long the plugins that have taken the longest on average
+        to handle messages on this network have taken, or, if <plugin> is
+        given, how long it's taken.
+        """
+        latencies = irc.getRealIrc().getLatencies()
+        if cb is None:
+            L = [(h.average(), name) for (name, h) in latencies.iteritems()
+                 if len(h)]
+            L.sort()
+            L.reverse()
+            L = ['%s (%s)' % (name, self._seconds(t)) for (t, name) in L[:10]]
+            if not L:
+                irc.reply('No plugins have handled any messages yet.')
+            else:
+                irc.reply(format('Slowest on average: %L.', L))
+            return
+        name = cb.name()
+        h = latencies.get(name)
+        if not h:
+            irc.reply(format('%s hasn\'t handled any messages yet.', name))
+            return
+        L = []
+        for (bound, count) in h.buckets():
+            if bound is None:
+                L.append(format('%i over %s', count,
+                                self._seconds(h.bounds[-1])))
+            else:
+                L.append(format('%i under %s', count, self._seconds(bound)))
+        irc.reply(format('%s has handled %n, taking %s on average and %s at '
+                         'most: %L.', name, (len(h), 'message'),
+                         self._seconds(h.average()), self._seconds(h.max), L))
+    latency = wrap(latency, [optional('plugin')])
+
     def net(self, irc, msg, args):
         """takes no arguments
 
@@ -167,10 +224,20 @@ class Status(callbacks.Plugin):
             if isinstance(cb, callbacks.Plugin):
                 callbacksPlugin += 1
                 commands += len(cb.listCommands())
-        s = format('I offer a total of %n in %n.  I have processed %n.',
+        s = format('I offer a total of %n in %n.  I have processed %n.  '
+                   '%.1f%% of capability checks were answered from the '
+                   'cache.',
                    (commands, 'command'),
                    (callbacksPlugin, 'command-based', 'plugin'),
-                   (world.commandsProcessed, 'command'))
+                   (world.commandsProcessed, 'command'),
+                   ircdb.capabilityCache.hitRatio() * 100)
+        stats = callbacks.mores.stats()
+        s += format('  I am keeping mores of %n in %n, taking %n; %i '
+                    'have expired and %i were forgotten to make room.',
+                    (stats['replies'], 'reply'),
+                    (stats['entries'], 'entry'),
+                    (stats['bytes'], 'byte'),
+                    stats['expired'], stats['evicted'])
         irc.reply(s)
     cmd = wrap(cmd)
 
@@ -71,6 +71,11 @@ class StatusTestCase(PluginTestCase):
     def testThreads(self):
         self.assertNotError('threads')
 
+    def testLatency(self):
+        self.assertRegexp('latency', 'No plugins')
+        self.assertRegexp('latency', 'Slowest on average: .*Status')
+        self.assertRegexp('latency Status', 'Status has handled')
+
 
 # vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
 
@@ -58,11 +58,19 @@ class DbiUrlDB(plugins.DbiChannelDB):
 
 URLDB = plugins.DB('URL', {'flat': DbiUrlDB})
 
+urlLiteral = utils.str.requiredLiteral(utils.web.urlRe.pattern,
+                                      utils.web.urlRe.flags)
+
 class URL(callbacks.Plugin):
     def __init__(self, irc):
         self.__parent = super(URL, self)
         self.__parent.__init__(irc)
         self.db = URLDB()
+        callbacks.snarfFilter.add(urlLiteral)
+
+    def die(self):
+        callbacks.snarfFilter.remove(urlLiteral)
+        self.__parent.die()
 
     def doPrivmsg(self, irc, msg):
         channel = msg.args[0]
@@ -71,6 +79,8 @@ class URL(callbacks.Plugin):
                 text = ircmsgs.unAction(msg)
             else:
                 text = msg.args[1]
+            if urlLiteral not in callbacks.snarfFilter.found(text):
+                return
             for url in utils.web.urlRe.findall(text):
                 r = self.registryValue('nonSnarfingRegexp', channel)
                 if r and r.search(url):
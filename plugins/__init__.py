@@ -34,6 +34,7 @@ import re
 import csv
 import sys
 import math
+import marshal
 import time
 import random
 import fnmatch
@@ -196,19 +197,39 @@ class ChannelDBHandler(object):
 class DbiChannelDB(object):
     """This just handles some of the general stuff for Channel DBI databases.
     Check out ChannelIdDatabasePlugin for an example of how to use this."""
-    def __init__(self, filename):
+    Mapping = None # Use self.DB's default.
+    def __init__(self, filename, Mapping=None):
         self.filename = filename
         self.dbs = ircutils.IrcDict()
+        if Mapping is not None:
+            self.Mapping = Mapping
 
     def _getDb(self, channel):
         filename = makeChannelFilename(self.filename, channel)
         try:
             db = self.dbs[channel]
         except KeyError:
-            db = self.DB(filename)
+            if self.Mapping is None:
+                db = self.DB(filename)
+            elif self.Mapping == 'indexed':
+                db = self._openIndexedDb(filename)
+            else:
+                db = self.DB(filename, Mapping=self.Mapping)
             self.dbs[channel] = db
         return db
 
+    def _openIndexedDb(self, filename):
+        # The first time an indexed database is opened, we import the
+        # records of the flat database it replaces.
+        flatFilename = None
+        if not os.path.exists(filename) and filename.endswith('.indexed.db'):
+            flatFilename = filename[:-len('indexed.db')] + 'flat.db'
+        db = self.DB(filename, Mapping='indexed')
+        if flatFilename is not None and os.path.exists(flatFilename):
+            log.info('Importing %s into %s.', flatFilename, filename)
+            db.map.importFlatfile(flatFilename)
+        return db
+
     def close(self):
         for db in self.dbs.itervalues():
             db.close()
@@ -257,9 +278,45 @@ class ChannelUserDictionary(UserDict.DictMixin):
 #     would very much feel like an extension, rather than part of the db
 #     itself.
 class ChannelUserDB(ChannelUserDictionary):
+    """A ChannelUserDictionary kept on disk as a snapshot plus a log of the
+    changes made since the snapshot was written.
+
+    Flushing only appends the entries that changed to the log; once the log
+    has grown big enough, a background thread folds it into a new snapshot.
+    Subclasses whose values are changed in place rather than reassigned
+    should set mutable to True, so every entry that's looked up is written
+    out on the next flush.
+    """
+    mutable = False
+    # The log isn't compacted until it's at least this big, and half as big
+    # as the snapshot.
+    compactionSize = 1 << 20
+    recordsPerChunk = 10000
     def __init__(self, filename):
         ChannelUserDictionary.__init__(self)
         self.filename = filename
+        self.snapshotFilename = filename + '.snapshot'
+        self.logFilename = filename + '.log'
+        self.oldLogFilename = filename + '.log.old'
+        self.dirty = set()
+        self.compactor = None
+        filenames = (self.snapshotFilename,
+                     self.oldLogFilename,
+                     self.logFilename)
+        if utils.iter.any(os.path.exists, filenames):
+            for filename in filenames:
+                self._replay(filename)
+            # An earlier compaction may not have finished.
+            self._compactLater()
+        elif os.path.exists(self.filename):
+            self._readCsv()
+            if self:
+                self._writeSnapshot(self._records(self.keys()))
+                log.info('Converted %s to %s.',
+                         self.filename, self.snapshotFilename)
+
+    def _readCsv(self):
+        # The format this database used to be kept in.
         try:
             fd = file(self.filename)
         except EnvironmentError, e:
@@ -279,7 +336,7 @@ class ChannelUserDB(ChannelUserDictionary):
                         # We'll skip over this so, say, nicks can be kept here.
                         pass
                     v = self.deserialize(channel, id, t)
-                    self[channel, id] = v
+                    ChannelUserDictionary.__setitem__(self, (channel, id), v)
                 except Exception, e:
                     log.warning('Invalid line #%s in %s.',
                                 lineno, self.__class__.__name__)
@@ -288,27 +345,166 @@ class ChannelUserDB(ChannelUserDictionary):
             log.warning('Invalid line #%s in %s.',
                         lineno, self.__class__.__name__)
             log.debug('Exception: %s', utils.exnToString(e))
+        fd.close()
 
-    def flush(self):
-        fd = utils.file.AtomicFile(self.filename, makeBackupIfSmaller=False)
-        writer = csv.writer(fd)
-        items = self.items()
-        if not items:
-            log.debug('%s: Refusing to write blank file.',
-                      self.__class__.__name__)
-            fd.rollback()
+    def _chunks(self, filename):
+        """Yields the lists of records in the given snapshot or log.  A
+        damaged log (say, from a crash in the middle of a flush) is truncated
+        to the last good list."""
+        try:
+            fd = file(filename, 'rb')
+        except EnvironmentError, e:
+            if os.path.exists(filename):
+                log.warning('Couldn\'t open %s: %s.', filename, e)
             return
-        items.sort()
-        for ((channel, id), v) in items:
-            L = self.serialize(v)
-            L.insert(0, id)
-            L.insert(0, channel)
-            writer.writerow(L)
+        try:
+            size = os.fstat(fd.fileno()).st_size
+            while fd.tell() < size:
+                pos = fd.tell()
+                try:
+                    records = marshal.load(fd)
+                except (EOFError, ValueError, TypeError):
+                    log.warning('Invalid data at byte %s of %s, ignoring the '
+                                'rest of it.', pos, filename)
+                    if filename == self.logFilename:
+                        fd.close()
+                        fd = file(filename, 'r+b')
+                        fd.truncate(pos)
+                    break
+                yield records
+        finally:
+            fd.close()
+
+    def _replay(self, filename):
+        # Records come grouped by channel, so we only look up each channel's
+        # dictionary when the channel changes.
+        lastChannel = ids = None
+        for records in self._chunks(filename):
+            for (channel, id, L) in records:
+                if channel != lastChannel:
+                    lastChannel = channel
+                    try:
+                        ids = self.channels[channel]
+                    except KeyError:
+                        ids = self.channels[channel] = self.IdDict()
+                if L is None:
+                    try:
+                        del ids[id]
+                    except KeyError:
+                        pass
+                    continue
+                try:
+                    ids[id] = self.deserialize(channel, id, L)
+                except Exception, e:
+                    log.warning('Invalid entry for %s in %s in %s.',
+                                id, channel, filename)
+                    log.debug('Exception: %s', utils.exnToString(e))
+
+    def _records(self, keys):
+        """Returns the records to write for the given keys: (channel, id, L)
+        where L is the serialized value (as strings, like csv would write
+        them) or None if the key has been deleted."""
+        records = []
+        for (channel, id) in keys:
+            try:
+                v = ChannelUserDictionary.__getitem__(self, (channel, id))
+            except KeyError:
+                records.append((channel, id, None))
+                continue
+            L = []
+            for x in self.serialize(v):
+                if isinstance(x, float):
+                    x = repr(x)
+                elif not isinstance(x, basestring):
+                    x = str(x)
+                L.append(x)
+            records.append((channel, id, L))
+        return records
+
+    def _writeSnapshot(self, records):
+        fd = utils.file.AtomicFile(self.snapshotFilename, 'wb',
+                                   makeBackupIfSmaller=False)
+        try:
+            for i in xrange(0, len(records), self.recordsPerChunk):
+                marshal.dump(records[i:i+self.recordsPerChunk], fd)
+        except:
+            fd.rollback()
+            raise
         fd.close()
 
+    def _compact(self):
+        # This runs in its own thread, so it works only from the files, not
+        # from the (changing) dictionary: the new snapshot is the old one
+        # with the old log applied to it.
+        try:
+            d = ChannelUserDictionary()
+            d.IdDict = self.IdDict
+            for filename in (self.snapshotFilename, self.oldLogFilename):
+                for records in self._chunks(filename):
+                    for (channel, id, L) in records:
+                        if L is None:
+                            try:
+                                del d[channel, id]
+                            except KeyError:
+                                pass
+                        else:
+                            d[channel, id] = L
+            self._writeSnapshot([(channel, id, L)
+                                 for ((channel, id), L) in d.iteritems()])
+            os.remove(self.oldLogFilename)
+        except Exception:
+            log.exception('Uncaught exception compacting %s:', self.filename)
+
+    def _compactLater(self):
+        if self.compactor is not None and self.compactor.isAlive():
+            return
+        if not os.path.exists(self.oldLogFilename):
+            try:
+                size = os.path.getsize(self.logFilename)
+            except OSError:
+                return
+            try:
+                snapshotSize = os.path.getsize(self.snapshotFilename)
+            except OSError:
+                snapshotSize = 0
+            if size < max(self.compactionSize, snapshotSize // 2):
+                return
+            os.rename(self.logFilename, self.oldLogFilename)
+        name = 'Compacting %s' % os.path.basename(self.filename)
+        self.compactor = threading.Thread(target=self._compact, name=name)
+        self.compactor.setDaemon(True)
+        self.compactor.start()
+
+    def __getitem__(self, key):
+        v = ChannelUserDictionary.__getitem__(self, key)
+        if self.mutable:
+            self.dirty.add(key)
+        return v
+
+    def __setitem__(self, key, v):
+        ChannelUserDictionary.__setitem__(self, key, v)
+        self.dirty.add(key)
+
+    def __delitem__(self, key):
+        ChannelUserDictionary.__delitem__(self, key)
+        self.dirty.add(key)
+
+    def flush(self):
+        if self.dirty:
+            records = self._records(self.dirty)
+            self.dirty.clear()
+            fd = file(self.logFilename, 'ab')
+            try:
+                marshal.dump(records, fd)
+            finally:
+                fd.close()
+        self._compactLater()
+
     def close(self):
         self.flush()
-        self.clear()
+        if self.compactor is not None:
+            self.compactor.join()
+        self.channels.clear()
 
     def deserialize(self, channel, id, L):
         """Should take a list of strings and return an object to be accessed
@@ -346,7 +542,11 @@ class ChannelIdDatabasePlugin(callbacks.Plugin):
     def __init__(self, irc):
         self.__parent = super(ChannelIdDatabasePlugin, self)
         self.__parent.__init__(irc)
-        self.db = DB(self.name(), {'flat': self.DB})()
+        self.db = DB(self.name(), {'flat': self.DB,
+                                   'indexed': self._makeIndexedDb})()
+
+    def _makeIndexedDb(self, filename):
+        return self.DB(filename, Mapping='indexed')
 
     def die(self):
         self.db.close()
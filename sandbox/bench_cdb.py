@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+
+"""
+Builds a CDB with a large number of keys and times random lookups with the
+memory-mapped cdb.Reader, its getMany, and the seek-and-read reader it
+replaced.
+
+Usage: bench_cdb.py [number of keys] [number of lookups]
+"""
+
+import os
+import sys
+import time
+import random
+import tempfile
+
+import supybot.cdb as cdb
+
+class FileReader(object):
+    """The old cdb.Reader lookup path: a seek and read for every probe."""
+    def __init__(self, filename):
+        self.fd = file(filename, 'rb')
+
+    def close(self):
+        self.fd.close()
+
+    def _read(self, len, pos):
+        self.fd.seek(pos)
+        return self.fd.read(len)
+
+    def __getitem__(self, key):
+        khash = cdb.hash(key)
+        (hpos, hslots) = cdb.unpack2Ints(self._read(8, (khash * 8) & 2047))
+        if hslots:
+            kpos = hpos + (((khash / 256) % hslots) * 8)
+            for _ in xrange(hslots):
+                (h, p) = cdb.unpack2Ints(self._read(8, kpos))
+                if p == 0:
+                    break
+                kpos += 8
+                if kpos == hpos + (hslots * 8):
+                    kpos = hpos
+                if h == khash:
+                    (u, dlen) = cdb.unpack2Ints(self._read(8, p))
+                    if u == len(key) and self._read(u, p+8) == key:
+                        return self._read(dlen, p + 8 + u)
+        raise KeyError, key
+
+def bench(n, lookups):
+    (fd, filename) = tempfile.mkstemp()
+    os.close(fd)
+    try:
+        start = time.time()
+        maker = cdb.Maker(filename)
+        for i in xrange(n):
+            maker.add('key%s' % i, 'value%s' % i)
+        maker.finish()
+        print 'Built %s keys (%s bytes) in %.2fs.' % \
+              (n, os.path.getsize(filename), time.time() - start)
+        keys = ['key%s' % random.randrange(n * 2) for _ in xrange(lookups)]
+        results = []
+        def timeit(name, f):
+            start = time.time()
+            ret = f()
+            elapsed = time.time() - start
+            results.append((name, elapsed))
+            return ret
+
+        old = FileReader(filename)
+        def oldLookups():
+            L = []
+            for key in keys:
+                try:
+                    L.append(old[key])
+                except KeyError:
+                    L.append(None)
+            return L
+        expected = timeit('seek/read reader', oldLookups)
+        old.close()
+
+        reader = cdb.Reader(filename)
+        def newLookups():
+            return [reader.get(key) for key in keys]
+        assert timeit('mmap reader', newLookups) == expected
+        assert timeit('mmap reader, getMany',
+                      lambda: reader.getMany(keys)) == expected
+        reader.close()
+
+        for (name, elapsed) in results:
+            print '%-22s %8.3fs %8.2fus/lookup' % \
+                  (name, elapsed, elapsed*1e6/lookups)
+    finally:
+        os.remove(filename)
+
+if __name__ == '__main__':
+    n = 1000000
+    lookups = 200000
+    if len(sys.argv) > 1:
+        n = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        lookups = int(sys.argv[2])
+    bench(n, lookups)
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
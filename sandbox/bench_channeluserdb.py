@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+
+"""
+Times flushing a Seen-like ChannelUserDB after a few changes, and opening it
+again, against rewriting and rereading the whole database as csv the way it
+used to be kept.
+
+Usage: bench_channeluserdb.py [number of entries] [number of changes]
+"""
+
+import os
+import sys
+import csv
+import time
+import shutil
+import tempfile
+
+import supybot.plugins as plugins
+
+class SeenDB(plugins.ChannelUserDB):
+    def serialize(self, v):
+        return list(v)
+
+    def deserialize(self, channel, id, L):
+        (seen, saying) = L
+        return (float(seen), saying)
+
+def writeCsv(db, filename):
+    # What ChannelUserDB.flush used to do.
+    fd = file(filename, 'wb')
+    writer = csv.writer(fd)
+    items = db.items()
+    items.sort()
+    for ((channel, id), v) in items:
+        L = db.serialize(v)
+        L.insert(0, id)
+        L.insert(0, channel)
+        writer.writerow(L)
+    fd.close()
+
+def timed(f, *args):
+    start = time.time()
+    result = f(*args)
+    return (time.time() - start, result)
+
+def bench(nEntries, nChanges):
+    dir = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(dir, 'Seen.db')
+        db = SeenDB(filename)
+        now = time.time()
+        for i in xrange(nEntries):
+            db['#chan%s' % (i % 100), 'nick%s' % i] = \
+                (now + i, '<nick%s> something or other, number %s' % (i, i))
+        # Start from a snapshot, as a database that's been running a while
+        # would.
+        db.compactionSize = 0
+        db.flush()
+        db.compactor.join()
+        db.compactionSize = plugins.ChannelUserDB.compactionSize
+        for i in xrange(nChanges):
+            j = i * 7 % nEntries
+            db['#chan%s' % (j % 100), 'nick%s' % j] = (now, 'changed')
+        (csvFlush, _) = timed(writeCsv, db, filename)
+        (logFlush, _) = timed(db.flush)
+        db.close()
+        old = SeenDB(os.path.join(dir, 'nonexistent'))
+        old.filename = filename
+        (csvOpen, _) = timed(old._readCsv)
+        assert len(old) == nEntries
+        (snapshotOpen, new) = timed(SeenDB, filename)
+        assert len(new) == nEntries
+        new.close()
+        print '%s entries, %s changed:' % (nEntries, nChanges)
+        print '    flush: %8.3fs csv, %8.3fs log' % (csvFlush, logFlush)
+        print '    open:  %8.3fs csv, %8.3fs snapshot' % \
+              (csvOpen, snapshotOpen)
+    finally:
+        shutil.rmtree(dir)
+
+if __name__ == '__main__':
+    nEntries = 500000
+    nChanges = 1000
+    if len(sys.argv) > 1:
+        nEntries = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        nChanges = int(sys.argv[2])
+    bench(nEntries, nChanges)
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
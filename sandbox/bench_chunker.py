@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+
+"""
+Times splitting a large reply into chunks for the more command: all at once
+with textwrap (which is how ircutils.wrap used to do it), and with
+ircutils.WrappedText, for just the first chunk, the first chunk and its
+"(N more messages)" count, and every chunk.
+
+Usage: bench_chunker.py [reply size in bytes] [chunk length]
+"""
+
+import sys
+import time
+import random
+import textwrap
+
+import supybot.ircutils as ircutils
+
+def textwrapWrap(s, length):
+    processed = []
+    chunks = textwrap.wrap(s, length)
+    context = None
+    for chunk in chunks:
+        if context is not None:
+            chunk = context.start(chunk)
+        context = ircutils.FormatParser(chunk).parse()
+        processed.append(context.end(chunk))
+    return processed
+
+def reply(size):
+    random.seed(0)
+    words = ('the quick brown fox jumps over the lazy dog and then some '
+             'more words to make a realistic reply').split()
+    words.append(ircutils.bold('bold'))
+    L = []
+    total = 0
+    while total < size:
+        word = random.choice(words)
+        L.append(word)
+        total += len(word) + 1
+    return ' '.join(L)[:size]
+
+def bench(size, length):
+    s = reply(size)
+    def textwrapAll():
+        return len(textwrapWrap(s, length))
+    def first():
+        ircutils.WrappedText(s, length).pop()
+        return 1
+    def firstAndCount():
+        chunks = ircutils.WrappedText(s, length)
+        chunks.pop()
+        return len(chunks) + 1
+    def all():
+        chunks = ircutils.WrappedText(s, length)
+        n = 0
+        while chunks:
+            chunks.pop()
+            n += 1
+        return n
+    for f in (textwrapAll, first, firstAndCount, all):
+        start = time.time()
+        n = f()
+        print '%-14s %8.4fs (%s chunks)' % (f.__name__, time.time()-start, n)
+
+if __name__ == '__main__':
+    size = 1024*1024
+    length = 400
+    if len(sys.argv) > 1:
+        size = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        length = int(sys.argv[2])
+    bench(size, length)
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+
+"""
+Loads a number of plugins with a handful of commands each and times finding
+the callbacks for commands with the command index, and with the scan of every
+callback it replaced.
+
+Usage: bench_dispatch.py [number of plugins] [number of dispatches]
+"""
+
+import sys
+import time
+import random
+
+import supybot.callbacks as callbacks
+
+def command(self, irc, msg, args):
+    pass
+
+def makePlugin(i, commands):
+    d = {}
+    for name in commands:
+        d[name] = command
+    # A nested command group, like RSS's announce.
+    d['group%s' % i] = type('group%s' % i, (callbacks.Commands,),
+                            {'list': command, 'add': command})
+    return type('Plugin%s' % i, (callbacks.Commands,), d)()
+
+class FakeIrc(object):
+    def __init__(self, callbacks):
+        self.callbacks = callbacks
+
+    def getCallback(self, name):
+        name = name.lower()
+        for cb in self.callbacks:
+            if cb.name().lower() == name:
+                return cb
+        return None
+
+class FakeProxy(object):
+    def __init__(self, irc):
+        self.irc = irc
+
+def scan(irc, args):
+    """The old findCallbacksForArgs, minus the defaultPlugins handling."""
+    args = map(callbacks.canonicalName, args)
+    cbs = []
+    maxL = []
+    for cb in irc.callbacks:
+        if not hasattr(cb, 'getCommand'):
+            continue
+        L = cb.getCommand(args)
+        if L and L >= maxL:
+            maxL = L
+            cbs.append((cb, L))
+    return (maxL, [cb for (cb, L) in cbs if L == maxL])
+
+def bench(n, dispatches):
+    cbs = []
+    for i in xrange(n):
+        cbs.append(makePlugin(i, ['cmd%s' % j for j in xrange(i, i+10)]))
+    irc = FakeIrc(cbs)
+    proxy = FakeProxy(irc)
+    find = callbacks.NestedCommandsIrcProxy.findCallbacksForArgs.im_func
+    commands = []
+    for _ in xrange(dispatches):
+        i = random.randrange(n)
+        commands.append(random.choice([['cmd%s' % (i+9), 'arg'],
+                                       ['plugin%s' % i, 'cmd%s' % i],
+                                       ['group%s' % i, 'list'],
+                                       ['nosuchcommand']]))
+    results = []
+    def timeit(name, f):
+        start = time.time()
+        ret = [f(args) for args in commands]
+        elapsed = time.time() - start
+        results.append((name, elapsed))
+        return ret
+    expected = timeit('scan', lambda args: scan(irc, args))
+    find(proxy, ['cmd0']) # Build the index, so we time only dispatches.
+    assert timeit('index', lambda args: find(proxy, args)) == expected
+    for (name, elapsed) in results:
+        print '%-8s %8.3fs %8.2fus/dispatch' % \
+              (name, elapsed, elapsed*1e6/dispatches)
+
+if __name__ == '__main__':
+    n = 60
+    dispatches = 10000
+    if len(sys.argv) > 1:
+        n = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        dispatches = int(sys.argv[2])
+    bench(n, dispatches)
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
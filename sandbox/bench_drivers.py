@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+
+"""
+Replays a burst of IRC traffic through the socket drivers' line framing and
+drivers.parseMsg, comparing the old string-concatenation framing with
+drivers.ReadBuffer, and sends the same burst through a slow socket, comparing
+the old reslicing output buffer with drivers.WriteBuffer.
+
+Usage: bench_drivers.py [capture file]
+
+The capture file should contain raw lines as received from a server; if none
+is given, a synthetic 100k-line netsplit/NAMES/WHO burst is used.
+"""
+
+import sys
+import time
+
+import supybot.drivers as drivers
+
+def syntheticBurst(n=100000):
+    lines = []
+    for i in xrange(n):
+        nick = 'nick%s' % i
+        kind = i % 4
+        if kind == 0:
+            lines.append(':irc.server.net 353 bot = #chan :%s @op%s +v%s' %
+                         (nick, i, i))
+        elif kind == 1:
+            lines.append(':irc.server.net 352 bot #chan ~%s host%s.example.com'
+                         ' irc.server.net %s H :0 Real Name' % (nick, i, nick))
+        elif kind == 2:
+            lines.append(':%s!~user@host%s.example.com QUIT :a.net b.net' %
+                         (nick, i))
+        else:
+            lines.append(':%s!~user@host%s.example.com PRIVMSG #chan :hi %s' %
+                         (nick, i, 'x' * (i % 200)))
+    return '\r\n'.join(lines) + '\r\n'
+
+class ReplaySocket(object):
+    def __init__(self, data):
+        self.data = data
+        self.i = 0
+
+    def recv(self, n):
+        s = self.data[self.i:self.i+n]
+        self.i += len(s)
+        return s
+
+    def recv_into(self, view):
+        s = self.recv(len(view))
+        view[:len(s)] = s
+        return len(s)
+
+class SlowSocket(object):
+    """A socket that only accepts a few kilobytes per send."""
+    def send(self, s):
+        return min(len(s), 4096)
+
+def oldFraming(data):
+    conn = ReplaySocket(data)
+    inbuffer = ''
+    n = 0
+    while True:
+        s = conn.recv(1024)
+        if not s:
+            break
+        inbuffer += s
+        lines = inbuffer.split('\n')
+        inbuffer = lines.pop()
+        for line in lines:
+            if drivers.parseMsg(line) is not None:
+                n += 1
+    return n
+
+def newFraming(data, size=8192):
+    conn = ReplaySocket(data)
+    buf = drivers.ReadBuffer(size)
+    n = 0
+    while buf.recvFrom(conn):
+        for line in buf.lines():
+            if drivers.parseMsg(line) is not None:
+                n += 1
+    return n
+
+def oldSending(data):
+    conn = SlowSocket()
+    outbuffer = data
+    while outbuffer:
+        sent = conn.send(outbuffer)
+        outbuffer = outbuffer[sent:]
+    return data.count('\n')
+
+def newSending(data):
+    conn = SlowSocket()
+    buf = drivers.WriteBuffer()
+    for line in data.splitlines(True):
+        buf.append(line)
+    while buf:
+        buf.send(conn)
+    return data.count('\n')
+
+def timeit(name, f, *args):
+    start = time.time()
+    n = f(*args)
+    elapsed = time.time() - start
+    print '%-28s %8d lines %8.3fs %10.0f lines/s' % \
+          (name, n, elapsed, n / elapsed)
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        data = open(sys.argv[1], 'rb').read()
+    else:
+        data = syntheticBurst()
+    print 'Replaying %s bytes.' % len(data)
+    timeit('old (1024 byte reads)', oldFraming, data)
+    for size in (1024, 8192, 65536):
+        timeit('ReadBuffer (%s bytes)' % size, newFraming, data, size)
+    timeit('old sending', oldSending, data)
+    timeit('WriteBuffer', newSending, data)
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
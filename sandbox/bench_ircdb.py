@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+
+"""
+Builds a synthetic user database and times hostmask lookups through
+ircdb.UsersDictionary.getUserId, with and without its hostmask index.
+
+Usage: bench_ircdb.py [number of users]
+"""
+
+import sys
+import time
+import random
+
+import supybot.ircdb as ircdb
+
+def patterns(i):
+    return ['*!*@*.host%s.isp%s.net' % (i, i % 100),
+            'nick%s-*!~user%s@*' % (i, i),
+            '*!*@192.%s.%s.*' % (i // 256 % 256, i % 256)]
+
+def hostmasks(i):
+    return ['someone!~x@a.host%s.isp%s.net' % (i, i % 100),
+            'nick%s-away!~user%s@example.com' % (i, i),
+            'x!y@192.%s.%s.1' % (i // 256 % 256, i % 256)]
+
+def build(n):
+    users = ircdb.UsersDictionary()
+    for i in xrange(1, n+1):
+        u = ircdb.IrcUser(name='user%s' % i)
+        u.id = i
+        for pattern in patterns(i):
+            u.addHostmask(pattern)
+        users.setUser(u, flush=False)
+    return users
+
+def scan(users, s):
+    # What getUserId did before it had an index.
+    ids = []
+    for (id, user) in users.users.iteritems():
+        if user.checkHostmask(s):
+            ids.append(id)
+    return ids
+
+def timeit(name, f, samples):
+    start = time.time()
+    for s in samples:
+        f(s)
+    elapsed = time.time() - start
+    print '%-30s %8.3fs %10.1fus/lookup' % \
+          (name, elapsed, elapsed * 1e6 / len(samples))
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        n = int(sys.argv[1])
+    else:
+        n = 50000
+    start = time.time()
+    users = build(n)
+    print 'Built %s users in %.2fs.' % (n, time.time() - start)
+    hits = [random.choice(hostmasks(random.randint(1, n)))
+            for _ in xrange(10000)]
+    misses = ['stranger%s!~who@unknown%s.example.org' % (i, i)
+              for i in xrange(10000)]
+    def lookup(s):
+        users._hostmaskCache.clear() # Measure the index, not the cache.
+        try:
+            users.getUserId(s)
+        except KeyError:
+            pass
+    timeit('getUserId (hits)', lookup, hits)
+    timeit('getUserId (misses)', lookup, misses)
+    # The negative cache only holds so many hostmasks.
+    timeit('getUserId (repeated misses)', lookup, misses[:500] * 20)
+    timeit('full scan (hits, 3 only)', lambda s: scan(users, s), hits[:3])
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
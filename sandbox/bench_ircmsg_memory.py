@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+
+"""
+Parses a number of IRC lines like the ones a busy network sends, keeps the
+resulting IrcMsgs around (like IrcState.history and plugins do), and reports
+how much memory each message costs.
+
+Usage: bench_ircmsg_memory.py [number of lines]
+"""
+
+import gc
+import sys
+import time
+import random
+
+import supybot.ircmsgs as ircmsgs
+
+def rss():
+    """Returns the resident set size of this process, in bytes."""
+    for line in open('/proc/self/status'):
+        if line.startswith('VmRSS:'):
+            return int(line.split()[1]) * 1024
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def lines(n):
+    random.seed(0)
+    nicks = ['user%s' % i for i in xrange(2000)]
+    channels = ['#channel%s' % i for i in xrange(50)]
+    words = ('the quick brown fox jumps over the lazy dog and then some '
+             'more words to make lines of a realistic length').split()
+    for _ in xrange(n):
+        nick = random.choice(nicks)
+        prefix = '%s!~%s@host-%s.example.com' % (nick, nick, len(nick))
+        channel = random.choice(channels)
+        r = random.random()
+        if r < 0.85:
+            text = ' '.join(random.sample(words, random.randrange(3, 15)))
+            yield ':%s PRIVMSG %s :%s\r\n' % (prefix, channel, text)
+        elif r < 0.9:
+            yield ':%s JOIN :%s\r\n' % (prefix, channel)
+        elif r < 0.95:
+            yield ':%s PART %s :Leaving\r\n' % (prefix, channel)
+        else:
+            yield ':%s MODE %s +v %s\r\n' % (prefix, channel,
+                                             random.choice(nicks))
+
+def bench(n):
+    gc.collect()
+    before = rss()
+    start = time.time()
+    msgs = []
+    for line in lines(n):
+        msg = ircmsgs.IrcMsg(line)
+        msg.nick # IrcState.addMsg asks every message for its nick.
+        msgs.append(msg)
+    elapsed = time.time() - start
+    gc.collect()
+    used = rss() - before
+    print '%s messages in %.2fs, %.1f bytes/message' % \
+          (n, elapsed, float(used) / n)
+
+if __name__ == '__main__':
+    n = 1000000
+    if len(sys.argv) > 1:
+        n = int(sys.argv[1])
+    bench(n)
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+
+"""
+Gives a number of distinct users a long reply each, keeping the rest of the
+replies for the more command the way NestedCommandsIrcProxy does, and reports
+memory use as the users come in: first with an IrcDict of ircutils.wrap's
+chunks (which is how mores used to be kept), then with a MoreStore.
+
+Usage: bench_mores.py [number of users]
+"""
+
+import gc
+import sys
+import time
+import random
+
+import supybot.ircutils as ircutils
+import supybot.callbacks as callbacks
+
+def rss():
+    """Returns the resident set size of this process, in bytes."""
+    for line in open('/proc/self/status'):
+        if line.startswith('VmRSS:'):
+            return int(line.split()[1]) * 1024
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+words = ('the quick brown fox jumps over the lazy dog and then some '
+         'more words to make replies of a realistic length').split()
+
+def replies(n):
+    random.seed(0)
+    for i in xrange(n):
+        mask = '~user%s@host-%s.example.com' % (i, i)
+        reply = ' '.join([random.choice(words)
+                          for _ in xrange(random.randrange(100, 1000))])
+        yield (mask, 'user%s' % i, reply)
+
+def unbounded(mask, nick, reply, d):
+    msgs = ircutils.wrap(reply, 400)
+    msgs.reverse()
+    msgs.pop()
+    d[mask] = msgs
+    d[nick] = (False, msgs)
+
+def store(mask, nick, reply, d):
+    msgs = ircutils.WrappedText(reply, 400)
+    msgs.pop()
+    d.put(mask, msgs)
+    d.put(nick, msgs, False)
+
+def bench(n):
+    for (f, d) in ((unbounded, ircutils.IrcDict()),
+                   (store, callbacks.MoreStore())):
+        gc.collect()
+        before = rss()
+        start = time.time()
+        for (i, (mask, nick, reply)) in enumerate(replies(n)):
+            f(mask, nick, reply, d)
+            if (i+1) % (n // 10) == 0:
+                print '%-10s %7s users: %8.1f MB' % \
+                      (f.__name__, i+1, (rss() - before) / 1048576.0)
+        print '%-10s %.2fs' % (f.__name__, time.time() - start)
+        d.clear()
+
+if __name__ == '__main__':
+    n = 100000
+    if len(sys.argv) > 1:
+        n = int(sys.argv[1])
+    bench(n)
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
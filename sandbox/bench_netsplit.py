@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+
+"""
+Replays a netsplit -- a large number of users quitting at once and then
+rejoining their channels -- through an IrcState, and times it with the nick
+index and with the scan of every channel it replaced.
+
+Usage: bench_netsplit.py [number of channels] [number of users]
+"""
+
+import sys
+import time
+import random
+
+import supybot.ircmsgs as ircmsgs
+import supybot.irclib as irclib
+
+class FakeIrc(object):
+    nick = 'supybot'
+
+class ScanState(irclib.IrcState):
+    """An IrcState that finds a nick's channels by scanning them all."""
+    def channelsOf(self, nick):
+        return [name for (name, chan) in self.channels.iteritems()
+                if nick in chan.users]
+
+def populate(state, channels, users):
+    irc = FakeIrc()
+    for channel in channels:
+        state.addMsg(irc, ircmsgs.join(channel, prefix='supybot!u@h'))
+    for (i, user) in enumerate(users):
+        # Most users are in a few channels; some are in many.
+        n = random.choice([1, 1, 2, 3, 5, len(channels) // 4 or 1])
+        for channel in random.sample(channels, n):
+            state.addMsg(irc, ircmsgs.join(channel, prefix=user))
+
+def bench(nChannels, nUsers):
+    channels = ['#chan%s' % i for i in xrange(nChannels)]
+    users = ['user%s!~u@host%s' % (i, i) for i in xrange(nUsers)]
+    random.seed(0)
+    initial = irclib.IrcState()
+    populate(initial, channels, users)
+    # Half the users split off, then come back (rejoining the channels they
+    # were in) and a few of them ghost their old nicks.
+    split = random.sample(users, nUsers // 2)
+    msgs = []
+    for user in split:
+        msgs.append(ircmsgs.IrcMsg(prefix=user, command='QUIT',
+                                   args=('*.net *.split',)))
+    for user in split:
+        nick = user.split('!')[0]
+        for channel in initial.channelsOf(nick):
+            msgs.append(ircmsgs.join(channel, prefix=user))
+        if random.random() < 0.1:
+            msgs.append(ircmsgs.IrcMsg(prefix=user, command='NICK',
+                                       args=(nick + '_',)))
+    irc = FakeIrc()
+    results = []
+    for cls in (ScanState, irclib.IrcState):
+        state = cls()
+        random.seed(0)
+        populate(state, channels, users)
+        start = time.time()
+        for msg in msgs:
+            state.addMsg(irc, msg)
+            state.whichChannelsHad(msg.nick)
+        elapsed = time.time() - start
+        results.append((cls.__name__, elapsed, state))
+    assert results[0][2] == results[1][2]
+    for (name, elapsed, _) in results:
+        print '%-10s %8.3fs %8.2fus/message' % \
+              (name, elapsed, elapsed*1e6/len(msgs))
+
+if __name__ == '__main__':
+    nChannels = 200
+    nUsers = 5000
+    if len(sys.argv) > 1:
+        nChannels = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        nUsers = int(sys.argv[2])
+    bench(nChannels, nUsers)
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
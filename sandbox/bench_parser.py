@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+
+"""
+Times parsing the lines in test/ircmsgs.txt (repeated to make up the number
+of lines asked for) one at a time through drivers.parseMsg, and in batches
+through drivers.parseLines with both the pure Python and compiled parsers.
+
+Usage: bench_parser.py [number of lines] [lines per batch]
+"""
+
+import os
+import sys
+import time
+
+import supybot.ircmsgs as ircmsgs
+import supybot.drivers as drivers
+
+def corpus():
+    filename = os.path.join(os.path.dirname(__file__), os.pardir,
+                            'test', 'ircmsgs.txt')
+    return [line.rstrip('\n') for line in open(filename)]
+
+def bench(n, batch):
+    lines = corpus()
+    lines = (lines * (n // len(lines) + 1))[:n]
+    buffers = ['\n'.join(lines[i:i+batch])
+               for i in xrange(0, len(lines), batch)]
+    results = []
+    def timeit(name, f):
+        start = time.time()
+        f()
+        results.append((name, time.time() - start))
+    def oneAtATime():
+        for line in lines:
+            drivers.parseMsg(line)
+    timeit('parseMsg', oneAtATime)
+    if hasattr(drivers, 'parseLines'):
+        def batches():
+            for buf in buffers:
+                drivers.parseLines(buf)
+        cParse = ircmsgs._cParse
+        ircmsgs._cParse = None
+        timeit('parseLines (Python)', batches)
+        ircmsgs._cParse = cParse
+        if cParse is not None:
+            timeit('parseLines (C)', batches)
+    for (name, elapsed) in results:
+        print '%-20s %8.3fs %8.2fus/line' % (name, elapsed, elapsed*1e6/n)
+
+if __name__ == '__main__':
+    n = 200000
+    batch = 20
+    if len(sys.argv) > 1:
+        n = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        batch = int(sys.argv[2])
+    bench(n, batch)
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+
+"""
+Runs a large number of timers through schedule.Schedule: adding them (one at
+a time and in bulk), removing a third of them, rescheduling another third,
+and firing everything that's left.
+
+Usage: bench_schedule.py [number of timers]
+"""
+
+import sys
+import time
+import random
+
+import supybot.world as world
+import supybot.schedule as schedule
+
+world.testing = True # Keeps Schedule.run from complaining it's alone.
+
+def noop():
+    pass
+
+def bench(n):
+    sched = schedule.Schedule()
+    now = time.time()
+    times = [now + random.random() * 100 for _ in xrange(n)]
+    results = []
+    def timeit(name, f, *args):
+        start = time.time()
+        ret = f(*args)
+        elapsed = time.time() - start
+        results.append((name, elapsed))
+        return ret
+
+    def addAll():
+        return [sched.addEvent(noop, t) for t in times]
+    names = timeit('addEvent', addAll)
+    def removeThird():
+        for name in names[::3]:
+            sched.removeEvent(name)
+    timeit('removeEvent (n/3)', removeThird)
+    def rescheduleThird():
+        for name in names[1::3]:
+            sched.rescheduleEvent(name, now + random.random() * 100)
+    timeit('rescheduleEvent (n/3)', rescheduleThird)
+    def fireAll():
+        for name in sched.events.keys():
+            sched.rescheduleEvent(name, now - 1)
+        sched.run()
+    timeit('reschedule to now and run', fireAll)
+    assert not sched.events and not sched.schedule
+
+    bulk = schedule.Schedule()
+    timeit('addEvents', bulk.addEvents, [(noop, t) for t in times])
+
+    for (name, elapsed) in results:
+        print '%-28s %8.3fs %8.2fus/event' % (name, elapsed, elapsed*1e6/n)
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        n = int(sys.argv[1])
+    else:
+        n = 100000
+    print 'Running %s timers.' % n
+    bench(n)
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+
+"""
+Simulates draining a burst of outgoing messages -- a long reply to one
+channel, short replies to a few others, and a flood of ops to another --
+through each outgoing scheduler, with a fake clock, and reports how long it
+takes to send everything and how long each channel waits for its messages.
+
+Usage: bench_scheduler.py [lines in the long reply] [number of ops]
+"""
+
+import sys
+
+import supybot.conf as conf
+import supybot.ircmsgs as ircmsgs
+import supybot.irclib as irclib
+
+class FakeIrc(object):
+    def __init__(self):
+        self.state = irclib.IrcState()
+        self.state.supported['modes'] = 4
+
+def burst(nLines, nOps):
+    msgs = []
+    for i in xrange(nLines):
+        msgs.append(ircmsgs.privmsg('#a', 'line %s of a long reply' % i))
+    for channel in ('#b', '#c'):
+        for i in xrange(3):
+            msgs.append(ircmsgs.privmsg(channel, 'short reply %s' % i))
+    for i in xrange(nOps):
+        msgs.append(ircmsgs.op('#d', 'nick%s' % i))
+    return msgs
+
+def drain(q, msgs):
+    for msg in msgs:
+        q.enqueue(msg)
+    now = 0.0
+    sent = []
+    while q:
+        # The throttle scheduler waits for strictly more than throttleTime.
+        now += q.nextTime(now) + 1e-9
+        msg = q.dequeue(now)
+        if msg is not None:
+            sent.append((now, msg))
+    return sent
+
+def report(name, sent):
+    waits = {}
+    for (when, msg) in sent:
+        waits.setdefault(msg.args[0], []).append(when)
+    print '%s: %s lines, drained in %.1fs' % (name, len(sent), sent[-1][0])
+    for target in sorted(waits):
+        times = waits[target]
+        print '    %s: %3s lines, mean wait %5.1fs, last at %5.1fs' % \
+              (target, len(times), sum(times)/len(times), times[-1])
+
+if __name__ == '__main__':
+    nLines = 40
+    nOps = 20
+    if len(sys.argv) > 1:
+        nLines = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        nOps = int(sys.argv[2])
+    msgs = burst(nLines, nOps)
+    report('throttle', drain(irclib.ThrottledQueue(), msgs))
+    report('penalty', drain(irclib.PenaltyQueue(FakeIrc()), msgs))
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+
+"""
+Times running the snarfer regexps of the bundled PluginRegexps (and the URL
+plugin's) over typical channel lines, each regexp scanning every line as they
+used to, against checking the shared SnarfFilter for their literals first.
+
+Usage: bench_snarfers.py [number of lines] [percentage with a URL]
+"""
+
+import re
+import sys
+import time
+import random
+
+import supybot.utils as utils
+import supybot.callbacks as callbacks
+
+patterns = [
+    r"https?://[^\])>\s]+",                         # Web
+    r"https?://[^\])>\s]{13,}",                     # ShrinkUrl
+    r"^google\s+(.*)$",                             # Google
+    r"http://groups.google.[\w.]+/\S+\?(\S+)",      # Google
+    "\x01PING ?(.*)\x01",                           # Ctcp
+    "\x01VERSION\x01",
+    "\x01USERINFO\x01",
+    "\x01TIME\x01",
+    "\x01FINGER\x01",
+    "\x01SOURCE\x01",
+    utils.web.urlRe.pattern,                        # URL
+    ]
+
+words = ('the of and to a in is you that it he was for on are as with his '
+         'they I at be this have from or one had by word but not what all '
+         'were we when your can said there use an each which she do how '
+         'their if will up other about out many then them these so').split()
+
+def lines(n, urls):
+    random.seed(0)
+    L = []
+    for i in xrange(n):
+        line = ' '.join(random.sample(words, random.randint(3, 15)))
+        if random.random() * 100 < urls:
+            line += ' http://example.com/some/page%s.html' % i
+        L.append(line)
+    return L
+
+def bench(n, urls):
+    res = []
+    for pattern in patterns:
+        r = re.compile(pattern, re.I)
+        literal = utils.str.requiredLiteral(pattern, re.I)
+        if literal is not None:
+            callbacks.snarfFilter.add(literal)
+        res.append((r, literal))
+    L = lines(n, urls)
+    def everyRegexp():
+        matches = 0
+        for s in L:
+            for (r, _) in res:
+                for m in r.finditer(s):
+                    matches += 1
+        return matches
+    def filtered():
+        matches = 0
+        for s in L:
+            found = callbacks.snarfFilter.found(s)
+            for (r, literal) in res:
+                if literal is not None and literal not in found:
+                    continue
+                for m in r.finditer(s):
+                    matches += 1
+        return matches
+    results = []
+    for f in (everyRegexp, filtered):
+        start = time.time()
+        matches = f()
+        elapsed = time.time() - start
+        results.append(matches)
+        print '%-12s %8.3fs %8.2fus/line' % \
+              (f.__name__, elapsed, elapsed*1e6/n)
+    assert results[0] == results[1]
+
+if __name__ == '__main__':
+    n = 100000
+    urls = 2
+    if len(sys.argv) > 1:
+        n = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        urls = float(sys.argv[2])
+    bench(n, urls)
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
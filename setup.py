@@ -54,8 +54,10 @@ def normalizeWhitespace(s):
     return ' '.join(s.split())
 
 try:
-    from distutils.core import setup
+    from distutils.core import setup, Extension
     from distutils.sysconfig import get_python_lib
+    from distutils.command.build_ext import build_ext
+    from distutils.errors import CCompilerError, DistutilsError
 except ImportError, e:
     s = normalizeWhitespace("""Supybot requires the distutils package to
     install. This package is normally included with Python, but for some
@@ -116,6 +118,24 @@ package_dir = {'supybot': 'src',
 for plugin in plugins:
     package_dir['supybot.plugins.' + plugin] = 'plugins/' + plugin
 
+# The compiled IRC parser is optional; supybot.ircmsgs falls back to its pure
+# Python parser if it isn't there, so we don't fail the install if it can't
+# be built.
+ext_modules = [Extension('supybot._ircparse', ['src/_ircparse.c'])]
+
+class optional_build_ext(build_ext):
+    def run(self):
+        try:
+            build_ext.run(self)
+        except DistutilsError, e:
+            self.warn('Not building the compiled IRC parser: %s' % e)
+
+    def build_extension(self, ext):
+        try:
+            build_ext.build_extension(self, ext)
+        except (CCompilerError, DistutilsError), e:
+            self.warn('Not building the compiled IRC parser: %s' % e)
+
 version = '0.83.4.1'
 setup(
     # Metadata
@@ -151,6 +171,9 @@ setup(
 
     package_dir=package_dir,
 
+    ext_modules=ext_modules,
+    cmdclass={'build_ext': optional_build_ext},
+
     scripts=['scripts/supybot',
              'scripts/supybot-test',
              'scripts/supybot-botchk',
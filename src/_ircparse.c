@@ -0,0 +1,171 @@
+/*
+ * Copyright (c) 2005, Jeremiah Fincher
+ * All rights reserved.
+ *
+ * Redistribution and use in source and binary forms, with or without
+ * modification, are permitted provided that the following conditions are met:
+ *
+ *   * Redistributions of source code must retain the above copyright notice,
+ *     this list of conditions, and the following disclaimer.
+ *   * Redistributions in binary form must reproduce the above copyright
+ *     notice, this list of conditions, and the following disclaimer in the
+ *     documentation and/or other materials provided with the distribution.
+ *   * Neither the name of the author of this software nor the name of
+ *     contributors to this software may be used to endorse or promote products
+ *     derived from this software without specific prior written consent.
+ *
+ * THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+ * AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+ * IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+ * ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+ * LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+ * CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+ * SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+ * INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+ * CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+ * ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+ * POSSIBILITY OF SUCH DAMAGE.
+ */
+
+/*
+ * An optional compiled version of supybot.ircmsgs._pyParse.  It must accept
+ * and reject exactly the same lines, and split them exactly the same way;
+ * test_ircmsgs.py checks the two against each other.
+ */
+
+#include <Python.h>
+
+/* What str.split() considers whitespace. */
+#define ISSPACE(c) ((c) == ' ' || ((c) >= '\t' && (c) <= '\r'))
+
+static PyObject *
+malformed(PyObject *line)
+{
+    PyObject *r = PyObject_Repr(line);
+    if (r != NULL) {
+        PyErr_SetObject(PyExc_ValueError, r);
+        Py_DECREF(r);
+    }
+    return NULL;
+}
+
+/* Appends the whitespace-separated words of s[start:end] to list. */
+static int
+splitWords(PyObject *list, const char *s, Py_ssize_t start, Py_ssize_t end)
+{
+    Py_ssize_t i = start, j;
+    PyObject *word;
+    while (1) {
+        while (i < end && ISSPACE(s[i]))
+            i++;
+        if (i == end)
+            return 0;
+        j = i;
+        while (j < end && !ISSPACE(s[j]))
+            j++;
+        word = PyString_FromStringAndSize(s + i, j - i);
+        if (word == NULL)
+            return -1;
+        if (PyList_Append(list, word) < 0) {
+            Py_DECREF(word);
+            return -1;
+        }
+        Py_DECREF(word);
+        i = j;
+    }
+}
+
+static PyObject *
+parse(PyObject *self, PyObject *args)
+{
+    PyObject *line, *prefix = NULL, *list = NULL, *command, *rest, *ret;
+    const char *s;
+    Py_ssize_t n, i = 0, j, k, colon = -1;
+
+    if (!PyArg_ParseTuple(args, "S:parse", &line))
+        return NULL;
+    s = PyString_AS_STRING(line);
+    n = PyString_GET_SIZE(line);
+    if (n == 0)
+        return malformed(line);
+    if (s[0] == ':') {
+        /* s[1:].split(None, 1) */
+        i = 1;
+        while (i < n && ISSPACE(s[i]))
+            i++;
+        j = i;
+        while (j < n && !ISSPACE(s[j]))
+            j++;
+        k = j;
+        while (k < n && ISSPACE(s[k]))
+            k++;
+        if (j == i || k == n)
+            return malformed(line);
+        prefix = PyString_FromStringAndSize(s + i, j - i);
+        i = k;
+    } else {
+        prefix = PyString_FromStringAndSize("", 0);
+    }
+    if (prefix == NULL)
+        return NULL;
+    for (j = i; j + 1 < n; j++) {
+        if (s[j] == ' ' && s[j+1] == ':') {
+            colon = j;
+            break;
+        }
+    }
+    list = PyList_New(0);
+    if (list == NULL)
+        goto error;
+    if (splitWords(list, s, i, colon == -1 ? n : colon) < 0)
+        goto error;
+    if (colon != -1) {
+        /* The trailing argument, minus any trailing '\r' and '\n'. */
+        k = n;
+        while (k > colon + 2 && (s[k-1] == '\r' || s[k-1] == '\n'))
+            k--;
+        rest = PyString_FromStringAndSize(s + colon + 2, k - colon - 2);
+        if (rest == NULL)
+            goto error;
+        if (PyList_Append(list, rest) < 0) {
+            Py_DECREF(rest);
+            goto error;
+        }
+        Py_DECREF(rest);
+    }
+    if (PyList_GET_SIZE(list) == 0) {
+        Py_DECREF(prefix);
+        Py_DECREF(list);
+        return malformed(line);
+    }
+    command = PyList_GET_ITEM(list, 0);
+    rest = PyList_GetSlice(list, 1, PyList_GET_SIZE(list));
+    if (rest == NULL)
+        goto error;
+    ret = Py_BuildValue("(OON)", prefix, command, PyList_AsTuple(rest));
+    Py_DECREF(rest);
+    Py_DECREF(prefix);
+    Py_DECREF(list);
+    return ret;
+error:
+    Py_XDECREF(prefix);
+    Py_XDECREF(list);
+    return NULL;
+}
+
+static PyMethodDef methods[] = {
+    {"parse", parse, METH_VARARGS,
+     "parse(line) -> (prefix, command, args)\n\n"
+     "Splits a raw IRC line into its parts.  Raises ValueError if the line\n"
+     "is malformed."},
+    {NULL, NULL, 0, NULL}
+};
+
+PyMODINIT_FUNC
+init_ircparse(void)
+{
+    Py_InitModule3("_ircparse", methods,
+                   "A compiled parser for raw IRC lines.");
+}
+
+/* vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79: */
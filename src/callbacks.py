@@ -38,6 +38,8 @@ import re
 import copy
 import time
 import shlex
+import threading
+import collections
 import getopt
 import inspect
 import operator
@@ -52,7 +54,7 @@ import supybot.irclib as irclib
 import supybot.ircmsgs as ircmsgs
 import supybot.ircutils as ircutils
 import supybot.registry as registry
-from supybot.utils.iter import any, all
+from supybot.utils.iter import any, all, chain
 
 def _addressed(nick, msg, prefixChars=None, nicks=None,
               prefixStrings=None, whenAddressedByNick=None,
@@ -571,9 +573,239 @@ class ReplyIrcProxy(RichReplyMethods):
 
 SimpleProxy = ReplyIrcProxy # Backwards-compatibility
 
+class CommandIndex(object):
+    """A trie of the commands provided by a list of callbacks, so finding the
+    callbacks that might have a given command doesn't mean asking all of them.
+    Each node is a pair of (owners, children): owners is a list of the
+    positions (in the list of callbacks) of the callbacks with the command
+    spelled out by the path to that node, and children maps the next word of
+    a command to its node.
+
+    The trie is built lazily and rebuilt whenever the list of callbacks
+    changes (which covers Irc.addCallback and Irc.removeCallback).  Plugins
+    whose commands change while they're loaded should tell the index with
+    addCommand and removeCommand, or invalidate it.  The index only narrows
+    down the candidates; callers must still ask them with getCommand, so
+    disabled commands are handled as they always have been."""
+    def __init__(self):
+        self.invalidate()
+
+    def invalidate(self):
+        """Makes the index rebuild itself the next time it's used."""
+        # (callbacks, positions, root, unindexed), replaced all at once so
+        # threads using the index never see it half-built.
+        self.state = None
+
+    def _paths(self, cb, command):
+        """Returns the paths by which command (a list of canonical names) of
+        cb can be called."""
+        return (command, [cb.canonicalName()] + command)
+
+    def _insert(self, root, path, i):
+        node = root
+        for word in path:
+            node = node[1].setdefault(word, ([], {}))
+        if i not in node[0]:
+            node[0].append(i)
+
+    def _build(self, callbacks):
+        callbacks = list(callbacks)
+        positions = {}
+        root = ([], {})
+        unindexed = []
+        for (i, cb) in enumerate(callbacks):
+            if not hasattr(cb, 'getCommand'):
+                continue
+            positions[cb] = i
+            getCommand = getattr(cb.getCommand, 'im_func', None)
+            if getCommand is not Commands.getCommand.im_func:
+                # We can't know what commands this callback will claim.
+                unindexed.append(i)
+                continue
+            for command in cb.listCommands():
+                for path in self._paths(cb, command.split()):
+                    self._insert(root, path, i)
+        log.debug('Built the command index for %i callbacks.', len(callbacks))
+        return (callbacks, positions, root, unindexed)
+
+    def _getState(self, callbacks):
+        state = self.state
+        if state is None or state[0] != callbacks:
+            state = self._build(callbacks)
+            self.state = state
+        return state
+
+    def candidates(self, callbacks, args):
+        """Returns the callbacks, in the order they are in callbacks, which
+        have a command that is a prefix of args (a list of canonical
+        names)."""
+        (callbacks, _, root, unindexed) = self._getState(callbacks)
+        found = set(unindexed)
+        node = root
+        for word in args:
+            node = node[1].get(word)
+            if node is None:
+                break
+            found.update(node[0])
+        found = list(found)
+        found.sort()
+        return [callbacks[i] for i in found]
+
+    def addCommand(self, cb, command):
+        """Adds command (a list of canonical names) to the commands of cb."""
+        state = self.state
+        if state is not None and cb in state[1]:
+            i = state[1][cb]
+            for path in self._paths(cb, command):
+                self._insert(state[2], path, i)
+
+    def removeCommand(self, cb, command):
+        """Removes command (a list of canonical names) from the commands of
+        cb."""
+        state = self.state
+        if state is not None and cb in state[1]:
+            i = state[1][cb]
+            for path in self._paths(cb, command):
+                node = state[2]
+                for word in path:
+                    node = node[1].get(word)
+                    if node is None:
+                        break
+                else:
+                    if i in node[0]:
+                        node[0].remove(i)
+
+commandIndex = CommandIndex()
+
+
+class MoreStore(object):
+    """Keeps the rest of long replies for the more command, under the
+    hostmask and nick they were for.  It keeps only so many users' mores
+    (supybot.reply.mores.users), taking only so much memory
+    (supybot.reply.mores.memory), for only so long
+    (supybot.reply.mores.expiry); whoever has gone longest without a long
+    reply or a more is forgotten first."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = {} # key -> [stamp, time, private, chunks]
+        self.order = collections.deque() # (stamp, key), oldest first.
+        self.stamp = 0
+        self.refs = {} # chunks -> [number of entries, size]
+        self.bytes = 0
+        # Metrics.
+        self.stored = 0
+        self.evicted = 0
+        self.expired = 0
+
+    def _use(self, key, entry):
+        self.stamp += 1
+        entry[0] = self.stamp
+        entry[1] = time.time()
+        self.order.append((self.stamp, key))
+        if len(self.order) > 2 * len(self.entries) + 16:
+            # Most of order is stale; there's no need to keep it around.
+            L = [(entry[0], key) for (key, entry) in self.entries.iteritems()]
+            L.sort()
+            self.order = collections.deque(L)
+
+    def _forget(self, key):
+        (_, _, _, chunks) = self.entries.pop(key)
+        ref = self.refs[chunks]
+        ref[0] -= 1
+        if not ref[0]:
+            del self.refs[chunks]
+            self.bytes -= ref[1]
+
+    def _prune(self):
+        users = conf.supybot.reply.mores.users()
+        memory = conf.supybot.reply.mores.memory()
+        expiry = conf.supybot.reply.mores.expiry()
+        cutoff = time.time() - expiry
+        while self.order:
+            (stamp, key) = self.order[0]
+            entry = self.entries.get(key)
+            if entry is None or entry[0] != stamp:
+                self.order.popleft() # Stale.
+            elif expiry and entry[1] < cutoff:
+                self.order.popleft()
+                self._forget(key)
+                self.expired += 1
+            elif len(self.entries) > 2*users or self.bytes > memory:
+                self.order.popleft()
+                self._forget(key)
+                self.evicted += 1
+            else:
+                break
+
+    def put(self, key, chunks, private=False):
+        """Stores chunks (an ircutils.WrappedText) as key's mores.  private
+        is whether they're only for key to see."""
+        key = ircutils.toLower(key)
+        self.lock.acquire()
+        try:
+            if key in self.entries:
+                self._forget(key)
+            entry = [0, 0, private, chunks]
+            self.entries[key] = entry
+            if chunks in self.refs:
+                self.refs[chunks][0] += 1
+            else:
+                size = chunks.size()
+                self.refs[chunks] = [1, size]
+                self.bytes += size
+            self.stored += 1
+            self._use(key, entry)
+            self._prune()
+        finally:
+            self.lock.release()
+
+    def get(self, key):
+        """Returns (private, chunks) for key's mores.  Raises KeyError if it
+        has none."""
+        key = ircutils.toLower(key)
+        self.lock.acquire()
+        try:
+            self._prune()
+            entry = self.entries[key]
+            self._use(key, entry)
+            return (entry[2], entry[3])
+        finally:
+            self.lock.release()
+
+    def clear(self):
+        self.lock.acquire()
+        try:
+            self.entries.clear()
+            self.order.clear()
+            self.refs.clear()
+            self.bytes = 0
+        finally:
+            self.lock.release()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def stats(self):
+        """Returns a dictionary of the store's metrics."""
+        self.lock.acquire()
+        try:
+            self._prune()
+            return {'entries': len(self.entries),
+                    'replies': len(self.refs),
+                    'bytes': self.bytes,
+                    'stored': self.stored,
+                    'evicted': self.evicted,
+                    'expired': self.expired,
+                   }
+        finally:
+            self.lock.release()
+
+mores = MoreStore()
+
+
 class NestedCommandsIrcProxy(ReplyIrcProxy):
     "A proxy object to allow proper nested of commands (even threaded ones)."
-    _mores = ircutils.IrcDict()
+    _mores = mores
     def __init__(self, irc, msg, args, nested=0):
         assert isinstance(args, list), 'Args should be a list, not a string.'
         self.irc = irc
@@ -676,13 +908,23 @@ class NestedCommandsIrcProxy(ReplyIrcProxy):
                     log.debug('Done calling invalidCommands: %s.',cb.name())
                     return
         if threaded:
-            name = 'Thread #%s (for invalidCommands)' % world.threadsSpawned
-            t = world.SupyThread(target=callInvalidCommands, name=name)
-            t.setDaemon(True)
-            t.start()
+            if not threadPool.submit(callInvalidCommands,
+                                     name='invalidCommands',
+                                     plugin='invalidCommands',
+                                     channel=self._poolChannel()):
+                log.info('Dropping invalidCommands for %q, thread pool is '
+                         'too busy.', self.msg.prefix)
         else:
             callInvalidCommands()
 
+    def _poolChannel(self):
+        """Returns who the thread pool should consider this command to be
+        from, for fairness' sake."""
+        if self.msg.args and self.isChannel(self.msg.args[0]):
+            return self.msg.args[0]
+        else:
+            return self.msg.nick
+
     def findCallbacksForArgs(self, args):
         """Returns a two-tuple of (command, plugins) that has the command
         (a list of strings) and the plugins for which it was a command."""
@@ -690,9 +932,7 @@ class NestedCommandsIrcProxy(ReplyIrcProxy):
         args = map(canonicalName, args)
         cbs = []
         maxL = []
-        for cb in self.irc.callbacks:
-            if not hasattr(cb, 'getCommand'):
-                continue
+        for cb in commandIndex.candidates(self.irc.callbacks, args):
             L = cb.getCommand(args)
             #log.debug('%s.getCommand(%r) returned %r', cb.name(), args, L)
             if L and L >= maxL:
@@ -705,7 +945,7 @@ class NestedCommandsIrcProxy(ReplyIrcProxy):
                        '(args given: %r, returned: %r)' % (args, L)
         log.debug('findCallbacksForArgs: %r', cbs)
         cbs = [cb for (cb, L) in cbs if L == maxL]
-        if len(maxL) == 1:
+        if len(maxL) == 1 and len(cbs) > 1:
             # Special case: one arg determines the callback.  In this case, we
             # have to check, in order:
             # 1. Whether the arg is the same as the name of a callback.  This
@@ -778,9 +1018,12 @@ class NestedCommandsIrcProxy(ReplyIrcProxy):
             args = self.args[len(command):]
             if world.isMainThread() and \
                (cb.threaded or conf.supybot.debug.threadAllCommands()):
-                t = CommandThread(target=cb._callCommand,
-                                  args=(command, self, self.msg, args))
-                t.start()
+                name = '%s.%s' % (cb.name(), formatCommand(command))
+                if not threadPool.submit(cb._callCommand,
+                                         (command, self, self.msg, args),
+                                         name=name, plugin=cb.name(),
+                                         channel=self._poolChannel()):
+                    self.error(threadPool.busyError)
             else:
                 cb._callCommand(command, self, self.msg, args)
 
@@ -874,8 +1117,7 @@ class NestedCommandsIrcProxy(ReplyIrcProxy):
                                   prefixNick=self.prefixNick)
                         self.irc.queueMsg(m)
                         return m
-                    msgs = ircutils.wrap(s, allowedLength)
-                    msgs.reverse()
+                    msgs = ircutils.WrappedText(s, allowedLength)
                     instant = conf.get(conf.supybot.reply.mores.instant,target)
                     while instant > 1 and msgs:
                         instant -= 1
@@ -905,10 +1147,10 @@ class NestedCommandsIrcProxy(ReplyIrcProxy):
                         except KeyError:
                             pass # We'll leave it as it is.
                     mask = prefix.split('!', 1)[1]
-                    self._mores[mask] = msgs
+                    self._mores.put(mask, msgs)
                     public = ircutils.isChannel(msg.args[0])
                     private = self.private or not public
-                    self._mores[msg.nick] = (private, msgs)
+                    self._mores.put(msg.nick, msgs, private)
                     m = reply(msg, response, to=self.to,
                                             action=self.action,
                                             notice=self.notice,
@@ -951,29 +1193,154 @@ class NestedCommandsIrcProxy(ReplyIrcProxy):
 
 IrcObjectProxy = NestedCommandsIrcProxy
 
-class CommandThread(world.SupyThread):
-    """Just does some extra logging and error-recovery for commands that need
-    to run in threads.
-    """
-    def __init__(self, target=None, args=(), kwargs={}):
-        self.command = args[0]
-        self.cb = target.im_self
-        threadName = 'Thread #%s (for %s.%s)' % (world.threadsSpawned,
-                                                 self.cb.name(),
-                                                 self.command)
-        log.debug('Spawning thread %s (args: %r)', threadName, args)
-        self.__parent = super(CommandThread, self)
-        self.__parent.__init__(target=target, name=threadName,
-                               args=args, kwargs=kwargs)
-        self.setDaemon(True)
-        self.originalThreaded = self.cb.threaded
-        self.cb.threaded = True
-
-    def run(self):
+class ThreadPool(object):
+    """A pool of threads for running commands (and the like) outside the main
+    thread.  Jobs are queued per channel and the channels are served in turn,
+    so a flood in one channel doesn't hold up the others.  No plugin may use
+    more than supybot.commands.threadPool.perPlugin threads at once, and a
+    plugin with supybot.commands.threadPool.queueSize jobs waiting has its
+    further jobs refused."""
+    busyError = 'I\'m too busy to do that right now; please try again in ' \
+                'a little while.'
+    def __init__(self):
+        self.cond = threading.Condition(threading.Lock())
+        self.queues = {} # channel -> deque of jobs.
+        self.channels = collections.deque() # Channels with jobs, in turn.
+        self.queued = {} # plugin -> number of jobs waiting.
+        self.waiting = 0 # Number of jobs waiting, from any plugin.
+        self.running = {} # plugin -> number of jobs running.
+        self.workers = 0
+        self.idle = 0
+        # Metrics.
+        self.jobs = 0
+        self.rejected = 0
+        self.totalWait = 0.0
+        self.maxWait = 0.0
+        self.busyTime = 0.0
+        self.started = time.time()
+
+    def submit(self, f, args=(), kwargs={}, name=None, plugin=None,
+               channel=None):
+        """Queues f(*args, **kwargs) to run in the pool.  Returns False if it
+        was refused because plugin has too many jobs waiting already."""
+        if name is None:
+            name = f.__name__
+        self.cond.acquire()
         try:
-            self.__parent.run()
+            if self.queued.get(plugin, 0) >= \
+               conf.supybot.commands.threadPool.queueSize():
+                self.rejected += 1
+                log.warning('Refusing to run %s, %s has too many jobs '
+                            'waiting.', name, plugin)
+                return False
+            job = (f, args, kwargs, name, plugin, time.time())
+            if channel not in self.queues:
+                self.queues[channel] = collections.deque()
+                self.channels.append(channel)
+            self.queues[channel].append(job)
+            self.queued[plugin] = self.queued.get(plugin, 0) + 1
+            self.waiting += 1
+            # Idle workers woken for earlier jobs still count as idle until
+            # they take them, so compare against all the jobs waiting.
+            if self.waiting > self.idle and \
+               self.workers < conf.supybot.commands.threadPool.size():
+                self.workers += 1
+                t = world.SupyThread(target=self._work,
+                                     name='Thread #%s (idle)' %
+                                     world.threadsSpawned)
+                t.setDaemon(True)
+                t.start()
+            self.cond.notify()
+            return True
+        finally:
+            self.cond.release()
+
+    def _next(self):
+        """Returns the next job to run, or None if no job can run yet.  Must
+        be called with self.cond held."""
+        perPlugin = conf.supybot.commands.threadPool.perPlugin()
+        for _ in xrange(len(self.channels)):
+            channel = self.channels[0]
+            self.channels.rotate(-1)
+            queue = self.queues[channel]
+            for job in queue:
+                plugin = job[4]
+                if self.running.get(plugin, 0) < perPlugin:
+                    queue.remove(job)
+                    if not queue:
+                        del self.queues[channel]
+                        self.channels.remove(channel)
+                    self.queued[plugin] -= 1
+                    self.waiting -= 1
+                    self.running[plugin] = self.running.get(plugin, 0) + 1
+                    return job
+        return None
+
+    def _work(self):
+        thread = threading.currentThread()
+        idleName = thread.getName()
+        self.cond.acquire()
+        try:
+            while 1:
+                job = self._next()
+                if job is None:
+                    if self.workers > conf.supybot.commands.threadPool.size():
+                        self.workers -= 1 # The pool was shrunk.
+                        return
+                    self.idle += 1
+                    self.cond.wait()
+                    self.idle -= 1
+                    continue
+                (f, args, kwargs, name, plugin, queuedAt) = job
+                start = time.time()
+                wait = start - queuedAt
+                self.jobs += 1
+                self.totalWait += wait
+                self.maxWait = max(self.maxWait, wait)
+                self.cond.release()
+                try:
+                    thread.setName(idleName.replace('idle', 'for %s' % name))
+                    log.debug('Running %s after waiting %.3f seconds.',
+                              name, wait)
+                    try:
+                        f(*args, **kwargs)
+                    except Exception:
+                        log.exception('Uncaught exception in %s:', name)
+                finally:
+                    thread.setName(idleName)
+                    self.cond.acquire()
+                self.running[plugin] -= 1
+                self.busyTime += time.time() - start
+                # A job held back by its plugin's limit may be runnable now.
+                self.cond.notify()
+        finally:
+            self.cond.release()
+
+    def stats(self):
+        """Returns a dictionary of the pool's metrics."""
+        self.cond.acquire()
+        try:
+            busy = self.workers - self.idle
+            elapsed = time.time() - self.started
+            size = conf.supybot.commands.threadPool.size()
+            if self.jobs:
+                averageWait = self.totalWait / self.jobs
+            else:
+                averageWait = 0.0
+            return {'size': size,
+                    'workers': self.workers,
+                    'busy': busy,
+                    'queued': self.waiting,
+                    'jobs': self.jobs,
+                    'rejected': self.rejected,
+                    'averageWait': averageWait,
+                    'maxWait': self.maxWait,
+                    'utilization': self.busyTime / (elapsed * size),
+                   }
         finally:
-            self.cb.threaded = self.originalThreaded
+            self.cond.release()
+
+threadPool = ThreadPool()
 
 
 class CanonicalString(registry.NormalizedString):
@@ -1036,6 +1403,8 @@ class DisabledCommands(object):
         else:
             if self.d[command] is not None:
                 self.d[command].remove(plugin)
+        # Commands that were disabled weren't indexed.
+        commandIndex.invalidate()
 
 class BasePlugin(object):
     def __init__(self, *args, **kwargs):
@@ -1223,6 +1592,8 @@ class PluginMixin(BasePlugin, irclib.IrcCallback):
     def __init__(self, irc):
         myName = self.name()
         self.log = log.getPluginLogger(myName)
+        # (name, channel) -> registry.Handle, for registryValue.
+        self._registryHandles = {}
         self.__parent = super(PluginMixin, self)
         self.__parent.__init__(irc)
         # We can't do this because of the specialness that Owner and Misc do.
@@ -1244,20 +1615,21 @@ class PluginMixin(BasePlugin, irclib.IrcCallback):
             self.__parent.__call__(irc, msg)
 
     def registryValue(self, name, channel=None, value=True):
-        plugin = self.name()
-        group = conf.supybot.plugins.get(plugin)
-        names = registry.split(name)
-        for name in names:
-            group = group.get(name)
-        if channel is not None:
-            if ircutils.isChannel(channel):
-                group = group.get(channel)
-            else:
-                self.log.debug('registryValue got channel=%r', channel)
+        if channel is not None and not ircutils.isChannel(channel):
+            self.log.debug('registryValue got channel=%r', channel)
+            channel = None
+        try:
+            handle = self._registryHandles[(name, channel)]
+        except KeyError:
+            names = [self.name()] + registry.split(name)
+            if channel is not None:
+                names.append(channel)
+            handle = registry.handle(conf.supybot.plugins, names)
+            self._registryHandles[(name, channel)] = handle
         if value:
-            return group()
+            return handle()
         else:
-            return group
+            return handle.resolve()
 
     def setRegistryValue(self, name, value, channel=None):
         plugin = self.name()
@@ -1313,6 +1685,51 @@ class Plugin(PluginMixin, Commands):
 Privmsg = Plugin # Backwards compatibility.
 
 
+class SnarfFilter(object):
+    """Finds which snarfers' literals a text contains.
+
+    A regexp can't match a text that doesn't contain the literal it requires
+    (see utils.str.requiredLiteral), so snarfers register their literals
+    here and check whether they were found before running their regexps.
+    Each text is searched once for all the literals, however many plugins
+    ask about it.  Since the search ignores case, a literal being found
+    doesn't mean the regexp matches, only that it might.
+    """
+    def __init__(self):
+        self.literals = {} # literal -> how many snarfers registered it
+        self.keys = ()
+        self.last = (None, frozenset())
+
+    def add(self, literal):
+        literal = literal.lower()
+        self.literals[literal] = self.literals.get(literal, 0) + 1
+        self.keys = tuple(self.literals)
+        self.last = (None, frozenset())
+
+    def remove(self, literal):
+        literal = literal.lower()
+        if literal not in self.literals:
+            return
+        self.literals[literal] -= 1
+        if not self.literals[literal]:
+            del self.literals[literal]
+        self.keys = tuple(self.literals)
+        self.last = (None, frozenset())
+
+    def found(self, text):
+        """Returns the set of registered literals text contains."""
+        (last, found) = self.last
+        if last is not text:
+            lowered = text.lower()
+            found = frozenset([literal for literal in self.keys
+                               if literal in lowered])
+            # Replaced rather than updated, so threads never see a mismatch.
+            self.last = (text, found)
+        return found
+
+snarfFilter = SnarfFilter()
+
+
 class PluginRegexp(Plugin):
     """Same as Plugin, except allows the user to also include regexp-based
     callbacks.  All regexp-based callbacks must be specified in the set (or
@@ -1334,21 +1751,36 @@ class PluginRegexp(Plugin):
     def __init__(self, irc):
         self.__parent = super(PluginRegexp, self)
         self.__parent.__init__(irc)
-        self.res = []
-        self.addressedRes = []
-        self.unaddressedRes = []
-        for name in self.regexps:
-            method = getattr(self, name)
-            r = re.compile(method.__doc__, self.flags)
-            self.res.append((r, name))
-        for name in self.addressedRegexps:
-            method = getattr(self, name)
-            r = re.compile(method.__doc__, self.flags)
-            self.addressedRes.append((r, name))
-        for name in self.unaddressedRegexps:
+        self.res = self._compileRegexps(self.regexps)
+        self.addressedRes = self._compileRegexps(self.addressedRegexps)
+        self.unaddressedRes = self._compileRegexps(self.unaddressedRegexps)
+
+    def _compileRegexps(self, names):
+        L = []
+        for name in names:
             method = getattr(self, name)
             r = re.compile(method.__doc__, self.flags)
-            self.unaddressedRes.append((r, name))
+            literal = utils.str.requiredLiteral(method.__doc__, self.flags)
+            if literal is not None:
+                literal = literal.lower()
+                snarfFilter.add(literal)
+            L.append((r, name, literal))
+        return L
+
+    def die(self):
+        for (_, _, literal) in chain(self.res, self.addressedRes,
+                                     self.unaddressedRes):
+            if literal is not None:
+                snarfFilter.remove(literal)
+        self.__parent.die()
+
+    def _snarf(self, res, s, irc, msg):
+        found = snarfFilter.found(s)
+        for (r, name, literal) in res:
+            if literal is not None and literal not in found:
+                continue
+            for m in r.finditer(s):
+                self._callRegexp(name, irc, msg, m)
 
     def _callRegexp(self, name, irc, msg, m):
         method = getattr(self, name)
@@ -1360,22 +1792,15 @@ class PluginRegexp(Plugin):
             self.log.exception('Uncaught exception in _callRegexp:')
 
     def invalidCommand(self, irc, msg, tokens):
-        s = ' '.join(tokens)
-        for (r, name) in self.addressedRes:
-            for m in r.finditer(s):
-                self._callRegexp(name, irc, msg, m)
+        self._snarf(self.addressedRes, ' '.join(tokens), irc, msg)
 
     def doPrivmsg(self, irc, msg):
         if msg.isError:
             return
         proxy = self.Proxy(irc, msg)
         if not msg.addressed:
-            for (r, name) in self.unaddressedRes:
-                for m in r.finditer(msg.args[1]):
-                    self._callRegexp(name, proxy, msg, m)
-        for (r, name) in self.res:
-            for m in r.finditer(msg.args[1]):
-                self._callRegexp(name, proxy, msg, m)
+            self._snarf(self.unaddressedRes, msg.args[1], proxy, msg)
+        self._snarf(self.res, msg.args[1], proxy, msg)
 PrivmsgCommandAndRegexp = PluginRegexp
 
 
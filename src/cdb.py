@@ -34,6 +34,7 @@ the same as) DJB's CDB <http://cr.yp.to/cdb.html>.
 
 import os
 import sys
+import mmap
 import struct
 import os.path
 import cPickle as pickle
@@ -178,11 +179,15 @@ class Maker(object):
             self.fd.write(pack2Ints(hashPos, hashLen))
 
 
+_pairStruct = struct.Struct('<LL')
+
 class Reader(utils.IterableMap):
-    """Class for reading from a CDB database."""
+    """Class for reading from a CDB database.  The database is memory-mapped,
+    so probes don't need to seek and read."""
     def __init__(self, filename):
         self.filename = filename
-        self.fd = file(filename, 'r')
+        self.fd = file(filename, 'rb')
+        self.map = mmap.mmap(self.fd.fileno(), 0, access=mmap.ACCESS_READ)
         self.loop = 0
         self.khash = 0
         self.kpos = 0
@@ -192,38 +197,37 @@ class Reader(utils.IterableMap):
         self.dlen = 0
 
     def close(self):
+        self.map.close()
         self.fd.close()
 
     def _read(self, len, pos):
-        self.fd.seek(pos)
-        return self.fd.read(len)
+        return self.map[pos:pos+len]
+
+    def _unpack(self, pos):
+        return _pairStruct.unpack_from(self.map, pos)
 
     def _match(self, key, pos):
-        return self._read(len(key), pos) == key
+        # find compares in place rather than slicing out a copy of the key.
+        return self.map.find(key, pos, pos + len(key)) == pos
 
     def iteritems(self):
-        # uses loop/hslots in a strange, non-re-entrant manner.
-        (self.loop,) = struct.unpack('<i', self._read(4, 0))
-        self.hslots = 2048
-        while self.hslots < self.loop:
-            (klen, dlen) = unpack2Ints(self._read(8, self.hslots))
-            dpos = self.hslots + 8 + klen
-            ret = (self._read(klen, self.hslots+8), self._read(dlen, dpos))
-            self.hslots = dpos + dlen
-            yield ret
-        self.loop = 0
-        self.hslots = 0
+        (end,) = struct.unpack_from('<i', self.map, 0)
+        pos = 2048
+        while pos < end:
+            (klen, dlen) = self._unpack(pos)
+            dpos = pos + 8 + klen
+            yield (self.map[pos+8:dpos], self.map[dpos:dpos+dlen])
+            pos = dpos + dlen
 
     def _findnext(self, key):
         if not self.loop:
             self.khash = hash(key)
-            (self.hpos, self.hslots) = unpack2Ints(self._read(8,
-                                                    (self.khash * 8) & 2047))
+            (self.hpos, self.hslots) = self._unpack((self.khash * 8) & 2047)
             if not self.hslots:
                 return False
             self.kpos = self.hpos + (((self.khash / 256) % self.hslots) * 8)
         while self.loop < self.hslots:
-            (h, p) = unpack2Ints(self._read(8, self.kpos))
+            (h, p) = self._unpack(self.kpos)
             if p == 0:
                 return False
             self.loop += 1
@@ -231,7 +235,7 @@ class Reader(utils.IterableMap):
             if self.kpos == self.hpos + (self.hslots * 8):
                 self.kpos = self.hpos
             if h == self.khash:
-                (u, self.dlen) = unpack2Ints(self._read(8, p))
+                (u, self.dlen) = self._unpack(p)
                 if u == len(key):
                     if self._match(key, p+8):
                         self.dpos = p + 8 + u
@@ -242,12 +246,43 @@ class Reader(utils.IterableMap):
         self.loop = loop
         return self._findnext(key)
 
+    def _lookup(self, key, khash=None):
+        """Returns the (position, length) of the first value for key, or None.
+        Unlike _find, this doesn't touch our state, so it's re-entrant."""
+        if khash is None:
+            khash = hash(key)
+        (hpos, hslots) = self._unpack((khash * 8) & 2047)
+        if not hslots:
+            return None
+        klen = len(key)
+        hend = hpos + hslots * 8
+        kpos = hpos + (((khash / 256) % hslots) * 8)
+        for _ in xrange(hslots):
+            (h, p) = self._unpack(kpos)
+            if p == 0:
+                return None
+            kpos += 8
+            if kpos == hend:
+                kpos = hpos
+            if h == khash:
+                (u, dlen) = self._unpack(p)
+                if u == klen and self._match(key, p+8):
+                    return (p + 8 + u, dlen)
+        return None
+
     def _getCurrentData(self):
         return self._read(self.dlen, self.dpos)
 
     def find(self, key, loop=0):
-        if self._find(key, loop=loop):
-            return self._getCurrentData()
+        if loop:
+            found = self._find(key, loop=loop)
+            t = (self.dpos, self.dlen)
+        else:
+            t = self._lookup(key)
+            found = t is not None
+        if found:
+            (pos, length) = t
+            return self.map[pos:pos+length]
         else:
             try:
                 return self.default
@@ -260,24 +295,53 @@ class Reader(utils.IterableMap):
             ret.append(self._getCurrentData())
         return ret
 
+    def getMany(self, keys, default=None):
+        """Returns a list of the values of the given keys, with default in
+        place of any that aren't in the database.  The lookups are done in
+        the order of the database's hash tables rather than the order given,
+        which keeps the probes close together on disk."""
+        lookups = []
+        for (i, key) in enumerate(keys):
+            khash = hash(key)
+            lookups.append((khash & 255, khash, i, key))
+        lookups.sort()
+        ret = [default] * len(lookups)
+        for (_, khash, i, key) in lookups:
+            t = self._lookup(key, khash)
+            if t is not None:
+                (pos, length) = t
+                ret[i] = self.map[pos:pos+length]
+        return ret
+
     def get(self, key, default=None):
         try:
             return self[key]
         except KeyError:
             return default
 
+    def has_key(self, key, loop=0):
+        if loop:
+            return self._find(key, loop=loop)
+        else:
+            return self._lookup(key) is not None
+
     def __len__(self):
-        (start,) = struct.unpack('<i', self._read(4, 0))
-        self.fd.seek(0, 2)
-        return ((self.fd.tell() - start) / 16)
+        (start,) = struct.unpack_from('<i', self.map, 0)
+        return ((len(self.map) - start) / 16)
 
-    has_key = _find
     __contains__ = has_key
     __getitem__ = find
 
 
 class ReaderWriter(utils.IterableMap):
-    """Uses a journal to pretend that a CDB is writable database."""
+    """Uses a journal to pretend that a CDB is writable database.
+
+    Changes are appended to the journal and kept in memory; the CDB is only
+    rebuilt (merging in the journal) once the journal is large enough
+    relative to the CDB, as determined by maxmods.  An int maxmods is a
+    number of changes, a float is a ratio of changes to records in the CDB.
+    With no maxmods, every flush rebuilds the CDB.
+    """
     def __init__(self, filename, journalName=None, maxmods=0):
         if journalName is None:
             journalName = filename + '.journal'
@@ -285,14 +349,12 @@ class ReaderWriter(utils.IterableMap):
         self.maxmods = maxmods
         self.mods = 0
         self.filename = filename
-        self._readJournal()
-        self._openFiles()
         self.adds = {}
         self.removals = set()
-
-    def _openFiles(self):
         self.cdb = Reader(self.filename)
-        self.journal = file(self.journalName, 'w')
+        self._readJournal()
+        self.journal = file(self.journalName, 'a')
+        self._mergeIfOverLimit()
 
     def _closeFiles(self):
         self.cdb.close()
@@ -309,66 +371,78 @@ class ReaderWriter(utils.IterableMap):
         self.journal.flush()
 
     def _readJournal(self):
-        removals = set()
-        adds = {}
+        """Replays the journal left by a previous instance into self.adds and
+        self.removals."""
         try:
             fd = file(self.journalName, 'r')
+        except IOError:
+            return
+        try:
             while 1:
                 (initchar, key, value) = _readKeyValue(fd)
                 if initchar is None:
                     break
                 elif initchar == '+':
-                    if key in removals:
-                        removals.remove(key)
-                    adds[key] = value
+                    self._add(key, value)
                 elif initchar == '-':
-                    if key in adds:
-                        del adds[key]
-                    removals.add(key)
+                    self._remove(key)
+                self.mods += 1
+        finally:
             fd.close()
-        except IOError:
-            pass
-        if removals or adds:
+
+    def _add(self, key, value):
+        self.removals.discard(key)
+        self.adds[key] = value
+
+    def _remove(self, key):
+        self.adds.pop(key, None)
+        if key in self.cdb:
+            self.removals.add(key)
+
+    def _merge(self):
+        """Rebuilds the CDB with the journal's changes and empties the
+        journal."""
+        if self.mods:
             maker = Maker(self.filename)
-            cdb = Reader(self.filename)
-            for (key, value) in cdb.iteritems():
-                if key in removals:
-                    continue
-                elif key in adds:
-                    value = adds[key]
-                    if value is not None:
-                        maker.add(key, value)
-                        adds[key] = None
-                else:
-                    maker.add(key, value)
-            for (key, value) in adds.iteritems():
-                if value is not None:
-                    maker.add(key, value)
-            cdb.close()
+            # Not self.iteritems, which Shelf overrides to unpickle.
+            for (key, value) in ReaderWriter.iteritems(self):
+                maker.add(key, value)
+            # The new CDB replaces the old one when it's finished, which
+            # Windows won't allow while we still have the old one open.
+            self._closeFiles()
             maker.finish()
-        if os.path.exists(self.journalName):
-            os.remove(self.journalName)
+        else:
+            self._closeFiles()
+        self.cdb = Reader(self.filename)
+        self.journal = file(self.journalName, 'w')
+        self.adds.clear()
+        self.removals.clear()
+        self.mods = 0
+
+    def _isOverLimit(self):
+        if not self.maxmods:
+            return False
+        elif isinstance(self.maxmods, int):
+            return self.mods > self.maxmods
+        else:
+            assert 0 <= self.maxmods
+            return self.mods / float(max(len(self.cdb), 100)) > self.maxmods
+
+    def _mergeIfOverLimit(self):
+        if self._isOverLimit():
+            self._merge()
 
     def close(self):
         self.flush()
         self._closeFiles()
+        if not self.mods and os.path.exists(self.journalName):
+            os.remove(self.journalName)
 
     def flush(self):
-        self._closeFiles()
-        self._readJournal()
-        self._openFiles()
-
-    def _flushIfOverLimit(self):
         if self.maxmods:
-            if isinstance(self.maxmods, int):
-                if self.mods > self.maxmods:
-                    self.flush()
-                    self.mods = 0
-            elif isinstance(self.maxmods, float):
-                assert 0 <= self.maxmods
-                if self.mods / max(len(self.cdb), 100) > self.maxmods:
-                    self.flush()
-                    self.mods = 0
+            self._mergeIfOverLimit()
+        else:
+            self._merge()
 
     def __getitem__(self, key):
         if key in self.removals:
@@ -380,30 +454,18 @@ class ReaderWriter(utils.IterableMap):
                 return self.cdb[key] # If this raises KeyError, we lack key.
 
     def __delitem__(self, key):
-        if key in self.removals:
+        if key not in self:
             raise KeyError, key
-        else:
-            if key in self.adds and key in self.cdb:
-                self._journalRemoveKey(key)
-                del self.adds[key]
-                self.removals.add(key)
-            elif key in self.adds:
-                self._journalRemoveKey(key)
-                del self.adds[key]
-            elif key in self.cdb:
-                self._journalRemoveKey(key)
-            else:
-                raise KeyError, key
+        self._journalRemoveKey(key)
+        self._remove(key)
         self.mods += 1
-        self._flushIfOverLimit()
+        self._mergeIfOverLimit()
 
     def __setitem__(self, key, value):
-        if key in self.removals:
-            self.removals.remove(key)
         self._journalAddKey(key, value)
-        self.adds[key] = value
+        self._add(key, value)
         self.mods += 1
-        self._flushIfOverLimit()
+        self._mergeIfOverLimit()
 
     def __contains__(self, key):
         if key in self.removals:
@@ -413,6 +475,24 @@ class ReaderWriter(utils.IterableMap):
 
     has_key = __contains__
 
+    def getMany(self, keys, default=None):
+        """Returns a list of the values of the given keys, with default in
+        place of any that we don't have."""
+        ret = []
+        missing = []
+        for key in keys:
+            if key in self.removals:
+                ret.append(default)
+            elif key in self.adds:
+                ret.append(self.adds[key])
+            else:
+                missing.append(len(ret))
+                ret.append(key)
+        values = self.cdb.getMany([ret[i] for i in missing], default)
+        for (i, value) in zip(missing, values):
+            ret[i] = value
+        return ret
+
     def iteritems(self):
         already = set()
         for (key, value) in self.cdb.iteritems():
@@ -449,6 +529,16 @@ class Shelf(ReaderWriter):
     def __setitem__(self, key, value):
         ReaderWriter.__setitem__(self, key, pickle.dumps(value, True))
 
+    def getMany(self, keys, default=None):
+        marker = object()
+        ret = ReaderWriter.getMany(self, keys, marker)
+        for (i, value) in enumerate(ret):
+            if value is marker:
+                ret[i] = default
+            else:
+                ret[i] = pickle.loads(value)
+        return ret
+
     def iteritems(self):
         for (key, value) in ReaderWriter.iteritems(self):
             yield (key, pickle.loads(value))
@@ -60,27 +60,21 @@ def thread(f):
     def newf(self, irc, msg, args, *L, **kwargs):
         if world.isMainThread():
             targetArgs = (self.callingCommand, irc, msg, args) + tuple(L)
-            t = callbacks.CommandThread(target=self._callCommand,
-                                        args=targetArgs, kwargs=kwargs)
-            t.start()
+            name = '%s.%s' % (self.name(),
+                              callbacks.formatCommand(self.callingCommand))
+            if msg.args and irc.isChannel(msg.args[0]):
+                channel = msg.args[0]
+            else:
+                channel = msg.nick
+            if not callbacks.threadPool.submit(self._callCommand, targetArgs,
+                                               kwargs, name=name,
+                                               plugin=self.name(),
+                                               channel=channel):
+                irc.error(callbacks.threadPool.busyError)
         else:
             f(self, irc, msg, args, *L, **kwargs)
     return utils.python.changeFunctionName(newf, f.func_name, f.__doc__)
 
-class UrlSnarfThread(world.SupyThread):
-    def __init__(self, *args, **kwargs):
-        assert 'url' in kwargs
-        kwargs['name'] = 'Thread #%s (for snarfing %s)' % \
-                         (world.threadsSpawned, kwargs.pop('url'))
-        super(UrlSnarfThread, self).__init__(*args, **kwargs)
-        self.setDaemon(True)
-
-    def run(self):
-        try:
-            super(UrlSnarfThread, self).run()
-        except utils.web.Error, e:
-            log.debug('Exception in urlSnarfer: %s', utils.exnToString(e))
-
 class SnarfQueue(ircutils.FloodQueue):
     timeout = conf.supybot.snarfThrottle
     def key(self, channel):
@@ -127,15 +121,25 @@ def urlSnarfer(f):
                 if msg.repliedTo:
                     self.log.debug('Not snarfing, msg is already repliedTo.')
                     return
-                f(self, irc, msg, match, *L, **kwargs)
+                try:
+                    f(self, irc, msg, match, *L, **kwargs)
+                except utils.web.Error, e:
+                    self.log.debug('Exception in urlSnarfer: %s',
+                                   utils.exnToString(e))
             finally:
                 _snarfLock.release()
         if threading.currentThread() is not world.mainThread:
             doSnarf()
         else:
-            L = list(L)
-            t = UrlSnarfThread(target=doSnarf, url=url)
-            t.start()
+            # Snarfs only run one at a time anyway, so they all share a
+            # single plugin's worth of the pool; otherwise a slow snarf
+            # could tie up every worker waiting on _snarfLock.
+            if not callbacks.threadPool.submit(doSnarf,
+                                               name='snarfing %s' % url,
+                                               plugin='snarfer',
+                                               channel=channel):
+                self.log.info('Not snarfing %s, the thread pool is too busy.',
+                              url)
     newf = utils.python.changeFunctionName(newf, f.func_name, f.__doc__)
     return newf
 
@@ -110,10 +110,16 @@ def registerPlugin(name, currentValue=None, public=True):
     registerGroup(users.plugins, name)
     return group
 
+_handles = {} # (group, channel) -> registry.Handle, for get.
 def get(group, channel=None):
     if group.channelValue and \
        channel is not None and ircutils.isChannel(channel):
-        return group.get(channel)()
+        try:
+            handle = _handles[(group, channel)]
+        except KeyError:
+            handle = registry.handle(group, [channel])
+            _handles[(group, channel)] = handle
+        return handle()
     else:
         return group()
 
@@ -339,6 +345,22 @@ registerChannelValue(supybot.reply.mores, 'instant',
     they are formed).  Defaults to 1, which means that a more command will be
     required for all but the first chunk."""))
 
+registerGlobalValue(supybot.reply.mores, 'users',
+    registry.PositiveInteger(1000, """Determines how many users' mores the bot
+    will keep at once.  Once there are more, the mores of whoever has gone
+    longest without a long reply or a more are forgotten."""))
+
+registerGlobalValue(supybot.reply.mores, 'memory',
+    registry.PositiveInteger(4*1024*1024, """Determines how many bytes of
+    replies the bot will keep for the more command.  Once they take up more
+    than this, the mores of whoever has gone longest without a long reply or a
+    more are forgotten."""))
+
+registerGlobalValue(supybot.reply.mores, 'expiry',
+    registry.NonNegativeInteger(3600, """Determines how many seconds the bot
+    will keep a user's mores after their last long reply or more.  If set to
+    0, mores are only forgotten to make room for others."""))
+
 registerGlobalValue(supybot.reply, 'oneToOne',
     registry.Boolean(True, """Determines whether the bot will send
     multi-message replies in a single message or in multiple messages.  For
@@ -615,6 +637,21 @@ registerGlobalValue(supybot.commands.defaultPlugins, 'importantPlugins',
         change this if you don't know what you're doing; if you do know what
         you're doing, then also know that this set is case-sensitive."""))
 
+registerGroup(supybot.commands, 'threadPool')
+registerGlobalValue(supybot.commands.threadPool, 'size',
+    registry.PositiveInteger(10, """Determines how many threads the bot will
+    use to run threaded commands (and other work done in threads, such as
+    snarfing urls).  Commands beyond that wait for a thread to be free."""))
+registerGlobalValue(supybot.commands.threadPool, 'perPlugin',
+    registry.PositiveInteger(4, """Determines how many threads a single plugin
+    may be using at once, so one slow plugin can't keep the others' commands
+    waiting."""))
+registerGlobalValue(supybot.commands.threadPool, 'queueSize',
+    registry.PositiveInteger(25, """Determines how many of a plugin's threaded
+    commands may be waiting for a thread.  Once there are this many, the bot
+    will refuse that plugin's further commands with a message saying it's
+    too busy."""))
+
 # supybot.commands.disabled moved to callbacks for canonicalName.
 
 ###
@@ -662,13 +699,21 @@ registerGlobalValue(supybot.drivers, 'poll',
     driver should block waiting for input."""))
 
 class ValidDriverModule(registry.OnlySomeStrings):
-    validStrings = ('default', 'Socket', 'Twisted')
+    validStrings = ('default', 'Socket', 'Select', 'Twisted')
 
 registerGlobalValue(supybot.drivers, 'module',
     ValidDriverModule('default', """Determines what driver module the bot will
     use.  Socket, a simple driver based on timeout sockets, is used by default
-    because it's simple and stable.  Twisted is very stable and simple, and if
-    you've got Twisted installed, is probably your best bet."""))
+    because it's simple and stable.  Select waits on all of the bot's
+    connections at once, and is a better choice if the bot is connected to
+    many networks.  Twisted is very stable and simple, and if you've got
+    Twisted installed, is probably your best bet."""))
+
+registerGlobalValue(supybot.drivers, 'bufferSize',
+    registry.PositiveInteger(8192, """Determines how many bytes the Socket and
+    Select drivers will try to read from the server at once.  Larger values
+    help the bot keep up with large bursts of input, such as netsplits or
+    long NAMES replies.  Changes take effect on the next restart."""))
 
 registerGlobalValue(supybot.drivers, 'maxReconnectWait',
     registry.PositiveFloat(300.0, """Determines the maximum time the bot will
@@ -770,7 +815,10 @@ class Databases(registry.SpaceSeparatedListOfStrings):
 registerGlobalValue(supybot, 'databases',
     Databases([], """Determines what databases are available for use. If this
     value is not configured (that is, if its value is empty) then sane defaults
-    will be provided."""))
+    will be provided.  Adding 'indexed' before 'flat' makes plugins that
+    support it (such as Quote, Lart, and Praise) keep their records in an
+    indexed, append-only file; existing flat databases are imported the first
+    time they're opened."""))
 
 registerGroup(supybot.databases, 'users')
 registerGlobalValue(supybot.databases.users, 'filename',
@@ -977,10 +1025,20 @@ registerGlobalValue(supybot.protocols.irc, 'maxHistoryLength',
     keep around in its history.  Changing this variable will not take effect
     until the bot is restarted."""))
 
+registerGlobalValue(supybot.protocols.irc, 'lanes',
+    registry.NonNegativeInteger(2, """Determines how many worker threads
+    (lanes) each network has for running the plugins that don't care in which
+    order they and other plugins handle messages, so a slow one doesn't hold
+    up the rest.  Each such plugin always runs in the same lane, so it still
+    sees messages in order.  If this is 0, every plugin is run on the driver
+    thread.  Changing this variable will not take effect until the bot is
+    restarted."""))
+
 registerGlobalValue(supybot.protocols.irc, 'throttleTime',
     registry.Float(1.0, """A floating point number of seconds to throttle
     queued messages -- that is, messages will not be sent faster than once per
-    throttleTime seconds."""))
+    throttleTime seconds.  This is only used by the throttle scheduler; see
+    supybot.protocols.irc.queuing.scheduler."""))
 
 registerGlobalValue(supybot.protocols.irc, 'ping',
     registry.Boolean(True, """Determines whether the bot will send PINGs to the
@@ -1001,6 +1059,34 @@ registerGlobalValue(supybot.protocols.irc.queuing, 'duplicates',
     multiple times; most of the time it doesn't matter, unless you're doing
     certain kinds of plugin hacking."""))
 
+class ValidScheduler(registry.OnlySomeStrings):
+    validStrings = ('penalty', 'throttle')
+
+registerGlobalValue(supybot.protocols.irc.queuing, 'scheduler',
+    ValidScheduler('penalty', """Determines how the bot decides when to send
+    queued messages.  penalty keeps within the number of commands and bytes
+    the server allows in a window of time (see
+    supybot.protocols.irc.queuing.penalty), sends to channels and nicks in
+    turn, and merges queued mode changes.  throttle sends one message every
+    supybot.protocols.irc.throttleTime seconds, in the order they were queued.
+    Changing this variable will not take effect until the bot reconnects."""))
+
+registerGroup(supybot.protocols.irc.queuing, 'penalty')
+registerGlobalValue(supybot.protocols.irc.queuing.penalty, 'window',
+    registry.NonNegativeFloat(5.0, """Determines the length, in seconds, of the window
+    of time the penalty scheduler counts commands and bytes sent in.  If this
+    is 0, the bot sends queued messages as fast as it can."""))
+registerGlobalValue(supybot.protocols.irc.queuing.penalty, 'commands',
+    registry.PositiveInteger(5, """Determines how many commands the penalty
+    scheduler will send in each window of time."""))
+registerGlobalValue(supybot.protocols.irc.queuing.penalty, 'bytes',
+    registry.PositiveInteger(2048, """Determines how many bytes the penalty
+    scheduler will send in each window of time."""))
+registerGlobalValue(supybot.protocols.irc.queuing.penalty, 'perTarget',
+    registry.PositiveInteger(4, """Determines how many messages to any one
+    channel or nick the penalty scheduler will send in each window of
+    time."""))
+
 registerGroup(supybot.protocols.irc.queuing, 'rateLimit')
 registerGlobalValue(supybot.protocols.irc.queuing.rateLimit, 'join',
     registry.Float(0, """Determines how many seconds must elapse between JOINs
@@ -1021,6 +1107,37 @@ registerGlobalValue(supybot.protocols.http, 'proxy',
     through.  The value should be of the form 'host:port'."""))
 utils.web.proxy = supybot.protocols.http.proxy
 
+registerGlobalValue(supybot.protocols.http, 'connectionsPerHost',
+    registry.PositiveInteger(4, """Determines how many HTTP requests the bot
+    will have in progress to a single host at once.  The connections used are
+    kept open for a while afterwards, to be reused by later requests."""))
+utils.web.connectionsPerHost = supybot.protocols.http.connectionsPerHost
+
+registerGlobalValue(supybot.protocols.http, 'dnsCacheTime',
+    registry.NonNegativeInteger(300, """Determines how many seconds the bot
+    will remember the addresses of the hosts it makes HTTP requests to."""))
+utils.web.dnsCacheTime = supybot.protocols.http.dnsCacheTime
+
+registerGroup(supybot.protocols.http, 'cache')
+registerGlobalValue(supybot.protocols.http.cache, 'size',
+    registry.NonNegativeInteger(100, """Determines how many HTTP responses the
+    bot will keep in memory, so it needn't fetch them again while they're
+    fresh (and can ask the server whether they've changed since, once they're
+    not).  Only responses whose headers allow it are cached."""))
+utils.web.cacheSize = supybot.protocols.http.cache.size
+
+registerGlobalValue(supybot.protocols.http.cache, 'diskSize',
+    registry.NonNegativeInteger(500, """Determines how many HTTP responses the
+    bot will keep on disk, in the httpCache directory of its data
+    directory."""))
+utils.web.diskCacheSize = supybot.protocols.http.cache.diskSize
+utils.web.cacheDirectory = lambda: supybot.directories.data.dirize('httpCache')
+
+registerGlobalValue(supybot.protocols.http.cache, 'maximumSize',
+    registry.PositiveInteger(262144, """Determines the size, in bytes, of the
+    largest HTTP response the bot will cache."""))
+utils.web.cacheEntrySize = supybot.protocols.http.cache.maximumSize
+
 
 ###
 # Especially boring stuff.
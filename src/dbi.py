@@ -31,8 +31,10 @@
 Module for some slight database-independence for simple databases.
 """
 
+import os
 import csv
 import math
+import threading
 
 import supybot.cdb as cdb
 import supybot.utils as utils
@@ -271,6 +273,232 @@ class FlatfileMapping(MappingInterface):
         self.vacuum() # Should we do this?  It should be fine.
         
 
+class IndexedMapping(MappingInterface):
+    """A mapping kept in an append-only file.  Every set appends the new
+    version of the record and every removal appends a tombstone; an
+    in-memory index maps each id to the position of its latest version, so
+    lookups are a seek rather than a scan of the file.  vacuum() rewrites
+    the file without the dead records; it's started in a thread once enough
+    of the file is dead."""
+    # Vacuum in the background once this fraction of the file is dead...
+    vacuumRatio = 0.5
+    # ...but don't bother for files smaller than this.
+    vacuumMinimumSize = 2**16
+    def __init__(self, filename, **kwargs):
+        self.filename = filename
+        self.lock = threading.RLock()
+        self.index = {} # id -> (offset, length) of its latest line.
+        self.nextId = 1
+        self.vacuuming = False
+        self.vacuumThread = None
+        self._open()
+
+    def _open(self):
+        self.writer = file(self.filename, 'ab')
+        self.reader = file(self.filename, 'rb')
+        self.index.clear()
+        self.dead = 0
+        self.size = self._load(0)
+
+    def _load(self, pos):
+        """Indexes the lines of the file from pos on, returning the size of
+        the file."""
+        self.reader.seek(pos)
+        for line in self.reader:
+            if not line.endswith('\n'):
+                # A write was interrupted; anything appended after it would
+                # be corrupted, so we cut it off.
+                os.ftruncate(self.writer.fileno(), pos)
+                break
+            if line.startswith('-'):
+                id = int(line[1:])
+                self.dead += len(line)
+                self._unindex(id)
+            else:
+                id = int(line[:line.index(':')])
+                self._unindex(id)
+                self.index[id] = (pos, len(line))
+            self.nextId = max(self.nextId, id+1)
+            pos += len(line)
+        return pos
+
+    def _unindex(self, id):
+        if id in self.index:
+            self.dead += self.index.pop(id)[1]
+
+    def _append(self, line):
+        pos = self.size
+        self.writer.write(line)
+        self.writer.flush()
+        self.size += len(line)
+        return pos
+
+    def _maybeVacuum(self):
+        if not self.vacuuming and self.size > self.vacuumMinimumSize and \
+           self.dead > self.size * self.vacuumRatio:
+            self.vacuumThread = threading.Thread(target=self.vacuum,
+                                                 name='Vacuuming %s' %
+                                                 self.filename)
+            self.vacuumThread.setDaemon(True)
+            self.vacuumThread.start()
+
+    def get(self, id):
+        self.lock.acquire()
+        try:
+            try:
+                (pos, length) = self.index[id]
+            except KeyError:
+                raise NoRecordError, id
+            self.reader.seek(pos)
+            line = self.reader.read(length)
+            return line[line.index(':')+1:-1]
+        finally:
+            self.lock.release()
+
+    def set(self, id, s):
+        line = '%s:%s\n' % (id, s)
+        self.lock.acquire()
+        try:
+            pos = self._append(line)
+            self._unindex(id)
+            self.index[id] = (pos, len(line))
+            self.nextId = max(self.nextId, id+1)
+            self._maybeVacuum()
+        finally:
+            self.lock.release()
+
+    def add(self, s):
+        self.lock.acquire()
+        try:
+            id = self.nextId
+            self.set(id, s)
+            return id
+        finally:
+            self.lock.release()
+
+    def remove(self, id):
+        self.lock.acquire()
+        try:
+            if id not in self.index:
+                raise NoRecordError, id
+            line = '-%s\n' % id
+            self._append(line)
+            self.dead += len(line)
+            self._unindex(id)
+            self._maybeVacuum()
+        finally:
+            self.lock.release()
+
+    def __iter__(self):
+        self.lock.acquire()
+        try:
+            ids = sorted(self.index)
+        finally:
+            self.lock.release()
+        for id in ids:
+            try:
+                yield (id, self.get(id))
+            except NoRecordError:
+                continue # Removed since we started iterating.
+
+    def importFlatfile(self, filename):
+        """Copies the records of the FlatfileMapping in filename into this
+        mapping, keeping their ids."""
+        flat = FlatfileMapping(filename)
+        self.lock.acquire()
+        try:
+            for (id, s) in flat:
+                self.set(id, s)
+            if flat.currentId > self.nextId:
+                # Ids the flatfile gave out to since-removed records must not
+                # be given out again.
+                lastId = flat.currentId - 1
+                self._append('-%s\n' % lastId)
+                self.nextId = flat.currentId
+        finally:
+            self.lock.release()
+
+    def vacuum(self):
+        """Rewrites the file with only the latest version of each record.
+        Records changed while the copy is made are carried over at the end,
+        so other threads can keep using the mapping in the meantime."""
+        self.lock.acquire()
+        try:
+            if self.vacuuming:
+                return
+            self.vacuuming = True
+            live = sorted(self.index.iteritems())
+            lastId = self.nextId - 1
+            end = self.size
+        finally:
+            self.lock.release()
+        reader = file(self.filename, 'rb')
+        fd = utils.file.AtomicFile(self.filename, 'wb',
+                                   makeBackupIfSmaller=False)
+        try:
+            index = {}
+            pos = 0
+            for (id, (offset, length)) in live:
+                reader.seek(offset)
+                fd.write(reader.read(length))
+                index[id] = (pos, length)
+                pos += length
+            dead = 0
+            if lastId and lastId not in index:
+                # Keeps the highest id from being given out again.
+                line = '-%s\n' % lastId
+                fd.write(line)
+                dead += len(line)
+                pos += len(line)
+            self.lock.acquire()
+            try:
+                reader.seek(end)
+                fd.write(reader.read(self.size - end))
+                fd.close()
+                self.writer.close()
+                self.reader.close()
+                self.writer = file(self.filename, 'ab')
+                self.reader = file(self.filename, 'rb')
+                self.index = index
+                self.dead = dead
+                self.size = self._load(pos)
+                # Enough may have died while we were copying to warrant
+                # another pass.
+                self.vacuuming = False
+                self._maybeVacuum()
+            finally:
+                self.lock.release()
+        except:
+            fd.rollback()
+            self.vacuuming = False
+            raise
+        finally:
+            reader.close()
+
+    def flush(self):
+        self.lock.acquire()
+        try:
+            self.writer.flush()
+        finally:
+            self.lock.release()
+
+    def close(self):
+        # A vacuum may start another before it finishes.  Vacuum threads are
+        # only started with the lock held, so checking under it can't see a
+        # thread that's been made but not started yet.
+        while True:
+            self.lock.acquire()
+            try:
+                thread = self.vacuumThread
+                if thread is None or not thread.isAlive():
+                    self.writer.close()
+                    self.reader.close()
+                    return
+            finally:
+                self.lock.release()
+            thread.join()
+
+
 class CdbMapping(MappingInterface):
     def __init__(self, filename, **kwargs):
         self.filename = filename
@@ -381,6 +609,7 @@ class DB(object):
 Mappings = {
     'cdb': CdbMapping,
     'flat': FlatfileMapping,
+    'indexed': IndexedMapping,
     }
 
 
@@ -0,0 +1,230 @@
+###
+# Copyright (c) 2002-2004, Jeremiah Fincher
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+###
+
+
+"""
+Contains a socket driver that multiplexes every connection through a single
+select (or poll) call, rather than blocking on each socket in turn.
+"""
+
+from __future__ import division
+
+import os
+import time
+import errno
+import select
+import socket
+
+import supybot.conf as conf
+import supybot.drivers as drivers
+import supybot.schedule as schedule
+from supybot.drivers.Socket import SocketDriver
+
+if hasattr(select, 'poll'):
+    _readFlags = select.POLLIN | select.POLLPRI | \
+                 select.POLLHUP | select.POLLERR
+    def _wait(readers, writers, timeout):
+        """Waits up to timeout seconds for any of the given file descriptors
+        to become ready.  Returns a (readable, writable) pair of lists."""
+        poller = select.poll()
+        for fd in readers:
+            if fd in writers:
+                poller.register(fd, _readFlags | select.POLLOUT)
+            else:
+                poller.register(fd, _readFlags)
+        for fd in writers:
+            if fd not in readers:
+                poller.register(fd, select.POLLOUT)
+        readable = []
+        writable = []
+        for (fd, flags) in poller.poll(int(timeout * 1000)):
+            if flags & _readFlags:
+                readable.append(fd)
+            if flags & select.POLLOUT:
+                writable.append(fd)
+        return (readable, writable)
+else:
+    def _wait(readers, writers, timeout):
+        """Waits up to timeout seconds for any of the given file descriptors
+        to become ready.  Returns a (readable, writable) pair of lists."""
+        if not readers and not writers:
+            # Windows' select refuses to wait on nothing.
+            time.sleep(timeout)
+            return ([], [])
+        (readable, writable, _) = select.select(readers, writers, [], timeout)
+        return (readable, writable)
+
+class SelectDriver(SocketDriver):
+    """A SocketDriver whose socket is serviced by the SelectReactor, rather
+    than by its own run method."""
+    def __init__(self, irc):
+        reactor.register(self)
+        SocketDriver.__init__(self, irc)
+
+    def run(self):
+        # The reactor does all our reading and writing for us.
+        pass
+
+    def wakeup(self):
+        reactor.wakeup()
+
+    def _reallyDie(self):
+        reactor.unregister(self)
+        SocketDriver._reallyDie(self)
+
+
+class SelectReactor(drivers.IrcDriver):
+    """Waits on the sockets of every SelectDriver at once, as well as on the
+    next scheduled event, and services only those sockets that are ready.
+    This way an idle network doesn't add any latency to the others."""
+    def __init__(self):
+        drivers.IrcDriver.__init__(self)
+        self.drivers = []
+        # Threads (threaded commands and the like) that queue messages
+        # write a byte to this pipe so we stop waiting and send them right
+        # away, rather than on the next poll.  Windows' select only takes
+        # sockets, so there we just wait out the poll.
+        self.wakeFds = None
+        if os.name == 'posix':
+            import fcntl
+            self.wakeFds = os.pipe()
+            for fd in self.wakeFds:
+                flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+                fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+
+    def name(self):
+        return self.__class__.__name__
+
+    def register(self, driver):
+        if driver not in self.drivers:
+            self.drivers.append(driver)
+
+    def unregister(self, driver):
+        if driver in self.drivers:
+            self.drivers.remove(driver)
+
+    def wakeup(self):
+        """Makes the reactor stop waiting as soon as possible.  Safe to call
+        from any thread."""
+        if self.wakeFds is not None:
+            try:
+                os.write(self.wakeFds[1], 'x')
+            except OSError, e:
+                # If the pipe is full, we're already going to wake up.
+                if e.args[0] != errno.EAGAIN:
+                    raise
+
+    def _drainWakeups(self):
+        try:
+            while os.read(self.wakeFds[0], 512):
+                pass
+        except OSError, e:
+            if e.args[0] != errno.EAGAIN:
+                raise
+
+    def _connected(self):
+        return [driver for driver in self.drivers
+                if driver.connected and driver.irc is not None]
+
+    def _getTimeout(self, now):
+        timeout = conf.supybot.drivers.poll()
+        when = schedule.nextTime()
+        if when is not None:
+            timeout = min(timeout, when - now)
+        for driver in self._connected():
+            irc = driver.irc
+            if irc.fastqueue:
+                return 0
+            elif irc.queue:
+                timeout = min(timeout, irc.queue.nextTime(now))
+        return max(timeout, 0)
+
+    def _service(self, driver, f):
+        try:
+            return f()
+        except Exception:
+            drivers.log.exception('Uncaught exception servicing %s:',
+                                  driver.name())
+            return False
+
+    def run(self):
+        # First, get anything that's already queued onto the wire, so we
+        # know which sockets we need to wait for writability on.
+        for driver in self._connected():
+            self._service(driver, driver._sendIfMsgs)
+        readers = {}
+        writers = {}
+        if self.wakeFds is not None:
+            readers[self.wakeFds[0]] = None
+        for driver in self._connected():
+            try:
+                fd = driver.conn.fileno()
+            except socket.error, e:
+                drivers.log.warning('Skipping %s, its socket is unusable: %s',
+                                    driver.name(), e)
+                continue
+            readers[fd] = driver
+            if driver.outbuffer:
+                writers[fd] = driver
+        timeout = self._getTimeout(time.time())
+        try:
+            (readable, writable) = _wait(readers.keys(), writers.keys(),
+                                         timeout)
+        except select.error, e:
+            # If we were interrupted by a signal, we'll just wait again the
+            # next time we're run; anything else, we can't do anything about
+            # here, and we don't want it to kill the reactor.
+            if e.args[0] != errno.EINTR:
+                drivers.log.error('Error waiting on sockets: %s', e)
+            return
+        ready = []
+        for fd in readable:
+            driver = readers[fd]
+            if driver is None:
+                self._drainWakeups()
+                continue
+            ready.append(driver)
+            self._service(driver, driver._read)
+        for fd in writable:
+            driver = writers[fd]
+            if driver not in ready:
+                ready.append(driver)
+        for driver in ready:
+            if driver.connected and driver.irc is not None and \
+               not driver.irc.zombie:
+                self._service(driver, driver._sendIfMsgs)
+
+Driver = SelectDriver
+
+try:
+    ignore(reactor)
+except NameError:
+    reactor = SelectReactor()
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
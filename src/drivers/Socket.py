@@ -43,7 +43,6 @@ import supybot.utils as utils
 import supybot.world as world
 import supybot.drivers as drivers
 import supybot.schedule as schedule
-from supybot.utils.iter import imap
 
 class SocketDriver(drivers.IrcDriver, drivers.ServersMixin):
     def __init__(self, irc):
@@ -53,8 +52,8 @@ class SocketDriver(drivers.IrcDriver, drivers.ServersMixin):
         self.conn = None
         self.servers = ()
         self.eagains = 0
-        self.inbuffer = ''
-        self.outbuffer = ''
+        self.inbuffer = drivers.ReadBuffer(conf.supybot.drivers.bufferSize())
+        self.outbuffer = drivers.WriteBuffer()
         self.zombie = False
         self.scheduled = None
         self.connected = False
@@ -92,17 +91,21 @@ class SocketDriver(drivers.IrcDriver, drivers.ServersMixin):
             log.debug('Got EAGAIN, current count: %s.', self.eagains)
             self.eagains += 1
 
+    def _handleEOF(self):
+        drivers.log.disconnect(self.currentServer, 'Connection closed.')
+        self.conn.close()
+        self.connected = False
+        self.scheduleReconnect()
+
     def _sendIfMsgs(self):
         if not self.zombie:
-            msgs = [self.irc.takeMsg()]
-            while msgs[-1] is not None:
-                msgs.append(self.irc.takeMsg())
-            del msgs[-1]
-            self.outbuffer += ''.join(imap(str, msgs))
+            msg = self.irc.takeMsg()
+            while msg is not None:
+                self.outbuffer.append(str(msg))
+                msg = self.irc.takeMsg()
         if self.outbuffer:
             try:
-                sent = self.conn.send(self.outbuffer)
-                self.outbuffer = self.outbuffer[sent:]
+                self.outbuffer.send(self.conn)
                 self.eagains = 0
             except socket.error, e:
                 self._handleSocketError(e)
@@ -116,22 +119,29 @@ class SocketDriver(drivers.IrcDriver, drivers.ServersMixin):
             time.sleep(conf.supybot.drivers.poll())
             return
         self._sendIfMsgs()
+        if not self._read():
+            return
+        if not self.irc.zombie:
+            self._sendIfMsgs()
+
+    def _read(self):
+        """Reads whatever is waiting on the socket and feeds any complete
+        lines to the Irc.  Returns False if the socket errored."""
         try:
-            self.inbuffer += self.conn.recv(1024)
+            if not self.inbuffer.recvFrom(self.conn):
+                # An empty read on a socket that select (or our timeout)
+                # considered readable means the server closed the connection.
+                self._handleEOF()
+                return False
             self.eagains = 0 # If we successfully recv'ed, we can reset this.
-            lines = self.inbuffer.split('\n')
-            self.inbuffer = lines.pop()
-            for line in lines:
-                msg = drivers.parseMsg(line)
-                if msg is not None:
-                    self.irc.feedMsg(msg)
+            for msg in drivers.parseLines(self.inbuffer.takeLines()):
+                self.irc.feedMsg(msg)
         except socket.timeout:
             pass
         except socket.error, e:
             self._handleSocketError(e)
-            return
-        if not self.irc.zombie:
-            self._sendIfMsgs()
+            return False
+        return True
 
     def connect(self, **kwargs):
         self.reconnect(reset=False, **kwargs)
@@ -147,6 +157,7 @@ class SocketDriver(drivers.IrcDriver, drivers.ServersMixin):
             self.irc.reset()
         else:
             drivers.log.debug('Not resetting %s.', self.irc)
+        self.inbuffer.clear()
         server = self._getNextServer()
         drivers.log.connect(self.currentServer)
         try:
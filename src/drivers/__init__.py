@@ -35,6 +35,7 @@ Contains various drivers (network, file, and otherwise) for using IRC objects.
 import sys
 import time
 import socket
+import collections
 
 import supybot.conf as conf
 import supybot.utils as utils
@@ -63,6 +64,12 @@ class IrcDriver(object):
     def reconnect(self, wait=False):
         raise NotImplementedError
 
+    def wakeup(self):
+        """Called when a message is queued from outside the driver loop (by a
+        threaded command, for instance).  Drivers that block waiting for
+        input can override this to notice the message sooner."""
+        pass
+
     def name(self):
         return repr(self)
 
@@ -209,6 +216,127 @@ def newDriver(irc, moduleName=None):
     irc.driver = driver
     return driver
 
+class ReadBuffer(object):
+    """A reusable receive buffer that frames incoming data into lines.
+
+    Data is read directly into a preallocated bytearray, and we remember how
+    far we've already looked for a newline, so neither a big burst of input
+    nor a long partial line causes the whole buffer to be copied or rescanned
+    on every read.
+    """
+    def __init__(self, size=8192):
+        self.buffer = bytearray(size)
+        self.start = 0 # Start of the data we haven't handed out yet.
+        self.end = 0 # End of the data we've received.
+        self.scanned = 0 # Everything before this is known not to be '\n'.
+
+    def __len__(self):
+        return self.end - self.start
+
+    def clear(self):
+        self.start = self.end = self.scanned = 0
+
+    def _makeRoom(self):
+        if self.start:
+            # Move the partial line we're holding onto to the front.
+            n = self.end - self.start
+            self.buffer[:n] = self.buffer[self.start:self.end]
+            self.scanned -= self.start
+            self.start = 0
+            self.end = n
+        else:
+            # The partial line fills the whole buffer; it'll have to grow.
+            self.buffer.extend(bytearray(len(self.buffer)))
+
+    def recvFrom(self, conn):
+        """Reads as much as will fit from conn.  Returns the number of bytes
+        read, which will be 0 if the other end closed the connection."""
+        if self.end == len(self.buffer):
+            self._makeRoom()
+        n = conn.recv_into(memoryview(self.buffer)[self.end:])
+        self.end += n
+        return n
+
+    def feed(self, data):
+        """Adds data to the buffer as if it had been read from a socket."""
+        needed = self.end + len(data)
+        while needed > len(self.buffer):
+            self._makeRoom()
+            needed = self.end + len(data)
+        self.buffer[self.end:needed] = data
+        self.end = needed
+
+    def takeLines(self):
+        """Returns every complete line in the buffer as a single string, minus
+        the last line's trailing '\n', and removes them from the buffer."""
+        i = self.buffer.rfind('\n', max(self.start, self.scanned), self.end)
+        if i == -1:
+            self.scanned = self.end
+            return ''
+        s = str(self.buffer[self.start:i])
+        self.start = i + 1
+        if self.start == self.end:
+            self.clear()
+        else:
+            self.scanned = self.start
+        return s
+
+    def lines(self):
+        """Returns a list of every complete line in the buffer, without their
+        trailing '\n', and removes them from the buffer."""
+        s = self.takeLines()
+        if not s:
+            return []
+        return s.split('\n')
+
+
+class WriteBuffer(object):
+    """A queue of outgoing chunks.  Partial sends are tracked with an offset
+    into the first chunk rather than by reslicing everything that's left."""
+    # The most we'll coalesce into a single send; anything past it stays in
+    # the queue, so a big backlog isn't copied on every send.
+    sendSize = 16384
+    def __init__(self):
+        self.chunks = collections.deque()
+        self.offset = 0
+        self.length = 0
+
+    def __len__(self):
+        return self.length
+
+    def append(self, s):
+        if s:
+            self.chunks.append(s)
+            self.length += len(s)
+
+    def send(self, conn):
+        """Sends as much as conn will take.  Returns the number of bytes
+        sent."""
+        chunks = self.chunks
+        if len(chunks) > 1 and len(chunks[0]) - self.offset < self.sendSize:
+            # Coalesce the leading chunks so they're sent in as few packets as
+            # possible, up to sendSize.
+            L = [chunks.popleft()[self.offset:]]
+            size = len(L[0])
+            while chunks and size + len(chunks[0]) <= self.sendSize:
+                s = chunks.popleft()
+                L.append(s)
+                size += len(s)
+            chunks.appendleft(''.join(L))
+            self.offset = 0
+        chunk = self.chunks[0]
+        if self.offset:
+            sent = conn.send(memoryview(chunk)[self.offset:])
+        else:
+            sent = conn.send(chunk)
+        self.offset += sent
+        self.length -= sent
+        if self.offset == len(chunk):
+            self.chunks.popleft()
+            self.offset = 0
+        return sent
+
+
 def parseMsg(s):
     start = time.time()
     s = s.strip()
@@ -219,4 +347,17 @@ def parseMsg(s):
     else:
         return None
 
+def _malformed(line):
+    log.warning('Ignoring malformed message from the server: %r', line)
+
+def parseLines(buf):
+    """Returns the IrcMsgs in buf, a string of lines read from the server,
+    as parseMsg would parse them one at a time.  Malformed lines are logged
+    and skipped rather than stopping the rest from being handled."""
+    start = time.time()
+    msgs = ircmsgs.parseLines(buf, _malformed)
+    for msg in msgs:
+        msg.tag('receivedAt', start)
+    return msgs
+
 # vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -32,6 +32,7 @@ from __future__ import division
 
 import os
 import time
+import bisect
 import operator
 
 import supybot.log as log
@@ -127,11 +128,13 @@ class CapabilitySet(set):
         if self.__parent.__contains__(inverted):
             self.__parent.remove(inverted)
         self.__parent.add(capability)
+        capabilityCache.clear()
 
     def remove(self, capability):
         """Removes a capability from the set."""
         capability = ircutils.toLower(capability)
         self.__parent.remove(capability)
+        capabilityCache.clear()
 
     def __contains__(self, capability):
         capability = ircutils.toLower(capability)
@@ -399,6 +402,7 @@ class IrcChannel(object):
     def setDefaultCapability(self, b):
         """Sets the default capability in the channel."""
         self.defaultAllow = b
+        capabilityCache.clear()
 
     def _checkCapability(self, capability):
         """Checks whether a certain capability is allowed by the channel."""
@@ -556,9 +560,219 @@ class IrcChannelCreator(Creator):
             IrcChannelCreator.name = None
 
 
+class CapabilityCache(object):
+    """Holds the results of checkCapability, keyed by (user id, channel).
+
+    The user id is None for unknown users and the channel is None for
+    capabilities that aren't channel capabilities.  Anything changing a
+    user, a channel, or the default capabilities must invalidate the
+    appropriate entries.
+    """
+    def __init__(self):
+        self.table = {}
+        self.hits = 0
+        self.misses = 0
+        # Bumped on every invalidation, so a result computed while the
+        # databases were changing underneath us isn't stored.
+        self.generation = 0
+
+    def get(self, id, channel, capability):
+        try:
+            ret = self.table[(id, channel)][capability]
+            self.hits += 1
+            return ret
+        except KeyError:
+            self.misses += 1
+            raise
+
+    def set(self, id, channel, capability, ret, generation):
+        if generation == self.generation:
+            key = (id, channel)
+            try:
+                self.table[key][capability] = ret
+            except KeyError:
+                self.table[key] = {capability: ret}
+
+    def hitRatio(self):
+        """Returns the fraction of lookups answered from the cache."""
+        total = self.hits + self.misses
+        if total:
+            return self.hits / total
+        else:
+            return 0.0
+
+    def invalidateUser(self, id):
+        self.generation += 1
+        for key in self.table.keys():
+            if key[0] == id:
+                del self.table[key]
+
+    def invalidateChannel(self, channel):
+        self.generation += 1
+        channel = ircutils.toLower(channel)
+        for key in self.table.keys():
+            if key[1] == channel:
+                del self.table[key]
+
+    def clear(self):
+        self.generation += 1
+        self.table.clear()
+
+
 class DuplicateHostmask(ValueError):
     pass
 
+def _literalHead(s):
+    """Returns the part of the pattern s before its first wildcard."""
+    for (i, c) in enumerate(s):
+        if c == '*' or c == '?':
+            return s[:i]
+    return s
+
+def _literalTail(s):
+    """Returns the part of the pattern s after its last wildcard."""
+    return s[max(s.rfind('*'), s.rfind('?'))+1:]
+
+class HostmaskIndex(object):
+    """Indexes users' hostmasks by their literal (non-wildcard) parts.
+
+    Anything a hostmask pattern matches must end with the pattern's literal
+    tail and start with its literal head (the nick prefix); if the pattern
+    has a single '@', the host must also start with the literal part just
+    after it.  Each pattern is bucketed under the longest of these, so a
+    lookup returns the handful of users whose patterns could possibly match,
+    and those users are then checked as usual.
+    """
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        # Each of these is a (tail, host head, nick head) triple.  The
+        # forward dicts map literals to sets of user ids, and lengths counts
+        # how many of those literals there are of each length.  The reverse
+        # lists hold every pattern's (literal, id) pairs, sorted, so we can
+        # find all the literals starting with a given one.  Tails are
+        # reversed in them, so that works for tails too.
+        self.forward = ({}, {}, {})
+        self.lengths = ({}, {}, {})
+        self.reverse = ([], [], [])
+        self.reverseKeys = {}
+        # Users with patterns we can't index (like *!*@*) or that have more
+        # than one '@'.  These are always candidates.
+        self.unindexed = set()
+        self.keys = {}
+
+    def _literals(self, pattern):
+        pattern = ircutils.toLower(pattern)
+        if pattern.count('@') == 1:
+            hostHead = _literalHead(pattern.split('@', 1)[1])
+        else:
+            hostHead = None
+        return (_literalTail(pattern), hostHead, _literalHead(pattern))
+
+    def _add(self, id, d, key, lengths=None):
+        try:
+            d[key].add(id)
+        except KeyError:
+            d[key] = set([id])
+            if lengths is not None:
+                lengths[len(key)] = lengths.get(len(key), 0) + 1
+        self.keys[id].append((d, key, lengths))
+
+    def _addForward(self, id, pattern):
+        (tail, hostHead, nickHead) = self._literals(pattern)
+        if hostHead is None:
+            self.unindexed.add(id)
+            return
+        (literal, i) = max((tail, 0), (hostHead, 1), (nickHead, 2),
+                           key=lambda (literal, _): len(literal))
+        if literal:
+            self._add(id, self.forward[i], literal, self.lengths[i])
+        else:
+            self.unindexed.add(id)
+
+    def _addReverse(self, id, pattern):
+        (tail, hostHead, nickHead) = self._literals(pattern)
+        if hostHead is None:
+            self.unindexed.add(id)
+            return
+        literals = (tail[::-1], hostHead, nickHead)
+        for (L, literal) in zip(self.reverse, literals):
+            if literal:
+                bisect.insort(L, (literal, id))
+                self.reverseKeys[id].append((L, (literal, id)))
+
+    def add(self, id, user):
+        """(Re)indexes the hostmasks and authenticated hostmasks of user."""
+        self.remove(id)
+        self.keys[id] = []
+        self.reverseKeys[id] = []
+        for hostmask in user.hostmasks:
+            self._addForward(id, hostmask)
+            self._addReverse(id, hostmask)
+        for (_, authmask) in user.auth:
+            self._addForward(id, authmask)
+
+    def remove(self, id):
+        self.unindexed.discard(id)
+        for (d, key, lengths) in self.keys.pop(id, ()):
+            # The same key may have been added for more than one hostmask.
+            ids = d.get(key)
+            if ids is not None:
+                ids.discard(id)
+                if not ids:
+                    del d[key]
+                    if lengths is not None:
+                        lengths[len(key)] -= 1
+                        if not lengths[len(key)]:
+                            del lengths[len(key)]
+        for (L, entry) in self.reverseKeys.pop(id, ()):
+            i = bisect.bisect_left(L, entry)
+            if i < len(L) and L[i] == entry:
+                del L[i]
+
+    def candidates(self, hostmask):
+        """Returns the set of ids of users who might have a hostmask or
+        authentication matching hostmask, or None if everyone might."""
+        s = ircutils.toLower(hostmask)
+        if s.count('@') != 1:
+            return None
+        host = s.split('@', 1)[1]
+        ids = set(self.unindexed)
+        (tails, hostHeads, nickHeads) = self.forward
+        for n in self.lengths[0]:
+            if n <= len(s) and s[-n:] in tails:
+                ids.update(tails[s[-n:]])
+        for n in self.lengths[1]:
+            if host[:n] in hostHeads:
+                ids.update(hostHeads[host[:n]])
+        for n in self.lengths[2]:
+            if s[:n] in nickHeads:
+                ids.update(nickHeads[s[:n]])
+        return ids
+
+    def matchedBy(self, pattern):
+        """Returns the set of ids of users who might have a hostmask that
+        pattern matches, or None if everyone might."""
+        (tail, hostHead, nickHead) = self._literals(pattern)
+        if hostHead is None:
+            return None
+        (literal, i) = max((tail, 0), (hostHead, 1), (nickHead, 2),
+                           key=lambda (literal, _): len(literal))
+        if not literal:
+            return None
+        if i == 0:
+            literal = literal[::-1]
+        L = self.reverse[i]
+        ids = set(self.unindexed)
+        for j in xrange(bisect.bisect_left(L, (literal,)), len(L)):
+            (key, id) = L[j]
+            if not key.startswith(literal):
+                break
+            ids.add(id)
+        return ids
+
+
 class UsersDictionary(utils.IterableMap):
     """A simple serialized-to-file User Database."""
     def __init__(self):
@@ -568,6 +782,11 @@ class UsersDictionary(utils.IterableMap):
         self.nextId = 0
         self._nameCache = utils.structures.CacheDict(1000)
         self._hostmaskCache = utils.structures.CacheDict(1000)
+        # Hostmasks we've recently found no user for.
+        self._missCache = utils.structures.CacheDict(1000)
+        self._hostmaskIndex = HostmaskIndex()
+        self._names = {}
+        self._namesById = {}
 
     # This is separate because the Creator has to access our instance.
     def open(self, filename):
@@ -593,6 +812,11 @@ class UsersDictionary(utils.IterableMap):
         self.users.clear()
         self._nameCache.clear()
         self._hostmaskCache.clear()
+        self._missCache.clear()
+        self._hostmaskIndex.clear()
+        self._names.clear()
+        self._namesById.clear()
+        capabilityCache.clear()
         if self.filename is not None:
             try:
                 self.open(self.filename)
@@ -633,9 +857,14 @@ class UsersDictionary(utils.IterableMap):
             try:
                 return self._hostmaskCache[s]
             except KeyError:
+                if s in self._missCache:
+                    raise KeyError, s
+                candidates = self._hostmaskIndex.candidates(s)
+                if candidates is None:
+                    candidates = self.users.keys()
                 ids = {}
-                for (id, user) in self.users.iteritems():
-                    x = user.checkHostmask(s)
+                for id in candidates:
+                    x = self.users[id].checkHostmask(s)
                     if x:
                         ids[id] = x
                 if len(ids) == 1:
@@ -647,6 +876,7 @@ class UsersDictionary(utils.IterableMap):
                         self._hostmaskCache[id] = set([s])
                     return id
                 elif len(ids) == 0:
+                    self._missCache[s] = True
                     raise KeyError, s
                 else:
                     log.error('Multiple matches found in user database.  '
@@ -654,19 +884,17 @@ class UsersDictionary(utils.IterableMap):
                     for (id, hostmask) in ids.iteritems():
                         log.error('Removing %q from user %s.', hostmask, id)
                         self.users[id].removeHostmask(hostmask)
+                        self._hostmaskIndex.add(id, self.users[id])
                     raise DuplicateHostmask, 'Ids %r matched.' % ids
         else: # Not a hostmask, must be a name.
             s = s.lower()
             try:
                 return self._nameCache[s]
             except KeyError:
-                for (id, user) in self.users.items():
-                    if s == user.name.lower():
-                        self._nameCache[s] = id
-                        self._nameCache[id] = s
-                        return id
-                else:
-                    raise KeyError, s
+                id = self._names[s]
+                self._nameCache[s] = id
+                self._nameCache[id] = s
+                return id
 
     def getUser(self, id):
         """Returns a user given its id, name, or hostmask."""
@@ -692,6 +920,9 @@ class UsersDictionary(utils.IterableMap):
         return len(self.users)
 
     def invalidateCache(self, id=None, hostmask=None, name=None):
+        # Any change might make a hostmask we couldn't find a user for
+        # recognizable.
+        self._missCache.clear()
         if hostmask is not None:
             if hostmask in self._hostmaskCache:
                 id = self._hostmaskCache.pop(hostmask)
@@ -702,6 +933,7 @@ class UsersDictionary(utils.IterableMap):
             del self._nameCache[self._nameCache[id]]
             del self._nameCache[id]
         if id is not None:
+            capabilityCache.invalidateUser(id)
             if id in self._nameCache:
                 del self._nameCache[self._nameCache[id]]
                 del self._nameCache[id]
@@ -710,8 +942,20 @@ class UsersDictionary(utils.IterableMap):
                     del self._hostmaskCache[hostmask]
                 del self._hostmaskCache[id]
 
+    def _setName(self, id, name):
+        if id in self._namesById:
+            del self._names[self._namesById.pop(id)]
+        if name is not None:
+            name = name.lower()
+            self._names[name] = id
+            self._namesById[id] = name
+
     def setUser(self, user, flush=True):
-        """Sets a user (given its id) to the IrcUser given it."""
+        """Sets a user (given its id) to the IrcUser given it.
+
+        This must be called after changing a user's name, hostmasks, or
+        authentication, so the user can be found by them.
+        """
         self.nextId = max(self.nextId, user.id)
         try:
             if self.getUserId(user.name) != user.id:
@@ -719,7 +963,14 @@ class UsersDictionary(utils.IterableMap):
         except KeyError:
             pass
         for hostmask in user.hostmasks:
-            for (i, u) in self.iteritems():
+            candidates = self._hostmaskIndex.candidates(hostmask)
+            matched = self._hostmaskIndex.matchedBy(hostmask)
+            if candidates is None or matched is None:
+                ids = self.users.keys()
+            else:
+                ids = candidates | matched
+            for i in ids:
+                u = self.users[i]
                 if i == user.id:
                     continue
                 elif u.checkHostmask(hostmask):
@@ -734,12 +985,17 @@ class UsersDictionary(utils.IterableMap):
                         raise DuplicateHostmask, hostmask
         self.invalidateCache(user.id)
         self.users[user.id] = user
+        self._setName(user.id, user.name)
+        self._hostmaskIndex.add(user.id, user)
         if flush:
             self.flush()
 
     def delUser(self, id):
         """Removes a user from the database."""
         del self.users[id]
+        self._setName(id, None)
+        self._hostmaskIndex.remove(id)
+        capabilityCache.invalidateUser(id)
         if id in self._nameCache:
             del self._nameCache[self._nameCache[id]]
             del self._nameCache[id]
@@ -809,6 +1065,7 @@ class ChannelsDictionary(utils.IterableMap):
         """Reloads the channel database from its file."""
         if self.filename is not None:
             self.channels.clear()
+            capabilityCache.clear()
             try:
                 self.open(self.filename)
             except EnvironmentError, e:
@@ -830,6 +1087,7 @@ class ChannelsDictionary(utils.IterableMap):
         """Sets a given channel to the IrcChannel object given."""
         channel = channel.lower()
         self.channels[channel] = ircChannel
+        capabilityCache.invalidateChannel(channel)
         self.flush()
 
     def iteritems(self):
@@ -907,6 +1165,8 @@ class IgnoresDB(object):
         del self.hostmasks[hostmask]
 
 
+capabilityCache = CapabilityCache()
+
 confDir = conf.supybot.directories.conf()
 try:
     userFile = os.path.join(confDir, conf.supybot.databases.users.filename())
@@ -1009,22 +1269,8 @@ def _checkCapabilityForUnknownUser(capability, users=users, channels=channels):
     else:
         return _x(capability, conf.supybot.capabilities.default())
 
-def checkCapability(hostmask, capability, users=users, channels=channels):
-    """Checks that the user specified by name/hostmask has the capability given.
-    """
-    if world.testing:
-        return _x(capability, True)
-    try:
-        u = users.getUser(hostmask)
-        if u.secure and not u.checkHostmask(hostmask, useAuth=False):
-            raise KeyError
-    except KeyError:
-        # Raised when no hostmasks match.
-        return _checkCapabilityForUnknownUser(capability, users=users,
-                                              channels=channels)
-    except ValueError, e:
-        # Raised when multiple hostmasks match.
-        log.warning('%s: %s', hostmask, e)
+def _resolveCapability(u, capability, users=users, channels=channels):
+    if u is None:
         return _checkCapabilityForUnknownUser(capability, users=users,
                                               channels=channels)
     if capability in u.capabilities:
@@ -1049,6 +1295,44 @@ def checkCapability(hostmask, capability, users=users, channels=channels):
         else:
             return _x(capability, conf.supybot.capabilities.default())
 
+def checkCapability(hostmask, capability, users=users, channels=channels):
+    """Checks that the user specified by name/hostmask has the capability given.
+    """
+    if world.testing:
+        return _x(capability, True)
+    try:
+        u = users.getUser(hostmask)
+        if u.secure and not u.checkHostmask(hostmask, useAuth=False):
+            raise KeyError
+    except KeyError:
+        # Raised when no hostmasks match.
+        u = None
+    except ValueError, e:
+        # Raised when multiple hostmasks match.
+        log.warning('%s: %s', hostmask, e)
+        u = None
+    # Only the global databases are cached; the cache can't tell other
+    # UsersDictionary or ChannelsDictionary instances apart.
+    if users is not globals()['users'] or \
+       channels is not globals()['channels']:
+        return _resolveCapability(u, capability, users, channels)
+    if u is None:
+        id = None
+    else:
+        id = u.id
+    if isChannelCapability(capability):
+        channel = ircutils.toLower(fromChannelCapability(capability)[0])
+    else:
+        channel = None
+    key = ircutils.toLower(capability)
+    try:
+        return capabilityCache.get(id, channel, key)
+    except KeyError:
+        generation = capabilityCache.generation
+        ret = _resolveCapability(u, capability, users, channels)
+        capabilityCache.set(id, channel, key, ret, generation)
+        return ret
+
 
 def checkCapabilities(hostmask, capabilities, requireAll=False):
     """Checks that a user has capabilities in a list.
@@ -1076,6 +1360,7 @@ class DefaultCapabilities(registry.SpaceSeparatedListOfStrings):
     # it's still an improvement, raising the bar for potential crackers.
     def setValue(self, v, allowDefaultOwner=conf.allowDefaultOwner):
         registry.SpaceSeparatedListOfStrings.setValue(self, v)
+        capabilityCache.clear()
         if '-owner' not in self.value and not allowDefaultOwner:
             print '*** You must run supybot with the --allow-default-owner'
             print '*** option in order to allow a default capability of owner.'
@@ -1091,8 +1376,13 @@ conf.registerGlobalValue(conf.supybot, 'capabilities',
     to override these capabilities.  See docs/CAPABILITIES if you don't
     understand why these default to what they do."""))
 
+class DefaultAllow(registry.Boolean):
+    def setValue(self, v):
+        registry.Boolean.setValue(self, v)
+        capabilityCache.clear()
+
 conf.registerGlobalValue(conf.supybot.capabilities, 'default',
-    registry.Boolean(True, """Determines whether the bot by default will allow
+    DefaultAllow(True, """Determines whether the bot by default will allow
     users to have a capability.  If this is disabled, a user must explicitly
     have the capability for whatever command he wishes to run."""))
 
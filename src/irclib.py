@@ -30,7 +30,9 @@
 import re
 import copy
 import time
+import Queue
 import random
+import threading
 
 import supybot.log as log
 import supybot.conf as conf
@@ -40,6 +42,7 @@ import supybot.ircdb as ircdb
 import supybot.ircmsgs as ircmsgs
 import supybot.ircutils as ircutils
 
+from collections import deque
 from utils.str import rsplit
 from utils.iter import imap, chain, cycle
 from utils.structures import queue, smallqueue, RingBuffer
@@ -66,9 +69,16 @@ class IrcCallback(IrcCommandDispatcher):
     Callbacks derived from this class should have methods of the form
     "doCommand" -- doPrivmsg, doNick, do433, etc.  These will be called
     on matching messages.
+
+    A callback whose handling of a message doesn't depend on which other
+    callbacks have handled it, or on irc.state having been updated only as far
+    as that message, can set commutative to True; it'll then be run in one of
+    its network's worker lanes rather than on the driver thread.  It must be
+    safe to call from a thread other than the one running its commands.
     """
     callAfter = ()
     callBefore = ()
+    commutative = False
     __metaclass__ = log.MetaFirewall
     __firewalled__ = {'die': None,
                       'reset': None,
@@ -139,6 +149,140 @@ class IrcCallback(IrcCommandDispatcher):
         """Makes the callback die.  Called when the parent Irc object dies."""
         pass
 
+class LatencyHistogram(object):
+    """Counts how long something took, in powers-of-ten buckets of
+    seconds."""
+    bounds = (0.001, 0.01, 0.1, 1, 10)
+    def __init__(self):
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.total = 0.0
+        self.max = 0.0
+
+    def __len__(self):
+        return sum(self.counts)
+
+    def record(self, elapsed):
+        i = 0
+        for bound in self.bounds:
+            if elapsed < bound:
+                break
+            i += 1
+        self.counts[i] += 1
+        self.total += elapsed
+        if elapsed > self.max:
+            self.max = elapsed
+
+    def average(self):
+        n = len(self)
+        if not n:
+            return 0.0
+        return self.total / n
+
+    def buckets(self):
+        """Returns a list of (upper bound, count) pairs for the buckets
+        anything has been counted in; the last bucket's bound is None."""
+        bounds = self.bounds + (None,)
+        return [(bound, count) for (bound, count) in zip(bounds, self.counts)
+                if count]
+
+
+class Lanes(object):
+    """Worker threads running an Irc's commutative callbacks.  Each callback
+    is given a lane (the least busy one) the first time it's needed and stays
+    in it, so it handles the network's messages in the order they came in,
+    while a slow callback only holds up those sharing its lane."""
+    # How many messages a lane will hold before the driver thread waits for
+    # it, so a callback that can't keep up doesn't grow without bound.
+    maxQueued = 1000
+    def __init__(self, name, n):
+        self.name = name
+        self.n = n
+        self.lock = threading.Lock()
+        self.queues = []
+        self.threads = []
+        self.assigned = {} # callback -> index of its lane.
+        self.latencies = {} # name -> LatencyHistogram
+
+    def __len__(self):
+        return self.n
+
+    def _lane(self, callback):
+        try:
+            return self.queues[self.assigned[callback]]
+        except KeyError:
+            pass
+        self.lock.acquire()
+        try:
+            if len(self.queues) < self.n:
+                q = Queue.Queue(self.maxQueued)
+                t = threading.Thread(target=self._work, args=(q,),
+                                     name='Lane #%s for %s' %
+                                     (len(self.queues), self.name))
+                t.setDaemon(True)
+                self.queues.append(q)
+                self.threads.append(t)
+                t.start()
+                i = len(self.queues) - 1
+            else:
+                loads = [0] * len(self.queues)
+                for j in self.assigned.itervalues():
+                    loads[j] += 1
+                i = loads.index(min(loads))
+            self.assigned[callback] = i
+            self.latencies.setdefault(callback.name(), LatencyHistogram())
+            return self.queues[i]
+        finally:
+            self.lock.release()
+
+    def _work(self, q):
+        while True:
+            job = q.get()
+            try:
+                if job is None:
+                    return
+                (irc, callback, msg) = job
+                histogram = self.latencies[callback.name()]
+                start = time.time()
+                try:
+                    callback(irc, msg)
+                except Exception:
+                    log.exception('Uncaught exception in callback:')
+                histogram.record(time.time() - start)
+            finally:
+                q.task_done()
+
+    def put(self, irc, callback, msg):
+        """Queues msg to be given to callback in its lane."""
+        self._lane(callback).put((irc, callback, msg))
+
+    def join(self):
+        """Waits for every message queued so far to be handled."""
+        if threading.currentThread() in self.threads:
+            return # We'd be waiting on ourself.
+        for q in self.queues:
+            q.join()
+
+    def forget(self, callback):
+        """Waits for callback's queued messages to be handled, and forgets
+        its lane, so it can be removed."""
+        if callback in self.assigned:
+            self.join()
+            self.lock.acquire()
+            try:
+                del self.assigned[callback]
+            finally:
+                self.lock.release()
+
+    def stop(self):
+        """Handles what's queued, then stops the lanes' threads."""
+        for q in self.queues:
+            q.put(None)
+        self.join()
+        self.queues = []
+        self.threads = []
+        self.assigned.clear()
+
+
 ###
 # Basic queue for IRC messages.  It doesn't presently (but should at some
 # later point) reorder messages based on priority or penalty calculations.
@@ -225,14 +369,312 @@ class IrcMsgQueue(object):
     __str__ = __repr__
 
 
+class ThrottledQueue(IrcMsgQueue):
+    """The original outgoing scheduler: an IrcMsgQueue that gives out at most
+    one message every supybot.protocols.irc.throttleTime seconds."""
+    __slots__ = ('lastTake',)
+    def __init__(self, irc=None):
+        IrcMsgQueue.__init__(self)
+
+    def reset(self):
+        IrcMsgQueue.reset(self)
+        self.lastTake = 0
+
+    def nextTime(self, now):
+        """Returns how many seconds until a message can be dequeued, or None
+        if the queue is empty."""
+        if not self:
+            return None
+        throttle = conf.supybot.protocols.irc.throttleTime()
+        return max(0, self.lastTake + throttle - now)
+
+    def dequeue(self, now=None):
+        if now is None:
+            now = time.time()
+        if now - self.lastTake <= conf.supybot.protocols.irc.throttleTime():
+            log.debug('Irc.takeMsg throttling.')
+            return None
+        self.lastTake = now
+        return IrcMsgQueue.dequeue(self)
+
+
+class TokenBucket(object):
+    """A bucket holding up to capacity tokens, refilled at rate tokens per
+    second."""
+    __slots__ = ('capacity', 'rate', 'tokens', 'last')
+    def __init__(self, capacity, rate, now):
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = capacity
+        self.last = now
+
+    def _refill(self, now):
+        if now > self.last:
+            self.tokens = min(self.capacity,
+                              self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+    def wait(self, cost, now):
+        """Returns how many seconds until cost tokens can be taken."""
+        self._refill(now)
+        cost = min(cost, self.capacity)
+        if self.tokens >= cost:
+            return 0
+        return (cost - self.tokens) / self.rate
+
+    def take(self, cost, now):
+        self._refill(now)
+        self.tokens -= min(cost, self.capacity)
+
+    def isFull(self, now):
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class PenaltyQueue(object):
+    """An outgoing scheduler modelled on the way servers penalize clients.
+
+    A server allows a client so many commands and so many bytes in a window
+    of time before it starts delaying (and eventually disconnecting) it; we
+    keep a token bucket for each, and don't send anything the buckets can't
+    pay for.  High priority messages (modes, kicks, nicks...) go first;
+    everything else is queued per target and the targets take turns, each
+    with a bucket of its own, so a long reply to one channel doesn't hold up
+    the others.  MODE changes queued for the same channel are merged into as
+    few lines as the server allows.
+    """
+    def __init__(self, irc=None):
+        self.irc = irc
+        self.reset()
+
+    def reset(self):
+        """Clears the queue."""
+        self.lastJoin = 0
+        self.length = 0
+        self.high = smallqueue()
+        self.targets = ircutils.IrcDict() # target -> deque of messages
+        self.rotation = deque() # The targets with messages waiting.
+        self.targetBuckets = ircutils.IrcDict()
+        self.settings = None
+        self.commands = None
+        self.bytes = None
+
+    def _maxModes(self):
+        # Like the Channel plugin, we assume only one mode per line unless
+        # the server says otherwise.
+        if self.irc is None:
+            return 1
+        return self.irc.state.supported.get('modes', 1)
+
+    def _target(self, msg):
+        if msg.args:
+            return msg.args[0]
+        return ''
+
+    def _merge(self, msg):
+        """Merges the MODE msg into the last high priority message to the
+        same channel, if that's a MODE as well.  Returns how many messages
+        were added to the queue, or None if they couldn't be merged."""
+        if msg.command != 'MODE' or msg.prefix or len(msg.args) < 2 or \
+           not ircutils.isChannel(msg.args[0]):
+            return None
+        n = self._maxModes()
+        if n < 2:
+            return None
+        channel = msg.args[0]
+        for i in xrange(len(self.high)-1, -1, -1):
+            last = self.high[i]
+            if last.args and ircutils.strEqual(last.args[0], channel):
+                break
+        else:
+            return None
+        if last.command != 'MODE' or last.prefix or len(last.args) < 2:
+            return None
+        try:
+            modes = ircutils.separateModes(last.args[1:]) + \
+                    ircutils.separateModes(msg.args[1:])
+        except (AssertionError, IndexError):
+            return None # Malformed; send them as they are.
+        merged = []
+        for j in xrange(0, len(modes), n):
+            args = [channel]
+            for arg in ircutils.joinModes(modes[j:j+n]):
+                if isinstance(arg, int):
+                    arg = str(arg)
+                args.append(arg)
+            merged.append(ircmsgs.IrcMsg(command='MODE', args=args))
+        self.high[i:i+1] = merged
+        return len(merged) - 1
+
+    def enqueue(self, msg):
+        """Enqueues a given message."""
+        if conf.supybot.protocols.irc.queuing.duplicates() and msg in self:
+            s = str(msg).strip()
+            log.info('Not adding message %q to queue, already added.', s)
+            return False
+        if msg.command in _high:
+            added = self._merge(msg)
+            if added is None:
+                self.high.enqueue(msg)
+                added = 1
+            self.length += added
+        else:
+            target = self._target(msg)
+            try:
+                self.targets[target].append(msg)
+            except KeyError:
+                self.targets[target] = deque([msg])
+                self.rotation.append(target)
+            self.length += 1
+        return True
+
+    def _buckets(self, now):
+        """Returns the (commands, bytes) buckets, or None if there's no limit
+        on what we can send."""
+        c = conf.supybot.protocols.irc.queuing.penalty
+        settings = (c.window(), c.commands(), c.bytes(), c.perTarget())
+        if settings != self.settings:
+            (window, commands, bytes, _) = settings
+            self.settings = settings
+            self.targetBuckets.clear()
+            if window > 0:
+                self.commands = TokenBucket(commands, commands/window, now)
+                self.bytes = TokenBucket(bytes, bytes/window, now)
+        if self.settings[0] <= 0:
+            return None
+        return (self.commands, self.bytes)
+
+    def _targetBucket(self, target, now):
+        try:
+            return self.targetBuckets[target]
+        except KeyError:
+            (window, _, _, perTarget) = self.settings
+            bucket = TokenBucket(perTarget, perTarget/window, now)
+            self.targetBuckets[target] = bucket
+            return bucket
+
+    def _prune(self, now):
+        # Buckets that have filled up again are no different from new ones.
+        if len(self.targetBuckets) > 2*len(self.targets) + 50:
+            for (target, bucket) in self.targetBuckets.items():
+                if target not in self.targets and bucket.isFull(now):
+                    del self.targetBuckets[target]
+
+    def _wait(self, buckets, msg, now):
+        (commands, bytes) = buckets
+        return max(commands.wait(1, now), bytes.wait(len(str(msg)), now))
+
+    def _charge(self, buckets, msg, now):
+        (commands, bytes) = buckets
+        commands.take(1, now)
+        bytes.take(len(str(msg)), now)
+
+    def _joinWait(self, msg, now):
+        if msg.command == 'JOIN':
+            limit = conf.supybot.protocols.irc.queuing.rateLimit.join()
+            return max(0, self.lastJoin + limit - now)
+        return 0
+
+    def nextTime(self, now):
+        """Returns how many seconds until a message can be dequeued, or None
+        if the queue is empty."""
+        if not self:
+            return None
+        buckets = self._buckets(now)
+        if self.high:
+            if buckets is None:
+                return 0
+            return self._wait(buckets, self.high[0], now)
+        wait = None
+        for target in self.rotation:
+            msg = self.targets[target][0]
+            t = self._joinWait(msg, now)
+            if buckets is not None:
+                t = max(t, self._targetBucket(target, now).wait(1, now),
+                        self._wait(buckets, msg, now))
+            if wait is None or t < wait:
+                wait = t
+        return wait
+
+    def dequeue(self, now=None):
+        """Dequeues the next message that can be sent now, if any."""
+        if now is None:
+            now = time.time()
+        buckets = self._buckets(now)
+        if self.high:
+            msg = self.high[0]
+            if buckets is not None:
+                if self._wait(buckets, msg, now):
+                    return None
+                self._charge(buckets, msg, now)
+            self.high.dequeue()
+            self.length -= 1
+            return msg
+        for _ in xrange(len(self.rotation)):
+            target = self.rotation[0]
+            msgs = self.targets[target]
+            msg = msgs[0]
+            if self._joinWait(msg, now):
+                self.rotation.rotate(-1)
+                continue
+            if buckets is not None:
+                bucket = self._targetBucket(target, now)
+                if bucket.wait(1, now):
+                    self.rotation.rotate(-1)
+                    continue
+                if self._wait(buckets, msg, now):
+                    return None
+                self._charge(buckets, msg, now)
+                bucket.take(1, now)
+            if msg.command == 'JOIN':
+                self.lastJoin = now
+            msgs.popleft()
+            self.length -= 1
+            self.rotation.popleft()
+            if msgs:
+                self.rotation.append(target)
+            else:
+                del self.targets[target]
+                if buckets is not None:
+                    self._prune(now)
+            return msg
+        return None
+
+    def __contains__(self, msg):
+        if msg in self.high:
+            return True
+        msgs = self.targets.get(self._target(msg))
+        return bool(msgs) and msg in msgs
+
+    def __nonzero__(self):
+        return bool(self.length)
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        return chain(self.high, *self.targets.values())
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, list(self))
+    __str__ = __repr__
+
+schedulers = {'throttle': ThrottledQueue, 'penalty': PenaltyQueue}
+
+
 ###
 # Maintains the state of IRC connection -- the most recent messages, the
 # status of various modes (especially ops/halfops/voices) in channels, etc.
 ###
 class ChannelState(utils.python.Object):
-    __slots__ = ('users', 'ops', 'halfops', 'bans',
-                 'voices', 'topic', 'modes', 'created')
+    # These are the attributes that make up the state of the channel; the
+    # others tie it to the ChannelDict (if any) that indexes its users.
+    _stateSlots = ('users', 'ops', 'halfops', 'bans',
+                   'voices', 'topic', 'modes', 'created')
+    __slots__ = _stateSlots + ('_channels', '_name')
     def __init__(self):
+        self._channels = None
+        self._name = None
         self.topic = ''
         self.created = 0
         self.ops = ircutils.IrcSet()
@@ -265,6 +707,8 @@ class ChannelState(utils.python.Object):
                 self.halfops.add(nick)
             elif marker == '+':
                 self.voices.add(nick)
+        if self._channels is not None and nick not in self.users:
+            self._channels._addNick(nick, self._name)
         self.users.add(nick)
 
     def replaceUser(self, oldNick, newNick):
@@ -272,6 +716,9 @@ class ChannelState(utils.python.Object):
         # Note that this doesn't have to have the sigil (@%+) that users
         # have to have for addUser; it just changes the name of the user
         # without changing any of his categories.
+        if self._channels is not None and oldNick in self.users:
+            self._channels._removeNick(oldNick, self._name)
+            self._channels._addNick(newNick, self._name)
         for s in (self.users, self.ops, self.halfops, self.voices):
             if oldNick in s:
                 s.remove(oldNick)
@@ -279,6 +726,8 @@ class ChannelState(utils.python.Object):
 
     def removeUser(self, user):
         """Removes a given user from the channel."""
+        if self._channels is not None and user in self.users:
+            self._channels._removeNick(user, self._name)
         self.users.discard(user)
         self.ops.discard(user)
         self.halfops.discard(user)
@@ -322,19 +771,65 @@ class ChannelState(utils.python.Object):
                     self.unsetMode(modeChar)
 
     def __getstate__(self):
-        return [getattr(self, name) for name in self.__slots__]
+        return [getattr(self, name) for name in self._stateSlots]
 
     def __setstate__(self, t):
-        for (name, value) in zip(self.__slots__, t):
+        self._channels = None
+        self._name = None
+        for (name, value) in zip(self._stateSlots, t):
             setattr(self, name, value)
 
     def __eq__(self, other):
         ret = True
-        for name in self.__slots__:
+        for name in self._stateSlots:
             ret = ret and getattr(self, name) == getattr(other, name)
         return ret
 
 
+class ChannelDict(ircutils.IrcDict):
+    """An IrcDict of channel names to ChannelStates which also keeps an index
+    of the channels each nick is in.  The index is kept up to date by the
+    ChannelStates' addUser, removeUser, and replaceUser methods; a ChannelState
+    can only be in one ChannelDict at a time."""
+    def __init__(self, dict=None):
+        self.nicks = ircutils.IrcDict() # nick -> IrcSet of channels.
+        super(ChannelDict, self).__init__(dict)
+
+    def _addNick(self, nick, channel):
+        try:
+            self.nicks[nick].add(channel)
+        except KeyError:
+            self.nicks[nick] = ircutils.IrcSet([channel])
+
+    def _removeNick(self, nick, channel):
+        channels = self.nicks.get(nick)
+        if channels is not None:
+            channels.discard(channel)
+            if not channels:
+                del self.nicks[nick]
+
+    def __setitem__(self, channel, chan):
+        if channel in self:
+            del self[channel]
+        super(ChannelDict, self).__setitem__(channel, chan)
+        if isinstance(chan, ChannelState):
+            if chan._channels is not None:
+                del chan._channels[chan._name]
+            chan._channels = self
+            chan._name = channel
+            for nick in chan.users:
+                self._addNick(nick, channel)
+
+    def __delitem__(self, channel):
+        chan = self[channel]
+        super(ChannelDict, self).__delitem__(channel)
+        if isinstance(chan, ChannelState) and chan._channels is self:
+            for nick in chan.users:
+                self._removeNick(nick, chan._name)
+            chan._channels = None
+            chan._name = None
+
+
 class IrcState(IrcCommandDispatcher):
     """Maintains state of the Irc connection.  Should also become smarter.
     """
@@ -349,11 +844,27 @@ class IrcState(IrcCommandDispatcher):
         if nicksToHostmasks is None:
             nicksToHostmasks = ircutils.IrcDict()
         if channels is None:
-            channels = ircutils.IrcDict()
+            channels = ChannelDict()
+        elif not isinstance(channels, ChannelDict):
+            channels = ChannelDict(channels)
         self.supported = supported
         self.history = history
         self.channels = channels
         self.nicksToHostmasks = nicksToHostmasks
+        self._clearChanges()
+
+    def _clearChanges(self):
+        # The channel membership changes made by the last message given to
+        # addMsg, so whichChannelsHad can see past them.
+        self.left = ircutils.IrcDict() # nick -> [channels it left]
+        self.joined = ircutils.IrcDict() # nick -> IrcSet of channels joined
+        self.gone = ircutils.IrcSet() # nicks that left every channel.
+
+    def _left(self, nick, channel):
+        self.left.setdefault(nick, []).append(channel)
+
+    def _joined(self, nick, channel):
+        self.joined.setdefault(nick, ircutils.IrcSet()).add(channel)
 
     def reset(self):
         """Resets the state to normal, unconnected state."""
@@ -361,6 +872,7 @@ class IrcState(IrcCommandDispatcher):
         self.channels.clear()
         self.supported.clear()
         self.nicksToHostmasks.clear()
+        self._clearChanges()
         self.history.resize(conf.supybot.protocols.irc.maxHistoryLength())
 
     def __reduce__(self):
@@ -385,6 +897,8 @@ class IrcState(IrcCommandDispatcher):
 
     def addMsg(self, irc, msg):
         """Updates the state based on the irc object and the message."""
+        if self.left or self.joined:
+            self._clearChanges()
         self.history.append(msg)
         if ircutils.isUserHostmask(msg.prefix) and not msg.command == 'NICK':
             self.nicksToHostmasks[msg.nick] = msg.prefix
@@ -400,6 +914,23 @@ class IrcState(IrcCommandDispatcher):
         """Returns the hostmask for a given nick."""
         return self.nicksToHostmasks[nick]
 
+    def channelsOf(self, nick):
+        """Returns the channels nick is in, as far as we know."""
+        return list(self.channels.nicks.get(nick, ()))
+
+    def whichChannelsHad(self, nick):
+        """Returns the channels nick was in before the last message given to
+        addMsg, i.e., the message callbacks are currently handling.  This is
+        what to use to find the channels someone who just quit or changed
+        nicks was in."""
+        if nick in self.gone:
+            return list(self.left[nick])
+        joined = self.joined.get(nick, ())
+        L = [channel for channel in self.channelsOf(nick)
+             if channel not in joined]
+        L.extend(self.left.get(nick, ()))
+        return L
+
     _005converters = utils.InsensitivePreservingDict({
         'modes': int,
         'keylen': int,
@@ -488,11 +1019,15 @@ class IrcState(IrcCommandDispatcher):
     def doJoin(self, irc, msg):
         for channel in msg.args[0].split(','):
             if channel in self.channels:
-                self.channels[channel].addUser(msg.nick)
+                chan = self.channels[channel]
+                if msg.nick not in chan.users:
+                    self._joined(msg.nick, channel)
+                chan.addUser(msg.nick)
             elif msg.nick: # It must be us.
                 chan = ChannelState()
                 chan.addUser(msg.nick)
                 self.channels[channel] = chan
+                self._joined(msg.nick, channel)
                 # I don't know why this assert was here.
                 #assert msg.nick == irc.nick, msg
 
@@ -530,7 +1065,10 @@ class IrcState(IrcCommandDispatcher):
                 continue
             if ircutils.strEqual(msg.nick, irc.nick):
                 del self.channels[channel]
+                self._left(msg.nick, channel)
             else:
+                if msg.nick in chan.users:
+                    self._left(msg.nick, channel)
                 chan.removeUser(msg.nick)
 
     def doKick(self, irc, msg):
@@ -539,13 +1077,19 @@ class IrcState(IrcCommandDispatcher):
         for user in users.split(','):
             if ircutils.strEqual(user, irc.nick):
                 del self.channels[channel]
+                self._left(user, channel)
                 return
             else:
+                if user in chan.users:
+                    self._left(user, channel)
                 chan.removeUser(user)
 
     def doQuit(self, irc, msg):
-        for channel in self.channels.itervalues():
-            channel.removeUser(msg.nick)
+        for name in self.channelsOf(msg.nick):
+            self._left(msg.nick, name)
+            self.channels[name].removeUser(msg.nick)
+        self.left.setdefault(msg.nick, [])
+        self.gone.add(msg.nick)
         if msg.nick in self.nicksToHostmasks:
             # If we're quitting, it may not be.
             del self.nicksToHostmasks[msg.nick]
@@ -575,8 +1119,13 @@ class IrcState(IrcCommandDispatcher):
             del self.nicksToHostmasks[oldNick]
         except KeyError:
             pass
-        for channel in self.channels.itervalues():
-            channel.replaceUser(oldNick, newNick)
+        for name in self.channelsOf(oldNick):
+            self._left(oldNick, name)
+            self._joined(newNick, name)
+            self.channels[name].replaceUser(oldNick, newNick)
+        if not ircutils.strEqual(oldNick, newNick):
+            self.left.setdefault(oldNick, [])
+            self.gone.add(oldNick)
 
 
 
@@ -606,12 +1155,21 @@ class Irc(IrcCommandDispatcher):
         self.network = network
         self.callbacks = callbacks
         self.state = IrcState()
-        self.queue = IrcMsgQueue()
+        self.queue = self._makeQueue()
         self.fastqueue = smallqueue()
         self.driver = None # The driver should set this later.
         self._setNonResettingVariables()
         self._queueConnectMessages()
         self.startedSync = ircutils.IrcDict()
+        self.latencies = {} # callback name -> LatencyHistogram
+        self.lanes = None
+        lanes = conf.supybot.protocols.irc.lanes()
+        if lanes and not world.testing:
+            self.lanes = Lanes(network, lanes)
+
+    def _makeQueue(self):
+        name = conf.supybot.protocols.irc.queuing.scheduler()
+        return schedulers[name](self)
 
     def isChannel(self, s):
         """Helper function to check whether a given string is a channel on
@@ -684,12 +1242,25 @@ class Irc(IrcCommandDispatcher):
             return cb.name().lower() == name
         (bad, good) = utils.iter.partition(nameMatches, self.callbacks)
         self.callbacks[:] = good
+        if self.lanes is not None:
+            for cb in bad:
+                self.lanes.forget(cb)
         return bad
 
+    def getLatencies(self):
+        """Returns a dictionary mapping the names of the callbacks to
+        LatencyHistograms of how long they've taken to handle messages."""
+        d = dict(self.latencies)
+        if self.lanes is not None:
+            d.update(self.lanes.latencies)
+        return d
+
     def queueMsg(self, msg):
         """Queues a message to be sent to the server."""
         if not self.zombie:
-            return self.queue.enqueue(msg)
+            ret = self.queue.enqueue(msg)
+            self._wakeDriver()
+            return ret
         else:
             log.warning('Refusing to queue %r; %s is a zombie.', msg, self)
             return False
@@ -698,9 +1269,19 @@ class Irc(IrcCommandDispatcher):
         """Queues a message to be sent to the server *immediately*"""
         if not self.zombie:
             self.fastqueue.enqueue(msg)
+            self._wakeDriver()
         else:
             log.warning('Refusing to send %r; %s is a zombie.', msg, self)
 
+    def _wakeDriver(self):
+        # Messages queued from the driver loop itself will be taken as soon as
+        # the current message is done being processed; only messages queued
+        # from other threads need to wake the driver up.
+        if not world.isMainThread():
+            wakeup = getattr(self.driver, 'wakeup', None)
+            if wakeup is not None:
+                wakeup()
+
     def takeMsg(self):
         """Called by the IrcDriver; takes a message to be sent."""
         if not self.callbacks:
@@ -710,11 +1291,7 @@ class Irc(IrcCommandDispatcher):
         if self.fastqueue:
             msg = self.fastqueue.dequeue()
         elif self.queue:
-            if now-self.lastTake <= conf.supybot.protocols.irc.throttleTime():
-                log.debug('Irc.takeMsg throttling.')
-            else:
-                self.lastTake = now
-                msg = self.queue.dequeue()
+            msg = self.queue.dequeue(now)
         elif self.afterConnect and \
              conf.supybot.protocols.irc.ping() and \
              now > self.lastping + conf.supybot.protocols.irc.ping.interval():
@@ -746,7 +1323,6 @@ class Irc(IrcCommandDispatcher):
                 # warning.
                 log.debug('Truncating %r, message is too long.', msg)
                 msg._str = msg._str[:500] + '\r\n'
-                msg._len = len(str(msg))
             # I don't think we should do this.  Why should it matter?  If it's
             # something important, then the server will send it back to us,
             # and if it's just a privmsg/notice/etc., we don't care.
@@ -823,12 +1399,24 @@ class Irc(IrcCommandDispatcher):
         postInFilter = str(msg).rstrip('\r\n')
         if postInFilter != preInFilter:
             log.debug('Incoming message (post-inFilter): %s', postInFilter)
+        lanes = self.lanes
         for callback in self.callbacks:
+            if callback is None:
+                continue
+            if lanes is not None and callback.commutative:
+                lanes.put(self, callback, msg)
+                continue
+            start = time.time()
             try:
-                if callback is not None:
-                    callback(self, msg)
+                callback(self, msg)
             except:
                 log.exception('Uncaught exception in callback:')
+            name = callback.name()
+            try:
+                histogram = self.latencies[name]
+            except KeyError:
+                histogram = self.latencies[name] = LatencyHistogram()
+            histogram.record(time.time() - start)
             world.debugFlush()
 
     def die(self):
@@ -847,9 +1435,11 @@ class Irc(IrcCommandDispatcher):
         """Resets the Irc object.  Called when the driver reconnects."""
         self._setNonResettingVariables()
         self.state.reset()
-        self.queue.reset()
+        self.queue = self._makeQueue()
         self.fastqueue.reset()
         self.startedSync.clear()
+        if self.lanes is not None:
+            self.lanes.join()
         for callback in self.callbacks:
             callback.reset()
         self._queueConnectMessages()
@@ -863,7 +1453,6 @@ class Irc(IrcCommandDispatcher):
         self.password = conf.supybot.networks.get(self.network).password()
         self.prefix = '%s!%s@%s' % (self.nick, self.ident, 'unset.domain')
         # The rest.
-        self.lastTake = 0
         self.server = 'unset'
         self.afterConnect = False
         self.lastping = time.time()
@@ -995,6 +1584,8 @@ class Irc(IrcCommandDispatcher):
         #     and fix whatever AttributeErrors arise in the drivers themselves.
         if self.driver is not None and hasattr(self.driver, 'die'):
             self.driver.die()
+        if self.lanes is not None:
+            self.lanes.stop()
         if self in world.ircs:
             world.ircs.remove(self)
             # Only kill the callbacks if we're the last Irc.
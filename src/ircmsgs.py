@@ -49,6 +49,40 @@ import supybot.ircutils as ircutils
 class MalformedIrcMsg(ValueError):
     pass
 
+def _pyParse(s):
+    """Splits the raw IRC line s into its prefix, command, and args.  Raises
+    ValueError if s is malformed."""
+    if s[:1] == ':':
+        (prefix, s) = s[1:].split(None, 1)
+    else:
+        prefix = ''
+    i = s.find(' :') # Note the space: IPV6 addresses are bad w/o it.
+    if i == -1:
+        args = s.split()
+    else:
+        args = s[:i].split()
+        args.append(s[i+2:].rstrip('\r\n'))
+    if not args:
+        raise ValueError, repr(s)
+    return (prefix, args[0], tuple(args[1:]))
+
+try:
+    from supybot._ircparse import parse as _cParse
+except ImportError:
+    _cParse = None
+
+def _parse(s):
+    if _cParse is not None and type(s) is str:
+        return _cParse(s)
+    return _pyParse(s)
+
+def _intern(s):
+    # Commands and prefixes repeat endlessly in the messages we keep around
+    # (history, queues, plugins' last messages), so we share one copy of each.
+    if type(s) is str:
+        return intern(s)
+    return s
+
 class IrcMsg(object):
     """Class to represent an IRC message.
 
@@ -78,43 +112,38 @@ class IrcMsg(object):
     """
     # It's too useful to be able to tag IrcMsg objects with extra, unforeseen
     # data.  Goodbye, __slots__.
-    # On second thought, let's use methods for tagging.
-    __slots__ = ('args', 'command', 'host', 'nick', 'prefix', 'user',
-                 '_hash', '_str', '_repr', '_len', 'tags')
+    # On second thought, let's use methods for tagging.  The tags dictionary
+    # is only created once a message is tagged, and nick, user, and host are
+    # only split out of the prefix when they're asked for; most messages we
+    # hold on to are never tagged, and many are never asked for their nick.
+    __slots__ = ('args', 'command', 'prefix', 'tags',
+                 '_hash', '_hostmask', '_str')
     def __init__(self, s='', command='', args=(), prefix='', msg=None):
         assert not (msg and s), 'IrcMsg.__init__ cannot accept both s and msg'
         if not s and not command and not msg:
             raise MalformedIrcMsg, 'IRC messages require a command.'
         self._str = None
-        self._repr = None
         self._hash = None
-        self._len = None
-        self.tags = {}
+        self._hostmask = None
+        self.tags = None
         if s:
             originalString = s
+            if not s.endswith('\n'):
+                s += '\n'
+            self._str = s
             try:
-                if not s.endswith('\n'):
-                    s += '\n'
-                self._str = s
-                if s[0] == ':':
-                    self.prefix, s = s[1:].split(None, 1)
-                else:
-                    self.prefix = ''
-                if ' :' in s: # Note the space: IPV6 addresses are bad w/o it.
-                    s, last = s.split(' :', 1)
-                    self.args = s.split()
-                    self.args.append(last.rstrip('\r\n'))
-                else:
-                    self.args = s.split()
-                self.command = self.args.pop(0)
-            except (IndexError, ValueError):
+                (self.prefix, self.command, self.args) = _parse(s)
+            except ValueError:
                 raise MalformedIrcMsg, repr(originalString)
         else:
             if msg is not None:
+                # Whatever isn't replaced is shared with the original message,
+                # including its string form and hash if nothing is.
                 if prefix:
                     self.prefix = prefix
                 else:
                     self.prefix = msg.prefix
+                    self._hostmask = msg._hostmask
                 if command:
                     self.command = command
                 else:
@@ -123,17 +152,47 @@ class IrcMsg(object):
                     self.args = args
                 else:
                     self.args = msg.args
-                self.tags = msg.tags.copy()
+                if msg.tags:
+                    self.tags = msg.tags.copy()
+                if not (prefix or command or args):
+                    self._str = msg._str
+                    self._hash = msg._hash
             else:
                 self.prefix = prefix
                 self.command = command
                 assert all(ircutils.isValidArgument, args)
                 self.args = args
-        self.args = tuple(self.args)
-        if isUserHostmask(self.prefix):
-            (self.nick,self.user,self.host)=ircutils.splitHostmask(self.prefix)
-        else:
-            (self.nick, self.user, self.host) = (self.prefix,)*3
+        self.prefix = _intern(self.prefix)
+        self.command = _intern(self.command)
+        if type(self.args) is not tuple:
+            self.args = tuple(self.args)
+
+    def _fromLine(cls, s):
+        """Makes an IrcMsg from the raw line s (which must end in '\\n')
+        without the checks and options of the constructor."""
+        (prefix, command, args) = _parse(s)
+        self = cls.__new__(cls)
+        self._str = s
+        self._hash = None
+        self._hostmask = None
+        self.tags = None
+        self.prefix = _intern(prefix)
+        self.command = _intern(command)
+        self.args = args
+        return self
+    _fromLine = classmethod(_fromLine)
+
+    def _splitPrefix(self):
+        if self._hostmask is None:
+            if isUserHostmask(self.prefix):
+                self._hostmask = ircutils.splitHostmask(self.prefix)
+            else:
+                self._hostmask = (self.prefix,)*3
+        return self._hostmask
+
+    nick = property(lambda self: self._splitPrefix()[0])
+    user = property(lambda self: self._splitPrefix()[1])
+    host = property(lambda self: self._splitPrefix()[2])
 
     def __str__(self):
         if self._str is not None:
@@ -185,25 +244,45 @@ class IrcMsg(object):
         return self._hash
 
     def __repr__(self):
-        if self._repr is not None:
-            return self._repr
-        self._repr = format('IrcMsg(prefix=%q, command=%q, args=%r)',
-                            self.prefix, self.command, self.args)
-        return self._repr
+        return format('IrcMsg(prefix=%q, command=%q, args=%r)',
+                      self.prefix, self.command, self.args)
 
     def __reduce__(self):
         return (self.__class__, (str(self),))
 
     def tag(self, tag, value=True):
+        if self.tags is None:
+            self.tags = {}
         self.tags[tag] = value
 
     def tagged(self, tag):
+        if self.tags is None:
+            return None
         return self.tags.get(tag) # Returns None if it's not there.
 
     def __getattr__(self, attr):
         return self.tagged(attr)
 
 
+def parseLines(buf, malformed=None):
+    """Returns a list of the IrcMsgs in buf, a string of raw IRC lines
+    separated by '\\n' (as read from the network).  Blank lines are skipped.
+    If malformed is given, it's called with each line that can't be parsed;
+    otherwise, MalformedIrcMsg is raised for such a line."""
+    msgs = []
+    fromLine = IrcMsg._fromLine
+    for line in buf.split('\n'):
+        line = line.strip()
+        if line:
+            try:
+                msgs.append(fromLine(line + '\n'))
+            except ValueError:
+                if malformed is None:
+                    raise MalformedIrcMsg, repr(line)
+                malformed(line)
+    return msgs
+
+
 def isCtcp(msg):
     """Returns whether or not msg is a CTCP message."""
     return msg.command in ('PRIVMSG', 'NOTICE') and \
@@ -35,10 +35,11 @@ IRC-case-insensitive fashion), and numerous other things.
 """
 
 import re
+import sys
 import time
 import random
 import string
-import textwrap
+from array import array
 from cStringIO import StringIO as sio
 
 import supybot.utils as utils
@@ -427,16 +428,103 @@ class FormatParser(object):
             context.bg = self.getInt()
 
 def wrap(s, length):
+    """Splits s into chunks of at most length characters, breaking at spaces
+    where it can, and carrying any formatting over from one chunk to the
+    next."""
+    chunks = WrappedText(s, length)
     processed = []
-    chunks = textwrap.wrap(s, length)
-    context = None
-    for chunk in chunks:
-        if context is not None:
-            chunk = context.start(chunk)
-        context = FormatParser(chunk).parse()
-        processed.append(context.end(chunk))
+    while chunks:
+        processed.append(chunks.pop())
     return processed
 
+_whitespaceRe = re.compile(r'[\t\n\x0b\x0c\r]')
+_nonSpaceRe = re.compile(r'[^ ]')
+
+def wrapOffsets(s, length):
+    """Generates the (start, end) offsets in s of each chunk of at most
+    length characters s is split into, looking at no more than length+1
+    characters of s for each.  Chunks end at a space where they can, and
+    neither start nor end with one.  s's whitespace must all be spaces."""
+    m = _nonSpaceRe.search(s)
+    while m is not None:
+        start = m.start()
+        end = start + length
+        if end < len(s) and s[end] != ' ':
+            space = s.rfind(' ', start, end)
+            if space != -1:
+                end = space # Otherwise it's a word longer than length.
+        end = start + len(s[start:end].rstrip(' '))
+        yield (start, end)
+        m = _nonSpaceRe.search(s, end)
+
+class WrappedText(object):
+    """The chunks wrap(s, length) returns, kept as s and the offsets of the
+    chunks in it.  The offsets are found only as chunks are needed, and the
+    chunks made (with their formatting carried over) only as they're
+    popped."""
+    __slots__ = ('s', 'offsets', 'expected', 'more', 'i', 'context')
+    def __init__(self, s, length):
+        s = _whitespaceRe.sub(' ', s.expandtabs())
+        self.s = s
+        self.offsets = array('i')
+        # There are at least this many offsets, two for each chunk.
+        self.expected = 2 * (len(s) // length + 1)
+        self.more = wrapOffsets(s, length)
+        self.i = 0
+        self.context = None
+
+    def _find(self, n):
+        """Finds the offsets of chunks until there are at least n offsets or
+        there are no more chunks."""
+        offsets = self.offsets
+        while len(offsets) < n and self.more is not None:
+            try:
+                offsets.extend(self.more.next())
+            except StopIteration:
+                self.more = None
+
+    def __nonzero__(self):
+        self._find(self.i + 2)
+        return self.i < len(self.offsets)
+
+    def __len__(self):
+        """Returns how many chunks haven't been popped.  This has to find all
+        of them."""
+        self._find(sys.maxint)
+        return (len(self.offsets) - self.i) // 2
+
+    def size(self):
+        """Returns roughly how many bytes of memory this is keeping alive,
+        counting the offsets that haven't been found yet."""
+        n = max(len(self.offsets), self.expected)
+        return len(self.s) + self.offsets.itemsize * n
+
+    def pop(self):
+        """Removes and returns the next chunk.  Raises IndexError if there
+        are none left."""
+        self._find(self.i + 2)
+        if self.i >= len(self.offsets):
+            raise IndexError, 'pop from empty WrappedText'
+        chunk = self.s[self.offsets[self.i]:self.offsets[self.i+1]]
+        self.i += 2
+        if self.context is not None:
+            chunk = self.context.start(chunk)
+        self.context = FormatParser(chunk).parse()
+        return self.context.end(chunk)
+
+    def copy(self):
+        """Returns a WrappedText that pops the same chunks as this one, but
+        independently of it."""
+        other = self.__class__.__new__(self.__class__)
+        other.s = self.s
+        # The offsets are only ever appended to, so copies can share them.
+        other.offsets = self.offsets
+        other.expected = self.expected
+        other.more = self.more
+        other.i = self.i
+        other.context = self.context
+        return other
+
 def isValidArgument(s):
     """Returns whether s is strictly a valid argument for an IRC message."""
     return '\r' not in s and '\n' not in s and '\x00' not in s
@@ -609,17 +697,18 @@ for (k, v) in mircColors.items():
         sv = str(v)
         mircColors[sv] = sv
 
-def standardSubstitute(irc, msg, text, env=None):
-    """Do the standard set of substitutions on text, and return it"""
-    if isChannel(msg.args[0]):
-        channel = msg.args[0]
-    else:
-        channel = 'somewhere'
+def _randInt(irc, msg, channel, t):
     def randInt():
         return str(random.randint(-1000, 1000))
+    return randInt
+
+def _randDate(irc, msg, channel, t):
     def randDate():
         t = pow(2,30)*random.random()+time.time()/4.0
         return time.ctime(t)
+    return randDate
+
+def _randNick(irc, msg, channel, t):
     def randNick():
         if channel != 'somewhere':
             L = list(irc.state.channels[channel].users)
@@ -632,33 +721,67 @@ def standardSubstitute(irc, msg, text, env=None):
                 return msg.nick
         else:
             return 'someone'
-    ctime = time.ctime()
-    localtime = time.localtime()
-    vars = IrcDict({
-        'who': msg.nick,
-        'nick': msg.nick,
-        'user': msg.user,
-        'host': msg.host,
-        'channel': channel,
-        'botnick': irc.nick,
-        'now': ctime, 'ctime': ctime,
-        'randnick': randNick, 'randomnick': randNick,
-        'randdate': randDate, 'randomdate': randDate,
-        'rand': randInt, 'randint': randInt, 'randomint': randInt,
-        'today': time.strftime('%d %b %Y', localtime),
-        'year': localtime[0],
-        'month': localtime[1],
-        'monthname': time.strftime('%b', localtime),
-        'date': localtime[2],
-        'day': time.strftime('%A', localtime),
-        'h': localtime[3], 'hr': localtime[3], 'hour': localtime[3],
-        'm': localtime[4], 'min': localtime[4], 'minute': localtime[4],
-        's': localtime[5], 'sec': localtime[5], 'second': localtime[5],
-        'tz': time.tzname[time.daylight],
-        })
+    return randNick
+
+def _strftime(format):
+    def strftime(irc, msg, channel, t):
+        return time.strftime(format, time.localtime(t))
+    return strftime
+
+def _localtime(i):
+    def localtime(irc, msg, channel, t):
+        return time.localtime(t)[i]
+    return localtime
+
+def _ctime(irc, msg, channel, t):
+    return time.ctime(t)
+
+# The functions that make the values of standardSubstitute's variables, so
+# it only has to make the ones a text uses.
+_standardVariables = {
+    'who': lambda irc, msg, channel, t: msg.nick,
+    'nick': lambda irc, msg, channel, t: msg.nick,
+    'user': lambda irc, msg, channel, t: msg.user,
+    'host': lambda irc, msg, channel, t: msg.host,
+    'channel': lambda irc, msg, channel, t: channel,
+    'botnick': lambda irc, msg, channel, t: irc.nick,
+    'now': _ctime, 'ctime': _ctime,
+    'randnick': _randNick, 'randomnick': _randNick,
+    'randdate': _randDate, 'randomdate': _randDate,
+    'rand': _randInt, 'randint': _randInt, 'randomint': _randInt,
+    'today': _strftime('%d %b %Y'),
+    'year': _localtime(0),
+    'month': _localtime(1),
+    'monthname': _strftime('%b'),
+    'date': _localtime(2),
+    'day': _strftime('%A'),
+    'h': _localtime(3), 'hr': _localtime(3), 'hour': _localtime(3),
+    'm': _localtime(4), 'min': _localtime(4), 'minute': _localtime(4),
+    's': _localtime(5), 'sec': _localtime(5), 'second': _localtime(5),
+    'tz': lambda irc, msg, channel, t: time.tzname[time.daylight],
+    }
+
+def standardSubstitute(irc, msg, text, env=None):
+    """Do the standard set of substitutions on text, and return it"""
+    template = utils.str.perlVariableTemplate(text)
+    if not template.names:
+        return text
+    if isChannel(msg.args[0]):
+        channel = msg.args[0]
+    else:
+        channel = 'somewhere'
     if env is not None:
-        vars.update(env)
-    return utils.str.perlVariableSubstitute(vars, text)
+        env = IrcDict(env)
+    t = time.time()
+    vars = IrcDict()
+    for name in template.names:
+        if env is not None and name in env:
+            vars[name] = env[name]
+        elif name not in vars:
+            f = _standardVariables.get(toLower(name))
+            if f is not None:
+                vars[name] = f(irc, msg, channel, t)
+    return template.substitute(vars)
 
 
 if __name__ == '__main__':
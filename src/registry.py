@@ -60,6 +60,9 @@ class NonExistentRegistryEntry(RegistryException):
 
 _cache = utils.InsensitivePreservingDict()
 _lastModified = 0
+# Incremented whenever a node is registered or unregistered, so Handles know
+# when the paths they've resolved might lead somewhere else.
+_version = 0
 def open(filename, clear=False):
     """Initializes the module by loading the registry file into memory."""
     global _lastModified
@@ -236,6 +239,7 @@ class Group(object):
                             pass
 
     def register(self, name, node=None):
+        global _version
         if not isValidRegistryName(name):
             raise InvalidRegistryName, name
         if node is None:
@@ -245,6 +249,7 @@ class Group(object):
         # For the longest time, we had an "Is this right?" comment here, but
         # from experience, we now know that it most definitely *is* right.
         if name not in self._children:
+            _version += 1
             self._children[name] = node
             self._added.append(name)
             names = split(self._name)
@@ -259,9 +264,11 @@ class Group(object):
         return node
 
     def unregister(self, name):
+        global _version
         try:
             node = self._children[name]
             del self._children[name]
+            _version += 1
             # We do this because we need to remove case-insensitively.
             name = name.lower()
             for elt in reversed(self._added):
@@ -293,6 +300,61 @@ class Group(object):
         return L
 
 
+class Handle(object):
+    """A handle on the node at a path of names below a group, such as one of
+    a plugin's configuration variables.  The path is resolved when the handle
+    is first used, and again only if any node has been registered or
+    unregistered since, so calling a handle costs little more than calling the
+    node itself."""
+    def __init__(self, group, names):
+        self.group = group
+        self.names = names
+        self.version = None
+        self.node = None
+
+    def resolve(self):
+        """Returns the node the handle refers to."""
+        if self.version != _version:
+            # Resolving may register default children, so we use the version
+            # from before; we'll just resolve once more next time.
+            version = _version
+            node = self.group
+            for name in self.names:
+                node = node.get(name)
+            self.node = node
+            self.version = version
+        return self.node
+
+    def __call__(self):
+        return self.resolve()()
+
+# When profiling is True, handles made by handle() count how often each value
+# is looked up; see lookupReport.
+profiling = False
+_lookups = {}
+_lookupsStarted = time.time()
+class CountingHandle(Handle):
+    def __call__(self):
+        node = self.resolve()
+        _lookups[node._name] = _lookups.get(node._name, 0) + 1
+        return node()
+
+def handle(group, names):
+    """Returns a Handle on the node at the path names below group."""
+    if profiling:
+        return CountingHandle(group, names)
+    else:
+        return Handle(group, names)
+
+def lookupReport(n=10):
+    """Returns a list of (name, lookups per second) pairs for the n values
+    looked up most often through handles since profiling began."""
+    elapsed = max(time.time() - _lookupsStarted, 1)
+    L = [(count, name) for (name, count) in _lookups.iteritems()]
+    L.sort()
+    L.reverse()
+    return [(name, count / elapsed) for (count, name) in L[:n]]
+
 class Value(Group):
     """Invalid registry value.  If you're getting this message, report it,
     because we forgot to put a proper help string here."""
@@ -407,6 +469,14 @@ class Float(Value):
         except ValueError:
             self.error()
 
+class NonNegativeFloat(Float):
+    """Value must be a floating-point number greater than or equal to zero."""
+    def setValue(self, v):
+        if v < 0:
+            self.error()
+        else:
+            super(NonNegativeFloat, self).setValue(v)
+
 class PositiveFloat(Float):
     """Value must be a floating-point number greater than zero."""
     def setValue(self, v):
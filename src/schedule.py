@@ -39,32 +39,33 @@ import supybot.log as log
 import supybot.world as world
 import supybot.drivers as drivers
 
-class mytuple(tuple):
-    def __cmp__(self, other):
-        return cmp(self[0], other[0])
-    def __le__(self, other):
-        return self[0] <= other[0]
-    def __lt__(self, other):
-        return self[0] < other[0]
-    def __gt__(self, other):
-        return self[0] > other[0]
-    def __ge__(self, other):
-        return self[0] >= other[0]
+# Heap entries are lists of [time, sequence, name]; when an event is removed
+# its entry's name is replaced by this marker and the entry is left in the
+# heap to be discarded when it reaches the top.
+_removed = object()
 
 class Schedule(drivers.IrcDriver):
     """An IrcDriver to handling scheduling of events.
 
     Events, in this case, are functions accepting no arguments.
     """
+    # Once more than this fraction of the heap is removed entries, the heap is
+    # rebuilt without them.
+    compactRatio = 0.5
     def __init__(self):
         drivers.IrcDriver.__init__(self)
         self.schedule = []
         self.events = {}
+        self.entries = {}
         self.counter = 0
+        self.sequence = 0
+        self.removed = 0
 
     def reset(self):
         self.events.clear()
+        self.entries.clear()
         self.schedule[:] = []
+        self.removed = 0
         # We don't reset the counter here because if someone has held an id of
         # one of the nuked events, we don't want him removing new events with
         # his old id.
@@ -72,32 +73,62 @@ class Schedule(drivers.IrcDriver):
     def name(self):
         return 'Schedule'
 
-    def addEvent(self, f, t, name=None):
-        """Schedules an event f to run at time t.
-
-        name must be hashable and not an int.
-        """
+    def _makeEntry(self, f, t, name=None):
         if name is None:
             name = self.counter
             self.counter += 1
         assert name not in self.events, \
                'An event with the same name has already been scheduled.'
+        entry = [t, self.sequence, name]
+        self.sequence += 1
         self.events[name] = f
-        heapq.heappush(self.schedule, mytuple((t, name)))
-        return name
+        self.entries[name] = entry
+        return entry
+
+    def addEvent(self, f, t, name=None):
+        """Schedules an event f to run at time t.
+
+        name must be hashable and not an int.
+        """
+        entry = self._makeEntry(f, t, name)
+        heapq.heappush(self.schedule, entry)
+        return entry[2]
+
+    def addEvents(self, events):
+        """Schedules many events at once.  events is an iterable of (f, t) or
+        (f, t, name) tuples, as would be given to addEvent.  Returns a list
+        of the names of the added events."""
+        entries = [self._makeEntry(*event) for event in events]
+        if len(entries) > len(self.schedule):
+            # Cheaper to rebuild the heap than to push each one.
+            self.schedule.extend(entries)
+            heapq.heapify(self.schedule)
+        else:
+            for entry in entries:
+                heapq.heappush(self.schedule, entry)
+        return [entry[2] for entry in entries]
 
     def removeEvent(self, name):
         """Removes the event with the given name from the schedule."""
         f = self.events.pop(name)
-        self.schedule = [(t, n) for (t, n) in self.schedule if n != name]
-        # We must heapify here because the heap property may not be preserved
-        # by the above list comprehension.  We could, conceivably, just mark
-        # the elements of the heap as removed and ignore them when we heappop,
-        # but that would only save a constant factor (we're already linear for
-        # the listcomp) so I'm not worried about it right now.
-        heapq.heapify(self.schedule)
+        entry = self.entries.pop(name)
+        entry[2] = _removed
+        self.removed += 1
+        if self.removed > len(self.schedule) * self.compactRatio:
+            self._compact()
         return f
 
+    def _compact(self):
+        self.schedule = [entry for entry in self.schedule
+                         if entry[2] is not _removed]
+        heapq.heapify(self.schedule)
+        self.removed = 0
+
+    def _discardRemoved(self):
+        while self.schedule and self.schedule[0][2] is _removed:
+            heapq.heappop(self.schedule)
+            self.removed -= 1
+
     def rescheduleEvent(self, name, t):
         f = self.removeEvent(name)
         self.addEvent(f, t, name=name)
@@ -117,19 +148,36 @@ class Schedule(drivers.IrcDriver):
 
     removePeriodicEvent = removeEvent
 
+    def nextTime(self):
+        """Returns the time at which the next event is due, or None if no
+        events are scheduled."""
+        self._discardRemoved()
+        if self.schedule:
+            return self.schedule[0][0]
+        else:
+            return None
+
     def run(self):
         if len(drivers._drivers) == 1 and not world.testing:
             log.error('Schedule is the only remaining driver, '
                       'why do we continue to live?')
             time.sleep(1) # We're the only driver; let's pause to think.
         while self.schedule and self.schedule[0][0] < time.time():
-            (t, name) = heapq.heappop(self.schedule)
-            f = self.events[name]
-            del self.events[name]
+            (t, _, name) = heapq.heappop(self.schedule)
+            if name is _removed:
+                self.removed -= 1
+                continue
+            f = self.events.pop(name)
+            del self.entries[name]
             try:
                 f()
             except Exception, e:
                 log.exception('Uncaught exception in scheduled function:')
+        if self.removed == len(self.schedule):
+            # Only removed entries are left; no need to wait for them to
+            # reach the top of the heap.
+            self.schedule = []
+            self.removed = 0
 
 try:
     ignore(schedule)
@@ -137,10 +185,12 @@ except NameError:
     schedule = Schedule()
 
 addEvent = schedule.addEvent
+addEvents = schedule.addEvents
 removeEvent = schedule.removeEvent
 rescheduleEvent = schedule.rescheduleEvent
 addPeriodicEvent = schedule.addPeriodicEvent
 removePeriodicEvent = removeEvent
+nextTime = schedule.nextTime
 run = schedule.run
 
 
@@ -37,9 +37,11 @@ import new
 import sys
 import string
 import textwrap
+import sre_parse
+import sre_constants
 
 from iter import all, any
-from structures import TwoWayDictionary
+from structures import TwoWayDictionary, LRUCache
 
 curry = new.instancemethod
 chars = string.maketrans('', '')
@@ -187,22 +189,97 @@ def perlReToReplacer(s):
         return lambda s: r.sub(replace, s, 1)
 
 _perlVarSubstituteRe = re.compile(r'\$\{([^}]+)\}|\$([a-zA-Z][a-zA-Z0-9]*)')
+class PerlVariableTemplate(object):
+    """A text with $variables and ${variables} in it, split up once so they
+    can be substituted by a single join."""
+    __slots__ = ('text', 'parts', 'variables', 'names')
+    def __init__(self, text):
+        self.text = text
+        self.parts = []
+        self.variables = [] # (index in parts, name, original text)
+        start = 0
+        for m in _perlVarSubstituteRe.finditer(text):
+            self.parts.append(text[start:m.start()])
+            (braced, unbraced) = m.groups()
+            self.variables.append((len(self.parts), braced or unbraced,
+                                   m.group(0)))
+            self.parts.append(None)
+            start = m.end()
+        self.parts.append(text[start:])
+        self.names = [name for (_, name, _) in self.variables]
+
+    def substitute(self, vars):
+        """Returns the text with the variables in vars substituted.  Values
+        that are callable are called for each time their variable is used;
+        variables that aren't in vars are left as they are."""
+        if not self.variables:
+            return self.text
+        parts = self.parts[:]
+        for (i, name, original) in self.variables:
+            try:
+                x = vars[name]
+                if callable(x):
+                    parts[i] = x()
+                else:
+                    parts[i] = str(x)
+            except KeyError:
+                parts[i] = original
+        return ''.join(parts)
+
+_perlVariableTemplates = LRUCache(1000)
+def perlVariableTemplate(text):
+    """Returns the (cached) PerlVariableTemplate for text."""
+    template = _perlVariableTemplates.get(text)
+    if template is None or template.text.__class__ is not text.__class__:
+        template = PerlVariableTemplate(text)
+        _perlVariableTemplates[text] = template
+    return template
+
 def perlVariableSubstitute(vars, text):
-    def replacer(m):
-        (braced, unbraced) = m.groups()
-        var = braced or unbraced
-        try:
-            x = vars[var]
-            if callable(x):
-                return x()
-            else:
-                return str(x)
-        except KeyError:
-            if braced:
-                return '${%s}' % braced
-            else:
-                return '$' + unbraced
-    return _perlVarSubstituteRe.sub(replacer, text)
+    return perlVariableTemplate(text).substitute(vars)
+
+def _requiredLiterals(data):
+    # The runs of literal characters in the parsed regexp data that every
+    # match must contain.
+    runs = []
+    run = []
+    for (op, av) in data:
+        if op == sre_constants.LITERAL and av < 256:
+            run.append(chr(av))
+            continue
+        if run:
+            runs.append(''.join(run))
+            run = []
+        if op == sre_constants.SUBPATTERN:
+            runs.extend(_requiredLiterals(av[-1]))
+        elif op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT):
+            (minimum, _, subpattern) = av
+            if minimum:
+                runs.extend(_requiredLiterals(subpattern))
+    if run:
+        runs.append(''.join(run))
+    return runs
+
+def requiredLiteral(pattern, flags=0):
+    """Returns the longest string any match of the regexp pattern must
+    contain (lowercased if the regexp ignores case), or None if there's no
+    such string or we can't be sure of it.  Searching for this string first
+    can save running the regexp at all."""
+    if flags & (re.L | re.U):
+        return None # Case folding then depends on more than ASCII.
+    try:
+        parsed = sre_parse.parse(pattern, flags)
+    except (sre_constants.error, TypeError):
+        return None
+    if parsed.pattern.flags & (re.L | re.U):
+        return None
+    runs = _requiredLiterals(parsed)
+    if not runs:
+        return None
+    literal = max(runs, key=len)
+    if (flags | parsed.pattern.flags) & re.I:
+        literal = literal.lower()
+    return literal
 
 def commaAndify(seq, comma=',', And='and'):
     """Given a a sequence, returns an English clause for that sequence.
@@ -363,6 +440,100 @@ def timestamp(t):
     return time.ctime(t)
 
 _formatRe = re.compile('%((?:\d+)?\.\d+f|[bfhiLnpqrstu%])')
+
+def _formatList(t):
+    if isinstance(t, list):
+        return commaAndify(t)
+    elif isinstance(t, tuple) and len(t) == 2:
+        if not isinstance(t[0], list):
+            raise ValueError, 'Invalid list for %%L in format: %s' % t
+        if not isinstance(t[1], basestring):
+            raise ValueError, 'Invalid string for %%L in format: %s' % t
+        return commaAndify(t[0], And=t[1])
+    else:
+        raise ValueError, 'Invalid value for %%L in format: %s' % t
+
+def _formatItems(t):
+    if not isinstance(t, (tuple, list)):
+        raise ValueError, 'Invalid value for %%n in format: %s' % t
+    if len(t) == 2:
+        return nItems(*t)
+    elif len(t) == 3:
+        return nItems(t[0], t[2], between=t[1])
+    else:
+        raise ValueError, 'Invalid value for %%n in format: %s' % t
+
+def _formatTimestamp(t):
+    return timestamp(t) # Looked up each time; supybot.conf replaces it.
+
+def _formatUrl(url):
+    return '<%s>' % url
+
+def _formatFloat(spec):
+    spec = '%' + spec
+    def formatFloat(x):
+        return spec % x
+    return formatFloat
+
+_formatters = {
+    's': str,
+    # XXX Improve me!
+    'i': str,
+    'b': be,
+    'h': has,
+    'L': _formatList,
+    'p': pluralize,
+    'q': quoted,
+    'r': repr,
+    'n': _formatItems,
+    't': _formatTimestamp,
+    'u': _formatUrl,
+    }
+
+class FormatTemplate(object):
+    """A format string (see format) split up once into its literal text and
+    the functions its format chars call for, so it can be formatted by a
+    single join."""
+    __slots__ = ('s', 'parts', 'formatters')
+    def __init__(self, s):
+        self.s = s
+        self.parts = []
+        self.formatters = [] # (index in parts, function)
+        literal = []
+        for (i, x) in enumerate(_formatRe.split(s)):
+            if not i % 2:
+                literal.append(x)
+            elif x == '%':
+                literal.append('%')
+            else:
+                self.parts.append(''.join(literal))
+                literal = []
+                if x.endswith('f'):
+                    f = _formatFloat(x)
+                else:
+                    f = _formatters[x]
+                self.formatters.append((len(self.parts), f))
+                self.parts.append(None)
+        self.parts.append(''.join(literal))
+
+    def format(self, args):
+        """Returns the format string formatted with the sequence args."""
+        if len(args) < len(self.formatters):
+            raise ValueError, 'Extra format chars in format spec: %r' % self.s
+        parts = self.parts[:]
+        for ((i, f), arg) in zip(self.formatters, args):
+            parts[i] = f(arg)
+        return ''.join(parts)
+
+_formatTemplates = LRUCache(1000)
+def formatTemplate(s):
+    """Returns the (cached) FormatTemplate for s."""
+    template = _formatTemplates.get(s)
+    if template is None or template.s.__class__ is not s.__class__:
+        template = FormatTemplate(s)
+        _formatTemplates[s] = template
+    return template
+
 def format(s, *args, **kwargs):
     """w00t.
 
@@ -380,62 +551,6 @@ def format(s, *args, **kwargs):
     t: time, formatted (takes an int)
     u: url, wrapped in braces (this should be configurable at some point)
     """
-    args = list(args)
-    args.reverse() # For more efficient popping.
-    def sub(match):
-        char = match.group(1)
-        if char == 's':
-            return str(args.pop())
-        elif char == 'i':
-            # XXX Improve me!
-            return str(args.pop())
-        elif char.endswith('f'):
-            return ('%'+char) % args.pop()
-        elif char == 'b':
-            return be(args.pop())
-        elif char == 'h':
-            return has(args.pop())
-        elif char == 'L':
-            t = args.pop()
-            if isinstance(t, list):
-                return commaAndify(t)
-            elif isinstance(t, tuple) and len(t) == 2:
-                if not isinstance(t[0], list):
-                    raise ValueError, \
-                          'Invalid list for %%L in format: %s' % t
-                if not isinstance(t[1], basestring):
-                    raise ValueError, \
-                          'Invalid string for %%L in format: %s' % t
-                return commaAndify(t[0], And=t[1])
-            else:
-                raise ValueError, 'Invalid value for %%L in format: %s' % t
-        elif char == 'p':
-            return pluralize(args.pop())
-        elif char == 'q':
-            return quoted(args.pop())
-        elif char == 'r':
-            return repr(args.pop())
-        elif char == 'n':
-            t = args.pop()
-            if not isinstance(t, (tuple, list)):
-                raise ValueError, 'Invalid value for %%n in format: %s' % t
-            if len(t) == 2:
-                return nItems(*t)
-            elif len(t) == 3:
-                return nItems(t[0], t[2], between=t[1])
-            else:
-                raise ValueError, 'Invalid value for %%n in format: %s' % t
-        elif char == 't':
-            return timestamp(args.pop())
-        elif char == 'u':
-            return '<%s>' % args.pop()
-        elif char == '%':
-            return '%'
-        else:
-            raise ValueError, 'Invalid char in sub (in format).'
-    try:
-        return _formatRe.sub(sub, s)
-    except IndexError:
-        raise ValueError, 'Extra format chars in format spec: %r' % s
+    return formatTemplate(s).format(args)
 
 # vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -33,6 +33,7 @@ Data structures for Python.
 
 import time
 import types
+import threading
 import UserDict
 from itertools import imap
 
@@ -444,4 +445,109 @@ class CacheDict(UserDict.DictMixin):
         return iter(self.d)
 
 
+class LRUCache(object):
+    """A mapping that keeps only the max items most recently set or gotten;
+    dropped is called with each item it drops to make room.  It's safe to
+    use from several threads at once."""
+    def __init__(self, max):
+        self.max = max
+        self.lock = threading.Lock()
+        self.d = {} # key -> [previous link, next link, key, value]
+        self.root = [] # The least recently used is root[1].
+        self.root[:] = [self.root, self.root, None, None]
+
+    def _unlink(self, link):
+        (previous, next, _, _) = link
+        previous[1] = next
+        next[0] = previous
+
+    def _append(self, link):
+        last = self.root[0]
+        link[0] = last
+        link[1] = self.root
+        last[1] = link
+        self.root[0] = link
+
+    def get(self, key, default=None):
+        self.lock.acquire()
+        try:
+            link = self.d.get(key)
+            if link is None:
+                return default
+            self._unlink(link)
+            self._append(link)
+            return link[3]
+        finally:
+            self.lock.release()
+
+    def __getitem__(self, key):
+        self.lock.acquire()
+        try:
+            link = self.d[key]
+            self._unlink(link)
+            self._append(link)
+            return link[3]
+        finally:
+            self.lock.release()
+
+    def __setitem__(self, key, value):
+        self.lock.acquire()
+        try:
+            link = self.d.get(key)
+            if link is not None:
+                self._unlink(link)
+                link[3] = value
+            else:
+                link = [None, None, key, value]
+                self.d[key] = link
+            self._append(link)
+            dropped = []
+            while len(self.d) > self.max:
+                oldest = self.root[1]
+                self._unlink(oldest)
+                del self.d[oldest[2]]
+                dropped.append((oldest[2], oldest[3]))
+        finally:
+            self.lock.release()
+        for (key, value) in dropped:
+            self.dropped(key, value)
+
+    def dropped(self, key, value):
+        pass
+
+    def __delitem__(self, key):
+        self.lock.acquire()
+        try:
+            self._unlink(self.d.pop(key))
+        finally:
+            self.lock.release()
+
+    def __contains__(self, key):
+        return key in self.d
+
+    def __len__(self):
+        return len(self.d)
+
+    def keys(self):
+        """Returns the keys, least recently used first."""
+        self.lock.acquire()
+        try:
+            L = []
+            link = self.root[1]
+            while link is not self.root:
+                L.append(link[2])
+                link = link[1]
+            return L
+        finally:
+            self.lock.release()
+
+    def clear(self):
+        self.lock.acquire()
+        try:
+            self.d.clear()
+            self.root[:] = [self.root, self.root, None, None]
+        finally:
+            self.lock.release()
+
+
 # vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
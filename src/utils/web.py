@@ -28,14 +28,22 @@
 ###
 
 import re
+import os
+import time
 import socket
 import urllib
+import rfc822
 import urllib2
 import httplib
 import sgmllib
 import urlparse
+import threading
 import htmlentitydefs
+import cPickle as pickle
+import cStringIO as StringIO
 
+import crypt
+from file import AtomicFile
 from str import normalizeWhitespace
 
 Request = urllib2.Request
@@ -87,8 +95,487 @@ defaultHeaders = {
 # application-specific function.  Feel free to use a callable here.
 proxy = None
 
+# These, too, may be callables.
+connectionsPerHost = 4 # Most requests in progress to a single host.
+idleTimeout = 60 # Seconds an idle connection is kept open for reuse.
+dnsCacheTime = 300 # Seconds a host's addresses are remembered.
+cacheSize = 100 # Responses cached in memory.
+cacheEntrySize = 262144 # Largest response body that will be cached.
+cacheDirectory = None # Where responses are cached on disk, if anywhere.
+diskCacheSize = 1000 # Responses cached on disk.
+
+# How long a request waits for a host's other requests to finish before going
+# ahead anyway; a caller that never closes its responses shouldn't be able to
+# stop us talking to a host.
+connectionWait = 30
+
+class DnsCache(object):
+    """Remembers the addresses of hosts for dnsCacheTime seconds."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.addresses = {}
+
+    def getaddrinfo(self, host, port):
+        now = time.time()
+        self.lock.acquire()
+        try:
+            try:
+                (expires, infos) = self.addresses[(host, port)]
+                if expires > now:
+                    return infos
+            except KeyError:
+                pass
+        finally:
+            self.lock.release()
+        infos = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)
+        self.lock.acquire()
+        try:
+            if len(self.addresses) > 1000:
+                for (key, (expires, _)) in self.addresses.items():
+                    if expires <= now:
+                        del self.addresses[key]
+            self.addresses[(host, port)] = (now + force(dnsCacheTime), infos)
+        finally:
+            self.lock.release()
+        return infos
+
+    def clear(self):
+        self.addresses.clear()
+
+dnsCache = DnsCache()
+
+def _connect(conn):
+    """Connects conn (an httplib.HTTPConnection) using the DNS cache."""
+    error = socket.error('getaddrinfo returns an empty list')
+    for (af, type, proto, _, address) in \
+            dnsCache.getaddrinfo(conn.host, conn.port):
+        sock = None
+        try:
+            sock = socket.socket(af, type, proto)
+            if conn.timeout is not socket._GLOBAL_DEFAULT_TIMEOUT:
+                sock.settimeout(conn.timeout)
+            if conn.source_address:
+                sock.bind(conn.source_address)
+            sock.connect(address)
+            break
+        except socket.error, error:
+            if sock is not None:
+                sock.close()
+            sock = None
+    if sock is None:
+        raise error
+    conn.sock = sock
+    if conn._tunnel_host:
+        conn._tunnel()
+
+class PooledResponse(httplib.HTTPResponse):
+    """A response that gives its connection back to the pool when it's
+    closed, which httplib does itself once the body has been read."""
+    release = None
+    def close(self):
+        httplib.HTTPResponse.close(self)
+        (release, self.release) = (self.release, None)
+        if release is not None:
+            # We only know a connection is ready for another request if we
+            # read exactly as much as the server said it would send.
+            release(self.length == 0 and not self.will_close)
+
+class HTTPConnection(httplib.HTTPConnection):
+    response_class = PooledResponse
+    def connect(self):
+        _connect(self)
+
+# httplib only has HTTPS if Python was built with ssl.
+if hasattr(httplib, 'HTTPSConnection'):
+    class HTTPSConnection(httplib.HTTPSConnection):
+        response_class = PooledResponse
+        def connect(self):
+            _connect(self)
+            server = self._tunnel_host or self.host
+            if hasattr(self, '_context'):
+                self.sock = self._context.wrap_socket(self.sock,
+                                                      server_hostname=server)
+            else:
+                import ssl
+                self.sock = ssl.wrap_socket(self.sock, self.key_file,
+                                            self.cert_file)
+
+class ConnectionPool(object):
+    """Keeps idle connections to each host open for reuse, and limits the
+    number of requests in progress to each host to connectionsPerHost."""
+    def __init__(self):
+        self.cond = threading.Condition(threading.Lock())
+        # The keys are (scheme, host, tunnelled host) triples.
+        self.idle = {} # key -> [(connection, idle since), ...]
+        self.active = {} # key -> number of requests in progress.
+
+    def get(self, key, connectionClass, timeout):
+        """Returns a pair of (connection, reused)."""
+        self.cond.acquire()
+        try:
+            deadline = time.time() + connectionWait
+            while self.active.get(key, 0) >= force(connectionsPerHost):
+                left = deadline - time.time()
+                if left <= 0:
+                    break
+                self.cond.wait(left)
+            self.active[key] = self.active.get(key, 0) + 1
+            idle = self.idle.get(key)
+            now = time.time()
+            while idle:
+                (conn, since) = idle.pop()
+                if now - since < force(idleTimeout):
+                    return (conn, True)
+                conn.close()
+        finally:
+            self.cond.release()
+        return (connectionClass(key[1], timeout=timeout), False)
+
+    def release(self, key, conn, reusable):
+        self.cond.acquire()
+        try:
+            self.active[key] -= 1
+            if not self.active[key]:
+                del self.active[key]
+            if reusable:
+                idle = self.idle.setdefault(key, [])
+                idle.append((conn, time.time()))
+                if len(idle) > force(connectionsPerHost):
+                    idle.pop(0)[0].close()
+            else:
+                conn.close()
+            self.cond.notify()
+        finally:
+            self.cond.release()
+
+    def clear(self):
+        self.cond.acquire()
+        try:
+            for idle in self.idle.itervalues():
+                for (conn, _) in idle:
+                    conn.close()
+            self.idle.clear()
+        finally:
+            self.cond.release()
+
+pool = ConnectionPool()
+
+class PooledHandlerMixin(object):
+    """Like urllib2.AbstractHTTPHandler.do_open, but with connections from the
+    pool, and without asking the server to close them."""
+    def pooledOpen(self, connectionClass, req):
+        host = req.get_host()
+        if not host:
+            raise urllib2.URLError('no host given')
+        key = (req.get_type(), host, req._tunnel_host)
+        headers = dict(req.unredirected_hdrs)
+        for (name, value) in req.headers.iteritems():
+            headers.setdefault(name, value)
+        headers = dict([(name.title(), value)
+                        for (name, value) in headers.iteritems()])
+        tunnelHeaders = {}
+        if req._tunnel_host:
+            if 'Proxy-Authorization' in headers:
+                tunnelHeaders['Proxy-Authorization'] = \
+                    headers.pop('Proxy-Authorization')
+        timeout = getattr(req, 'timeout', socket._GLOBAL_DEFAULT_TIMEOUT)
+        (conn, reused) = pool.get(key, connectionClass, timeout)
+        while 1:
+            try:
+                if req._tunnel_host and not reused:
+                    conn.set_tunnel(req._tunnel_host, headers=tunnelHeaders)
+                conn.request(req.get_method(), req.get_selector(),
+                             req.data, headers)
+                r = conn.getresponse(buffering=True)
+                break
+            except (socket.error, httplib.HTTPException), e:
+                conn.close()
+                if reused:
+                    # The server probably closed it while it was idle.
+                    conn = connectionClass(host, timeout=timeout)
+                    reused = False
+                    continue
+                pool.release(key, conn, False)
+                if isinstance(e, socket.error):
+                    raise urllib2.URLError(e)
+                raise
+        def release(reusable):
+            pool.release(key, conn, reusable)
+        if r.isclosed(): # There was no body.
+            release(not r.will_close)
+        else:
+            r.release = release
+        r.recv = r.read
+        fp = socket._fileobject(r, close=True)
+        resp = urllib.addinfourl(fp, r.msg, req.get_full_url())
+        resp.code = r.status
+        resp.msg = r.reason
+        return resp
+
+class PooledHTTPHandler(PooledHandlerMixin, urllib2.HTTPHandler):
+    def http_open(self, req):
+        return self.pooledOpen(HTTPConnection, req)
+
+if hasattr(httplib, 'HTTPSConnection'):
+    class PooledHTTPSHandler(PooledHandlerMixin, urllib2.HTTPSHandler):
+        def https_open(self, req):
+            return self.pooledOpen(HTTPSConnection, req)
+
+# The pooled connections use parts of httplib (set_tunnel, source_address,
+# getresponse's buffering) that are new in Python 2.7; before that, we just
+# use urllib2's own handlers.
+pooling = hasattr(httplib.HTTPConnection, 'set_tunnel')
+handlers = []
+if pooling:
+    handlers.append(PooledHTTPHandler)
+    if hasattr(httplib, 'HTTPSConnection'):
+        handlers.append(PooledHTTPSHandler)
+opener = urllib2.build_opener(*handlers)
+
+class CacheEntry(object):
+    """A response kept by the ResponseCache."""
+    def __init__(self, url, headers, body):
+        self.url = url
+        self.headers = str(headers)
+        self.body = body
+        self.update(headers)
+
+    def update(self, headers):
+        """Updates the entry's freshness from the headers of a response
+        (possibly a 304 Not Modified) for it."""
+        self.etag = headers.getheader('ETag') or \
+                    getattr(self, 'etag', None)
+        self.lastModified = headers.getheader('Last-Modified') or \
+                            getattr(self, 'lastModified', None)
+        self.expires = freshUntil(headers)
+
+    def isFresh(self):
+        return self.expires > time.time()
+
+    def response(self):
+        headers = httplib.HTTPMessage(StringIO.StringIO(self.headers))
+        return urllib.addinfourl(StringIO.StringIO(self.body), headers,
+                                 self.url, 200)
+
+def freshUntil(headers):
+    """Returns when a response with the given headers stops being fresh, or
+    None if it shouldn't be cached at all."""
+    directives = {}
+    for directive in (headers.getheader('Cache-Control') or '').split(','):
+        (name, _, value) = directive.strip().partition('=')
+        directives[name.lower()] = value.strip('"')
+    if 'no-store' in directives:
+        return None
+    if 'no-cache' in directives:
+        return 0
+    try:
+        return time.time() + int(directives['max-age'])
+    except (KeyError, ValueError):
+        pass
+    expires = rfc822.parsedate_tz(headers.getheader('Expires') or '')
+    if expires:
+        return rfc822.mktime_tz(expires)
+    return 0
+
+class ResponseCache(object):
+    """Keeps the cacheSize most recently used responses in memory, and the
+    diskCacheSize most recently stored in cacheDirectory."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = {} # key -> [last used, entry]
+        self.clock = 0
+        self.diskEntries = None # Number of files in the directory.
+
+    def _filename(self, key):
+        directory = force(cacheDirectory)
+        if directory and force(diskCacheSize):
+            return os.path.join(directory, crypt.sha(key).hexdigest())
+        return None
+
+    def get(self, key):
+        self.lock.acquire()
+        try:
+            self.clock += 1
+            if key in self.entries:
+                self.entries[key][0] = self.clock
+                return self.entries[key][1]
+        finally:
+            self.lock.release()
+        filename = self._filename(key)
+        if filename and os.path.exists(filename):
+            try:
+                fd = file(filename, 'rb')
+                try:
+                    entry = pickle.load(fd)
+                finally:
+                    fd.close()
+            except Exception:
+                return None
+            self._remember(key, entry)
+            return entry
+        return None
+
+    def _remember(self, key, entry):
+        size = force(cacheSize)
+        self.lock.acquire()
+        try:
+            self.clock += 1
+            self.entries[key] = [self.clock, entry]
+            while len(self.entries) > size:
+                (_, oldest) = min([(used, k) for (k, (used, _))
+                                   in self.entries.iteritems()])
+                del self.entries[oldest]
+        finally:
+            self.lock.release()
+
+    def put(self, key, entry):
+        self._remember(key, entry)
+        filename = self._filename(key)
+        if filename:
+            try:
+                self._store(filename, entry)
+            except EnvironmentError:
+                pass # The disk cache is just an optimization.
+
+    def _store(self, filename, entry):
+        directory = os.path.dirname(filename)
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        if self.diskEntries is None:
+            self.diskEntries = len(os.listdir(directory))
+        if not os.path.exists(filename):
+            self.diskEntries += 1
+        fd = AtomicFile(filename, 'wb', makeBackupIfSmaller=False)
+        pickle.dump(entry, fd, pickle.HIGHEST_PROTOCOL)
+        fd.close()
+        size = force(diskCacheSize)
+        if self.diskEntries > size:
+            L = [os.path.join(directory, name)
+                 for name in os.listdir(directory)]
+            L = [(os.path.getmtime(name), name) for name in L]
+            L.sort()
+            for (_, name) in L[:len(L) - size]:
+                os.remove(name)
+            self.diskEntries = min(len(L), size)
+
+    def remove(self, key):
+        self.lock.acquire()
+        try:
+            self.entries.pop(key, None)
+        finally:
+            self.lock.release()
+        filename = self._filename(key)
+        if filename and os.path.exists(filename):
+            try:
+                os.remove(filename)
+            except EnvironmentError:
+                pass
+
+    def clear(self):
+        self.lock.acquire()
+        try:
+            self.entries.clear()
+        finally:
+            self.lock.release()
+
+cache = ResponseCache()
+
+class CachingResponse(object):
+    """Wraps a response, putting it in the cache once it's been read to the
+    end (as long as it wasn't too big)."""
+    def __init__(self, fd, key):
+        self.fd = fd
+        self.key = key
+        self.data = []
+        self.size = 0
+
+    def __getattr__(self, attr):
+        return getattr(self.fd, attr)
+
+    def _got(self, s, eof):
+        if self.data is None:
+            return s
+        self.data.append(s)
+        self.size += len(s)
+        if self.size > force(cacheEntrySize):
+            self.data = None
+        elif eof:
+            entry = CacheEntry(self.fd.geturl(), self.fd.info(),
+                               ''.join(self.data))
+            if entry.expires is not None:
+                cache.put(self.key, entry)
+            self.data = None
+        return s
+
+    def read(self, size=-1):
+        s = self.fd.read(size)
+        return self._got(s, size < 0 or not s)
+
+    def readline(self, size=-1):
+        s = self.fd.readline(size)
+        return self._got(s, not s)
+
+    def readlines(self, sizehint=0):
+        L = []
+        while 1:
+            line = self.readline()
+            if not line:
+                return L
+            L.append(line)
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        line = self.readline()
+        if not line:
+            raise StopIteration
+        return line
+
+    def close(self):
+        self.data = None
+        self.fd.close()
+
+def _open(request):
+    """Opens request, using the cache for GET requests."""
+    if request.get_method() != 'GET' or \
+       not (force(cacheSize) or force(diskCacheSize)):
+        return opener.open(request)
+    headers = request.header_items()
+    headers.sort()
+    key = repr((request.get_full_url(), headers))
+    entry = cache.get(key)
+    if entry is not None:
+        if entry.isFresh():
+            return entry.response()
+        if entry.etag:
+            request.add_unredirected_header('If-None-Match', entry.etag)
+        if entry.lastModified:
+            request.add_unredirected_header('If-Modified-Since',
+                                            entry.lastModified)
+    try:
+        fd = opener.open(request)
+    except urllib2.HTTPError, e:
+        if e.code == 304 and entry is not None:
+            entry.update(e.info())
+            if entry.expires is None:
+                cache.remove(key)
+            else:
+                cache.put(key, entry)
+            e.close()
+            return entry.response()
+        raise
+    if fd.getcode() == 200:
+        info = fd.info()
+        if freshUntil(info) is not None and \
+           (freshUntil(info) > time.time() or
+            info.getheader('ETag') or info.getheader('Last-Modified')):
+            return CachingResponse(fd, key)
+    return fd
+
 def getUrlFd(url, headers=None):
-    """Gets a file-like object for a url."""
+    """Gets a file-like object for a url.  Connections to HTTP servers are
+    kept open for reuse, and responses are cached as their headers allow."""
     if headers is None:
         headers = defaultHeaders
     try:
@@ -101,8 +588,7 @@ def getUrlFd(url, headers=None):
         httpProxy = force(proxy)
         if httpProxy:
             request.set_proxy(httpProxy, 'http')
-        fd = urllib2.urlopen(request)
-        return fd
+        return _open(request)
     except socket.timeout, e:
         raise Error, TIMED_OUT
     except (socket.error, socket.sslerror), e:
@@ -110,6 +596,7 @@ def getUrlFd(url, headers=None):
     except httplib.InvalidURL, e:
         raise Error, 'Invalid URL: %s' % e
     except urllib2.HTTPError, e:
+        e.close() # So its connection goes back to the pool.
         raise Error, strError(e)
     except urllib2.URLError, e:
         raise Error, strError(e.reason)
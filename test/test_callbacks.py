@@ -530,6 +530,39 @@ class PluginRegexpTestCase(PluginTestCase):
         self.irc.addCallback(self.PCAR(self.irc))
         self.assertResponse('test', 'test <foo>')
 
+    def testSnarfersNeedTheirLiteral(self):
+        class Snarfer(callbacks.PluginRegexp):
+            regexps = ['snarf']
+            snarfed = []
+            def snarf(self, irc, msg, match):
+                r"snarf(\d+)"
+                self.snarfed.append(match.group(1))
+        cb = Snarfer(self.irc)
+        self.assertEqual(cb.res[0][2], 'snarf')
+        self.irc.addCallback(cb)
+        self.irc.feedMsg(ircmsgs.privmsg('#test', 'nothing here',
+                                         prefix=self.prefix))
+        self.irc.feedMsg(ircmsgs.privmsg('#test', 'SNARF1 snarf2',
+                                         prefix=self.prefix))
+        self.assertEqual(Snarfer.snarfed, ['1', '2'])
+
+        for cb in self.irc.removeCallback('Snarfer'):
+            cb.die()
+        self.failIf('snarf' in callbacks.snarfFilter.literals)
+
+    def testSnarfFilter(self):
+        f = callbacks.SnarfFilter()
+        f.add('http')
+        f.add('://')
+        f.add('://')
+        s = 'Look at HTTP://example.com'
+        self.assertEqual(f.found(s), set(['http', '://']))
+        self.assertEqual(f.found('something else'), set())
+        f.remove('://')
+        self.assertEqual(f.found(s), set(['http', '://']))
+        f.remove('://')
+        self.assertEqual(f.found(s), set(['http']))
+
 class RichReplyMethodsTestCase(PluginTestCase):
     plugins = ()
     class NoCapability(callbacks.Plugin):
@@ -690,6 +723,220 @@ class ProxyTestCase(SupyTestCase):
         self.failUnless(d[proxy] == 'foo')
 
 
+class CommandIndexTestCase(SupyTestCase):
+    def setUp(self):
+        SupyTestCase.setUp(self)
+        def command(self, irc, msg, args):
+            pass
+        class Foo(callbacks.Commands):
+            foo = command
+            bar = command
+            class baz(callbacks.Commands):
+                qux = command
+        class Bar(callbacks.Commands):
+            bar = command
+        class Dynamic(callbacks.Commands):
+            def getCommand(self, args):
+                return args[:1]
+        self.foo = Foo()
+        self.bar = Bar()
+        self.dynamic = Dynamic()
+        self.index = callbacks.CommandIndex()
+
+    def testCandidates(self):
+        cbs = [self.foo, self.bar]
+        self.assertEqual(self.index.candidates(cbs, ['foo']), [self.foo])
+        self.assertEqual(self.index.candidates(cbs, ['bar', 'x']), cbs)
+        self.assertEqual(self.index.candidates(cbs, ['baz', 'qux']),
+                         [self.foo])
+        self.assertEqual(self.index.candidates(cbs, ['foo', 'baz', 'qux']),
+                         [self.foo])
+        self.assertEqual(self.index.candidates(cbs, ['bar', 'foo']), cbs)
+        self.assertEqual(self.index.candidates(cbs, ['qux']), [])
+
+    def testRebuildsWhenCallbacksChange(self):
+        cbs = [self.foo]
+        self.assertEqual(self.index.candidates(cbs, ['bar']), [self.foo])
+        cbs.append(self.bar)
+        self.assertEqual(self.index.candidates(cbs, ['bar']), cbs)
+        cbs.remove(self.foo)
+        self.assertEqual(self.index.candidates(cbs, ['bar']), [self.bar])
+
+    def testUnindexedCallbacksAreAlwaysCandidates(self):
+        cbs = [self.foo, self.dynamic]
+        self.assertEqual(self.index.candidates(cbs, ['anything']),
+                         [self.dynamic])
+
+    def testAddAndRemoveCommand(self):
+        cbs = [self.foo, self.bar]
+        self.assertEqual(self.index.candidates(cbs, ['new']), [])
+        self.index.addCommand(self.bar, ['new'])
+        self.assertEqual(self.index.candidates(cbs, ['new']), [self.bar])
+        self.index.removeCommand(self.bar, ['new'])
+        self.assertEqual(self.index.candidates(cbs, ['new']), [])
+
+
+class ThreadPoolTestCase(SupyTestCase):
+    def setUp(self):
+        SupyTestCase.setUp(self)
+        self.config = conf.supybot.commands.threadPool
+        self.original = (self.config.size(), self.config.perPlugin(),
+                         self.config.queueSize())
+        self.pool = callbacks.ThreadPool()
+        self.gate = threading.Event()
+        self.ran = []
+        self.lock = threading.Lock()
+
+    def tearDown(self):
+        self.gate.set()
+        (size, perPlugin, queueSize) = self.original
+        self.config.size.setValue(size)
+        self.config.perPlugin.setValue(perPlugin)
+        self.config.queueSize.setValue(queueSize)
+        SupyTestCase.tearDown(self)
+
+    def block(self):
+        self.gate.wait()
+
+    def record(self, x):
+        self.lock.acquire()
+        try:
+            self.ran.append(x)
+        finally:
+            self.lock.release()
+
+    def waitFor(self, n):
+        for _ in xrange(200):
+            if len(self.ran) >= n:
+                return
+            time.sleep(0.01)
+        self.fail('Only %s of %s jobs ran.' % (len(self.ran), n))
+
+    def testChannelsTakeTurns(self):
+        self.config.size.setValue(1)
+        self.pool.submit(self.block, plugin='A', channel='#a')
+        time.sleep(0.05) # Let the worker take the blocking job.
+        for i in xrange(3):
+            self.pool.submit(self.record, (('#a', i),), plugin='A', channel='#a')
+        self.pool.submit(self.record, (('#b', 0),), plugin='A', channel='#b')
+        self.gate.set()
+        self.waitFor(4)
+        self.assertEqual(self.ran,
+                         [('#a', 0), ('#b', 0), ('#a', 1), ('#a', 2)])
+
+    def testPerPluginLimit(self):
+        self.config.size.setValue(3)
+        self.config.perPlugin.setValue(1)
+        self.pool.submit(self.block, plugin='A', channel='#a')
+        self.pool.submit(self.record, ('A',), plugin='A', channel='#a')
+        self.pool.submit(self.record, ('B',), plugin='B', channel='#a')
+        self.waitFor(1)
+        time.sleep(0.05)
+        self.assertEqual(self.ran, ['B'])
+        self.gate.set()
+        self.waitFor(2)
+        self.assertEqual(self.ran, ['B', 'A'])
+
+    def testFullQueueRefuses(self):
+        self.config.size.setValue(1)
+        self.config.queueSize.setValue(2)
+        self.pool.submit(self.block, plugin='A', channel='#a')
+        time.sleep(0.05) # Let the worker take the blocking job.
+        self.failUnless(self.pool.submit(self.record, (1,), plugin='A'))
+        self.failUnless(self.pool.submit(self.record, (2,), plugin='A'))
+        self.failIf(self.pool.submit(self.record, (3,), plugin='A'))
+        self.failUnless(self.pool.submit(self.record, (4,), plugin='B'))
+        self.assertEqual(self.pool.stats()['rejected'], 1)
+        self.gate.set()
+        self.waitFor(3)
+        self.assertEqual(sorted(self.ran), [1, 2, 4])
+
+    def testBurstRunsConcurrently(self):
+        self.config.size.setValue(10)
+        self.pool.submit(self.record, ('warm',), plugin='A', channel='#a')
+        self.waitFor(1)
+        time.sleep(0.05) # Let the worker go idle.
+        def slow(x):
+            time.sleep(0.3)
+            self.record(x)
+        start = time.time()
+        for x in 'ABCD':
+            self.pool.submit(slow, (x,), plugin=x, channel='#' + x)
+        self.waitFor(5)
+        self.failUnless(time.time() - start < 0.6,
+                        'The burst ran one job at a time.')
+        self.assertEqual(sorted(self.ran[1:]), ['A', 'B', 'C', 'D'])
+
+    def testExceptionsDontKillWorkers(self):
+        self.config.size.setValue(1)
+        def raiser():
+            raise ValueError
+        self.pool.submit(raiser, plugin='A')
+        self.pool.submit(self.record, ('ok',), plugin='A')
+        self.waitFor(1)
+        self.assertEqual(self.ran, ['ok'])
+        self.assertEqual(self.pool.stats()['jobs'], 2)
+
+class MoreStoreTestCase(SupyTestCase):
+    def setUp(self):
+        SupyTestCase.setUp(self)
+        self.config = conf.supybot.reply.mores
+        self.original = (self.config.users(), self.config.memory(),
+                         self.config.expiry())
+        self.store = callbacks.MoreStore()
+
+    def tearDown(self):
+        (users, memory, expiry) = self.original
+        self.config.users.setValue(users)
+        self.config.memory.setValue(memory)
+        self.config.expiry.setValue(expiry)
+        SupyTestCase.tearDown(self)
+
+    def chunks(self, s):
+        return ircutils.WrappedText(s, 10)
+
+    def testGetPut(self):
+        chunks = self.chunks('foo bar baz qux quux')
+        self.store.put('user@host', chunks)
+        self.store.put('Nick', chunks, True)
+        self.assertEqual(self.store.get('USER@HOST'), (False, chunks))
+        self.assertEqual(self.store.get('nick'), (True, chunks))
+        self.assertRaises(KeyError, self.store.get, 'other')
+        stats = self.store.stats()
+        self.assertEqual(stats['entries'], 2)
+        self.assertEqual(stats['replies'], 1)
+        self.assertEqual(stats['bytes'], chunks.size())
+
+    def testOldestAreEvicted(self):
+        self.config.users.setValue(1)
+        for key in ('a', 'b', 'c'):
+            self.store.put(key, self.chunks(key))
+            self.store.get('a')
+        self.assertEqual(self.store.get('a')[1].pop(), 'a')
+        self.assertRaises(KeyError, self.store.get, 'b')
+        self.assertEqual(self.store.get('c')[1].pop(), 'c')
+        self.assertEqual(self.store.stats()['evicted'], 1)
+
+    def testMemoryIsBounded(self):
+        self.config.memory.setValue(1000)
+        for i in xrange(100):
+            self.store.put(str(i), self.chunks('x' * 100))
+        stats = self.store.stats()
+        self.failUnless(stats['bytes'] <= 1000)
+        self.failUnless(stats['entries'] < 10)
+        self.assertRaises(KeyError, self.store.get, '0')
+        self.store.get('99')
+
+    def testExpiry(self):
+        self.config.expiry.setValue(1)
+        self.store.put('a', self.chunks('a'))
+        self.store.entries['a'][1] -= 2
+        self.store.put('b', self.chunks('b'))
+        self.assertRaises(KeyError, self.store.get, 'a')
+        self.store.get('b')
+        stats = self.store.stats()
+        self.assertEqual(stats['expired'], 1)
+        self.assertEqual(stats['entries'], 1)
 
 
 # vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
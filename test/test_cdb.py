@@ -0,0 +1,135 @@
+###
+# Copyright (c) 2002-2005, Jeremiah Fincher
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+###
+
+
+from supybot.test import *
+
+import os
+
+import supybot.cdb as cdb
+import supybot.conf as conf
+
+class CdbTestCase(SupyTestCase):
+    filename = conf.supybot.directories.data.dirize('CdbTestCase.cdb')
+    def setUp(self):
+        SupyTestCase.setUp(self)
+        for filename in (self.filename, self.filename + '.journal'):
+            if os.path.exists(filename):
+                os.remove(filename)
+
+    def makeDb(self, d):
+        maker = cdb.Maker(self.filename)
+        for (key, value) in d.iteritems():
+            maker.add(key, value)
+        maker.finish()
+
+    def testReader(self):
+        d = dict([('key%s' % i, 'value%s' % i) for i in range(1000)])
+        self.makeDb(d)
+        reader = cdb.Reader(self.filename)
+        try:
+            self.assertEqual(len(reader), 1000)
+            self.assertEqual(reader['key0'], 'value0')
+            self.assertEqual(reader['key999'], 'value999')
+            self.failUnless('key500' in reader)
+            self.failIf('key1000' in reader)
+            self.assertRaises(KeyError, reader.__getitem__, 'key1000')
+            self.assertEqual(reader.get('key1000'), None)
+            self.assertEqual(dict(reader.iteritems()), d)
+        finally:
+            reader.close()
+
+    def testFindall(self):
+        maker = cdb.Maker(self.filename)
+        maker.add('foo', 'bar')
+        maker.add('foo', 'baz')
+        maker.finish()
+        reader = cdb.Reader(self.filename)
+        try:
+            self.assertEqual(reader.findall('foo'), ['bar', 'baz'])
+            self.assertEqual(reader['foo'], 'bar')
+        finally:
+            reader.close()
+
+    def testGetMany(self):
+        d = dict([('key%s' % i, 'value%s' % i) for i in range(100)])
+        self.makeDb(d)
+        reader = cdb.Reader(self.filename)
+        try:
+            keys = ['key%s' % i for i in range(0, 200, 7)]
+            expected = [d.get(key) for key in keys]
+            self.assertEqual(reader.getMany(keys), expected)
+            self.assertEqual(reader.getMany(['nope'], 'x'), ['x'])
+            self.assertEqual(reader.getMany([]), [])
+        finally:
+            reader.close()
+
+    def testReaderWriter(self):
+        self.makeDb({'foo': 'bar', 'baz': 'qux'})
+        db = cdb.ReaderWriter(self.filename)
+        db['foo'] = 'FOO'
+        del db['baz']
+        db['new'] = 'value'
+        self.assertEqual(db['foo'], 'FOO')
+        self.failIf('baz' in db)
+        self.assertRaises(KeyError, db.__delitem__, 'baz')
+        self.assertEqual(db.getMany(['foo', 'baz', 'new']),
+                         ['FOO', None, 'value'])
+        db.close()
+        self.failIf(os.path.exists(self.filename + '.journal'))
+        db = cdb.ReaderWriter(self.filename)
+        self.assertEqual(dict(db.iteritems()), {'foo': 'FOO', 'new': 'value'})
+        db.close()
+
+    def testMergesOnlyOverLimit(self):
+        self.makeDb(dict([(str(i), str(i)) for i in range(200)]))
+        db = cdb.ReaderWriter(self.filename, maxmods=0.5)
+        for i in range(50):
+            del db[str(i)]
+        db.flush()
+        # The journal is kept until it's half the size of the database.
+        self.assertEqual(len(db.cdb), 200)
+        db.close()
+        db = cdb.ReaderWriter(self.filename, maxmods=0.5)
+        self.failIf('0' in db)
+        self.assertEqual(len(list(db.iteritems())), 150)
+        for i in range(50, 101):
+            del db[str(i)]
+        self.assertEqual(len(db.cdb), 99)
+        self.assertEqual(db.mods, 0)
+        db.close()
+
+    def testShelf(self):
+        db = cdb.shelf(self.filename)
+        db['foo'] = [1, 2]
+        self.assertEqual(db.getMany(['foo', 'bar']), [[1, 2], None])
+        db.close()
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -0,0 +1,134 @@
+###
+# Copyright (c) 2002-2005, Jeremiah Fincher
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+###
+
+
+from supybot.test import *
+
+import os
+
+import supybot.conf as conf
+import supybot.dbi as dbi
+
+class IndexedMappingTestCase(SupyTestCase):
+    filename = conf.supybot.directories.data.dirize('IndexedMapping.db')
+    def setUp(self):
+        SupyTestCase.setUp(self)
+        for filename in (self.filename, self.filename + '.flat'):
+            if os.path.exists(filename):
+                os.remove(filename)
+
+    def testAddGetSetRemove(self):
+        m = dbi.IndexedMapping(self.filename)
+        self.assertEqual(m.add('foo'), 1)
+        self.assertEqual(m.add('bar'), 2)
+        self.assertEqual(m.get(1), 'foo')
+        m.set(1, 'baz')
+        self.assertEqual(m.get(1), 'baz')
+        m.remove(2)
+        self.assertRaises(dbi.NoRecordError, m.get, 2)
+        self.assertRaises(dbi.NoRecordError, m.remove, 2)
+        self.assertEqual(list(m), [(1, 'baz')])
+        m.close()
+
+    def testReopen(self):
+        m = dbi.IndexedMapping(self.filename)
+        m.add('foo')
+        m.add('bar')
+        m.set(1, 'baz')
+        m.remove(2)
+        m.close()
+        m = dbi.IndexedMapping(self.filename)
+        self.assertEqual(list(m), [(1, 'baz')])
+        self.assertEqual(m.add('qux'), 3)
+        m.close()
+
+    def testInterruptedWrite(self):
+        m = dbi.IndexedMapping(self.filename)
+        m.add('foo')
+        m.close()
+        fd = file(self.filename, 'ab')
+        fd.write('2:ba')
+        fd.close()
+        m = dbi.IndexedMapping(self.filename)
+        self.assertEqual(m.add('bar'), 2)
+        self.assertEqual(list(m), [(1, 'foo'), (2, 'bar')])
+        m.close()
+
+    def testVacuum(self):
+        m = dbi.IndexedMapping(self.filename)
+        for i in range(10):
+            m.add(str(i))
+        for i in range(1, 11):
+            m.set(i, 'x' * i)
+        for i in range(1, 10):
+            m.remove(i)
+        size = os.path.getsize(self.filename)
+        m.vacuum()
+        self.failUnless(os.path.getsize(self.filename) < size)
+        self.assertEqual(list(m), [(10, 'x' * 10)])
+        m.remove(10)
+        m.vacuum()
+        self.assertEqual(list(m), [])
+        self.assertEqual(m.add('foo'), 11)
+        m.close()
+        m = dbi.IndexedMapping(self.filename)
+        self.assertEqual(list(m), [(11, 'foo')])
+        m.close()
+
+    def testBackgroundVacuum(self):
+        m = dbi.IndexedMapping(self.filename)
+        m.vacuumMinimumSize = 100
+        written = 0
+        for i in range(1, 101):
+            m.add('foo')
+            written += len('%s:foo\n' % i)
+        for i in range(1, 100):
+            m.remove(i)
+            written += len('-%s\n' % i)
+        m.close()
+        self.failUnless(os.path.getsize(self.filename) < written / 2)
+        m = dbi.IndexedMapping(self.filename)
+        self.assertEqual(list(m), [(100, 'foo')])
+        m.close()
+
+    def testImportFlatfile(self):
+        flat = dbi.FlatfileMapping(self.filename + '.flat')
+        flat.add('foo')
+        flat.add('bar')
+        flat.add('baz')
+        flat.remove(1)
+        flat.remove(3)
+        m = dbi.IndexedMapping(self.filename)
+        m.importFlatfile(self.filename + '.flat')
+        self.assertEqual(list(m), [(2, 'bar')])
+        self.assertEqual(m.add('qux'), 4)
+        m.close()
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -0,0 +1,194 @@
+###
+# Copyright (c) 2002-2005, Jeremiah Fincher
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+###
+
+
+from supybot.test import *
+
+import os
+import errno
+import select
+import socket
+
+import supybot.drivers as drivers
+import supybot.drivers.Select as Select
+import supybot.ircmsgs as ircmsgs
+
+class FakeSocket(object):
+    def __init__(self, data='', maxSend=None):
+        self.data = data
+        self.sent = []
+        self.maxSend = maxSend
+
+    def recv_into(self, view):
+        n = min(len(view), len(self.data))
+        view[:n] = self.data[:n]
+        self.data = self.data[n:]
+        return n
+
+    def send(self, s):
+        if isinstance(s, memoryview):
+            s = s.tobytes()
+        if self.maxSend is not None:
+            s = s[:self.maxSend]
+        self.sent.append(s)
+        return len(s)
+
+class ReadBufferTestCase(SupyTestCase):
+    def testLines(self):
+        buf = drivers.ReadBuffer(16)
+        buf.feed('foo\r\nbar\r\nba')
+        self.assertEqual(list(buf.lines()), ['foo\r', 'bar\r'])
+        self.assertEqual(len(buf), 2)
+        buf.feed('z\r\n')
+        self.assertEqual(list(buf.lines()), ['baz\r'])
+        self.assertEqual(len(buf), 0)
+
+    def testLongLinesGrowBuffer(self):
+        buf = drivers.ReadBuffer(4)
+        buf.feed('x' * 10)
+        self.assertEqual(list(buf.lines()), [])
+        buf.feed('\nyy')
+        self.assertEqual(list(buf.lines()), ['x' * 10])
+        buf.feed('y' * 10 + '\n')
+        self.assertEqual(list(buf.lines()), ['y' * 12])
+
+    def testTakeLines(self):
+        buf = drivers.ReadBuffer(16)
+        buf.feed('PING :foo\r\n\r\nPING :bar\r\nPI')
+        self.assertEqual(buf.takeLines(), 'PING :foo\r\n\r\nPING :bar\r')
+        self.assertEqual(buf.takeLines(), '')
+        buf.feed('NG :baz\r\n:bad\r\n')
+        msgs = drivers.parseLines(buf.takeLines())
+        self.assertEqual(msgs, [ircmsgs.ping('baz')])
+        self.failUnless(msgs[0].receivedAt)
+
+    def testRecvFrom(self):
+        lines = ['PRIVMSG #foo :%s\r' % i for i in range(100)]
+        conn = FakeSocket('\n'.join(lines) + '\n')
+        buf = drivers.ReadBuffer(64)
+        received = []
+        while buf.recvFrom(conn):
+            received.extend(buf.lines())
+        self.assertEqual(received, lines)
+        self.assertEqual(buf.recvFrom(conn), 0)
+
+class WriteBufferTestCase(SupyTestCase):
+    def testPartialSends(self):
+        buf = drivers.WriteBuffer()
+        self.failIf(buf)
+        buf.append('foo\r\n')
+        buf.append('bar\r\n')
+        self.assertEqual(len(buf), 10)
+        conn = FakeSocket(maxSend=3)
+        while buf:
+            buf.send(conn)
+        self.assertEqual(''.join(conn.sent), 'foo\r\nbar\r\n')
+        buf.append('baz\r\n')
+        buf.send(conn)
+        self.assertEqual(conn.sent[-1], 'baz')
+        buf.append('qux\r\n')
+        while buf:
+            buf.send(conn)
+        self.assertEqual(''.join(conn.sent), 'foo\r\nbar\r\nbaz\r\nqux\r\n')
+
+    def testCoalescingIsBounded(self):
+        buf = drivers.WriteBuffer()
+        line = 'PRIVMSG #foo :%s\r\n' % ('x' * 480)
+        for _ in xrange(1000):
+            buf.append(line)
+        conn = FakeSocket()
+        sent = buf.send(conn)
+        self.failUnless(len(line) <= sent <= buf.sendSize)
+        self.assertEqual(sent % len(line), 0)
+        self.failUnless(len(buf.chunks) > 900)
+        while buf:
+            buf.send(conn)
+        self.assertEqual(''.join(conn.sent), line * 1000)
+
+class FakeDriver(object):
+    connected = True
+    outbuffer = ''
+    def __init__(self, conn):
+        self.irc = self
+        self.zombie = False
+        self.fastqueue = None
+        self.queue = None
+        self.conn = conn
+        self.sends = 0
+
+    def name(self):
+        return 'FakeDriver'
+
+    def _sendIfMsgs(self):
+        self.sends += 1
+
+class ClosedSocket(object):
+    def fileno(self):
+        raise socket.error(errno.EBADF, 'Bad file descriptor')
+
+class SelectReactorTestCase(SupyTestCase):
+    def setUp(self):
+        SupyTestCase.setUp(self)
+        self.originalWait = Select._wait
+        self.reactor = Select.SelectReactor()
+
+    def tearDown(self):
+        Select._wait = self.originalWait
+        if self.reactor.wakeFds is not None:
+            for fd in self.reactor.wakeFds:
+                os.close(fd)
+        SupyTestCase.tearDown(self)
+
+    def testWaitErrorsDontEscape(self):
+        driver = FakeDriver(FakeSocket())
+        driver.conn.fileno = lambda: 0
+        self.reactor.register(driver)
+        for code in (errno.EINTR, errno.EBADF):
+            def _wait(readers, writers, timeout):
+                raise select.error(code, 'Oops')
+            Select._wait = _wait
+            self.reactor.run()
+        # Only the sends before waiting happened.
+        self.assertEqual(driver.sends, 2)
+
+    def testUnusableSocketsAreSkipped(self):
+        waited = []
+        def _wait(readers, writers, timeout):
+            waited.append(readers)
+            return ([], [])
+        Select._wait = _wait
+        self.reactor.register(FakeDriver(ClosedSocket()))
+        self.reactor.run()
+        self.assertEqual(len(waited), 1)
+        self.failIf([fd for fd in waited[0]
+                     if self.reactor.wakeFds is None or
+                        fd != self.reactor.wakeFds[0]])
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -397,6 +397,57 @@ class UsersDictionaryTestCase(IrcdbTestCase):
         u2.addHostmask('*!xyzzy@baz.domain.c?m')
         self.assertRaises(ValueError, self.users.setUser, u2)
 
+    def testManyUsers(self):
+        patterns = ['*!*@*.isp%s.net', 'nickname%s-*!*@*', '*!*@10.20.%s.*',
+                    '*!username%s@*', 'exact%s!user@host.com']
+        for i in range(50):
+            u = self.users.newUser()
+            u.name = 'user%s' % i
+            u.addHostmask(patterns[i % len(patterns)] % i)
+            self.users.setUser(u, flush=False)
+        self.assertEqual(self.users.getUserId('x!y@foo.isp0.net'), 1)
+        self.assertEqual(self.users.getUserId('NICKNAME1-x!y@foo.com'), 2)
+        self.assertEqual(self.users.getUserId('x!y@10.20.2.5'), 3)
+        self.assertEqual(self.users.getUserId('x!username3@foo.com'), 4)
+        self.assertEqual(self.users.getUserId('exact4!user@host.com'), 5)
+        self.assertEqual(self.users.getUserId('user49'), 50)
+        self.assertRaises(KeyError, self.users.getUserId, 'x!y@foo.isp1.net')
+        # Hostmasks matching another user's hostmask, in either direction,
+        # are still caught.
+        u = self.users.newUser()
+        u.addHostmask('*!*@foo.isp5.net')
+        self.assertRaises(ValueError, self.users.setUser, u)
+        u.hostmasks.clear()
+        u.addHostmask('*!*@*isp0.net')
+        self.assertRaises(ValueError, self.users.setUser, u)
+
+    def testMissesAreInvalidated(self):
+        hostmask = 'foo!bar@baz.domain.com'
+        self.assertRaises(KeyError, self.users.getUserId, hostmask)
+        u = self.users.newUser()
+        u.name = 'foo'
+        u.addHostmask('*!*@*.domain.com')
+        self.users.setUser(u)
+        self.assertEqual(self.users.getUserId(hostmask), u.id)
+        u.removeHostmask('*!*@*.domain.com')
+        self.users.setUser(u)
+        self.assertRaises(KeyError, self.users.getUserId, hostmask)
+        u.addAuth(hostmask)
+        self.users.setUser(u)
+        self.assertEqual(self.users.getUserId(hostmask), u.id)
+        u.clearAuth()
+        self.users.setUser(u)
+        self.assertRaises(KeyError, self.users.getUserId, hostmask)
+
+    def testChangeName(self):
+        u = self.users.newUser()
+        u.name = 'foo'
+        self.users.setUser(u)
+        u.name = 'bar'
+        self.users.setUser(u)
+        self.assertEqual(self.users.getUserId('bar'), u.id)
+        self.assertRaises(KeyError, self.users.getUserId, 'foo')
+
 
 class CheckCapabilityTestCase(IrcdbTestCase):
     filename = os.path.join(conf.supybot.directories.conf(),
@@ -560,5 +611,67 @@ class CheckCapabilityTestCase(IrcdbTestCase):
             conf.supybot.capabilities.default.set(str(originalConfDefaultAllow))
 
 
+class CapabilityCacheTestCase(IrcdbTestCase):
+    hostmask = 'cached!cached@cached.host.com'
+    channel = '#cachechannel'
+    cap = 'cachefoo'
+    chancap = ircdb.makeChannelCapability(channel, cap)
+    def setUp(self):
+        IrcdbTestCase.setUp(self)
+        self.user = ircdb.users.newUser()
+        self.user.name = 'cached'
+        self.user.addHostmask(self.hostmask)
+        ircdb.users.setUser(self.user)
+        ircdb.channels.setChannel(self.channel, ircdb.IrcChannel())
+
+    def tearDown(self):
+        ircdb.users.delUser(self.user.id)
+        IrcdbTestCase.tearDown(self)
+
+    def testRepeatedChecksHit(self):
+        cache = ircdb.capabilityCache
+        self.failUnless(ircdb.checkCapability(self.hostmask, self.cap))
+        hits = cache.hits
+        self.failUnless(ircdb.checkCapability(self.hostmask, self.cap))
+        self.failUnless(ircdb.checkCapability(self.hostmask, self.cap))
+        self.assertEqual(cache.hits, hits + 2)
+        self.failUnless(0 < cache.hitRatio() <= 1)
+
+    def testUserChangesInvalidate(self):
+        self.failUnless(ircdb.checkCapability(self.hostmask, self.cap))
+        self.user.addCapability(ircdb.makeAntiCapability(self.cap))
+        ircdb.users.setUser(self.user)
+        self.failIf(ircdb.checkCapability(self.hostmask, self.cap))
+        self.user.addCapability(self.cap)
+        self.failUnless(ircdb.checkCapability(self.hostmask, self.cap))
+        self.user.ignore = True
+        ircdb.users.setUser(self.user)
+        self.failIf(ircdb.checkCapability(self.hostmask, self.cap))
+
+    def testChannelChangesInvalidate(self):
+        self.failUnless(ircdb.checkCapability(self.hostmask, self.chancap))
+        c = ircdb.channels.getChannel(self.channel)
+        c.setDefaultCapability(False)
+        self.failIf(ircdb.checkCapability(self.hostmask, self.chancap))
+        c = ircdb.IrcChannel()
+        c.addCapability(self.cap)
+        c.setDefaultCapability(False)
+        ircdb.channels.setChannel(self.channel, c)
+        self.failUnless(ircdb.checkCapability(self.hostmask, self.chancap))
+
+    def testDefaultChangesInvalidate(self):
+        original = conf.supybot.capabilities.default()
+        try:
+            self.failUnless(ircdb.checkCapability(self.hostmask, self.cap))
+            conf.supybot.capabilities.default.setValue(False)
+            self.failIf(ircdb.checkCapability(self.hostmask, self.cap))
+            conf.supybot.capabilities().add(self.cap)
+            self.failUnless(ircdb.checkCapability(self.hostmask, self.cap))
+            conf.supybot.capabilities().remove(self.cap)
+            self.failIf(ircdb.checkCapability(self.hostmask, self.cap))
+        finally:
+            conf.supybot.capabilities.default.setValue(original)
+
+
 # vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
 
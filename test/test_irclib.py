@@ -30,7 +30,9 @@
 from supybot.test import *
 
 import copy
+import time
 import pickle
+import threading
 
 import supybot.conf as conf
 import supybot.irclib as irclib
@@ -182,6 +184,149 @@ class IrcMsgQueueTestCase(SupyTestCase):
         self.assertEqual(self.msg, q.dequeue())
 
 
+class PenaltyQueueTestCase(SupyTestCase):
+    class FakeIrc:
+        def __init__(self, modes):
+            self.state = irclib.IrcState()
+            self.state.supported['modes'] = modes
+    penalty = conf.supybot.protocols.irc.queuing.penalty
+
+    def setUp(self):
+        SupyTestCase.setUp(self)
+        self.originals = (self.penalty.window(), self.penalty.commands(),
+                          self.penalty.bytes(), self.penalty.perTarget())
+
+    def tearDown(self):
+        (window, commands, bytes, perTarget) = self.originals
+        self.penalty.window.setValue(window)
+        self.penalty.commands.setValue(commands)
+        self.penalty.bytes.setValue(bytes)
+        self.penalty.perTarget.setValue(perTarget)
+        SupyTestCase.tearDown(self)
+
+    def testRoundRobin(self):
+        self.penalty.window.setValue(0)
+        q = irclib.PenaltyQueue()
+        for i in range(3):
+            q.enqueue(ircmsgs.privmsg('#foo', str(i)))
+        q.enqueue(ircmsgs.privmsg('#bar', 'a'))
+        q.enqueue(ircmsgs.privmsg('#bar', 'b'))
+        q.enqueue(ircmsgs.kick('#baz', 'PeterB'))
+        self.assertEqual(len(q), 6)
+        sent = [q.dequeue(0) for _ in range(6)]
+        self.assertEqual([(m.args[0], m.args[1]) for m in sent],
+                         [('#baz', 'PeterB'), ('#foo', '0'), ('#bar', 'a'),
+                          ('#foo', '1'), ('#bar', 'b'), ('#foo', '2')])
+        self.failIf(q)
+        self.assertEqual(q.dequeue(0), None)
+        self.assertEqual(q.nextTime(0), None)
+
+    def testBuckets(self):
+        self.penalty.window.setValue(10)
+        self.penalty.commands.setValue(2)
+        self.penalty.perTarget.setValue(2)
+        q = irclib.PenaltyQueue()
+        for i in range(3):
+            q.enqueue(ircmsgs.privmsg('#foo', str(i)))
+        q.enqueue(ircmsgs.privmsg('#bar', 'a'))
+        self.assertEqual(q.nextTime(0), 0)
+        self.assertEqual(q.dequeue(0).args, ('#foo', '0'))
+        self.assertEqual(q.dequeue(0).args, ('#bar', 'a'))
+        # We've used up our commands for now.
+        self.assertEqual(q.dequeue(0), None)
+        self.assertEqual(q.nextTime(0), 5)
+        self.assertEqual(q.dequeue(5).args, ('#foo', '1'))
+        self.assertEqual(q.nextTime(5), 5)
+        self.assertEqual(q.dequeue(10).args, ('#foo', '2'))
+        self.failIf(q)
+
+    def testTargetBuckets(self):
+        self.penalty.window.setValue(10)
+        self.penalty.commands.setValue(10)
+        self.penalty.perTarget.setValue(1)
+        q = irclib.PenaltyQueue()
+        q.enqueue(ircmsgs.privmsg('#foo', '0'))
+        q.enqueue(ircmsgs.privmsg('#foo', '1'))
+        self.assertEqual(q.dequeue(0).args, ('#foo', '0'))
+        self.assertEqual(q.dequeue(0), None)
+        self.assertEqual(q.nextTime(0), 10)
+        q.enqueue(ircmsgs.privmsg('#bar', 'a'))
+        self.assertEqual(q.dequeue(0).args, ('#bar', 'a'))
+        self.assertEqual(q.dequeue(10).args, ('#foo', '1'))
+
+    def testBytes(self):
+        self.penalty.window.setValue(10)
+        self.penalty.bytes.setValue(100)
+        q = irclib.PenaltyQueue()
+        msg = ircmsgs.privmsg('#foo', 'x' * 70)
+        q.enqueue(msg)
+        q.enqueue(ircmsgs.privmsg('#bar', 'x' * 70))
+        self.assertEqual(q.dequeue(0), msg)
+        self.assertEqual(q.dequeue(0), None)
+        self.failUnless(q.nextTime(0) > 0)
+
+    def testMergesModes(self):
+        self.penalty.window.setValue(0)
+        q = irclib.PenaltyQueue(self.FakeIrc(4))
+        q.enqueue(ircmsgs.op('#foo', 'a'))
+        q.enqueue(ircmsgs.voice('#bar', 'b'))
+        q.enqueue(ircmsgs.op('#foo', 'c'))
+        q.enqueue(ircmsgs.ban('#foo', 'd!*@*'))
+        q.enqueue(ircmsgs.IrcMsg('MODE #foo +l 10'))
+        q.enqueue(ircmsgs.deop('#foo', 'a'))
+        self.assertEqual(len(q), 3)
+        self.assertEqual(q.dequeue(0).args,
+                         ('#foo', '+oobl', 'a', 'c', 'd!*@*', '10'))
+        self.assertEqual(q.dequeue(0).args, ('#foo', '-o', 'a'))
+        self.assertEqual(q.dequeue(0).args, ('#bar', '+v', 'b'))
+        self.failIf(q)
+
+    def testOnlyMergesWhenServerAllows(self):
+        self.penalty.window.setValue(0)
+        q = irclib.PenaltyQueue(self.FakeIrc(1))
+        q.enqueue(ircmsgs.op('#foo', 'a'))
+        q.enqueue(ircmsgs.op('#foo', 'b'))
+        self.assertEqual(len(q), 2)
+        q = irclib.PenaltyQueue()
+        q.enqueue(ircmsgs.op('#foo', 'a'))
+        q.enqueue(ircmsgs.kick('#foo', 'c'))
+        q.enqueue(ircmsgs.op('#foo', 'b'))
+        self.assertEqual(len(q), 3)
+
+    def testJoinRateLimit(self):
+        self.penalty.window.setValue(0)
+        limit = conf.supybot.protocols.irc.queuing.rateLimit.join
+        original = limit()
+        limit.setValue(10)
+        try:
+            q = irclib.PenaltyQueue()
+            q.enqueue(ircmsgs.join('#foo'))
+            q.enqueue(ircmsgs.join('#bar'))
+            q.enqueue(ircmsgs.privmsg('#baz', 'hi'))
+            self.assertEqual(q.dequeue(100).args, ('#foo',))
+            self.assertEqual(q.dequeue(101).args, ('#baz', 'hi'))
+            self.assertEqual(q.dequeue(102), None)
+            self.assertEqual(q.nextTime(102), 8)
+            self.assertEqual(q.dequeue(110).args, ('#bar',))
+        finally:
+            limit.setValue(original)
+
+    def testNoIdenticals(self):
+        self.penalty.window.setValue(0)
+        duplicates = conf.supybot.protocols.irc.queuing.duplicates
+        original = duplicates()
+        duplicates.setValue(True)
+        try:
+            q = irclib.PenaltyQueue()
+            msg = ircmsgs.privmsg('#foo', 'hi')
+            self.failUnless(q.enqueue(msg))
+            self.failIf(q.enqueue(msg))
+            self.failUnless(msg in q)
+            self.assertEqual(len(q), 1)
+        finally:
+            duplicates.setValue(original)
+
+
 class ChannelStateTestCase(SupyTestCase):
     def testPickleCopy(self):
         c = irclib.ChannelState()
@@ -257,6 +402,33 @@ class IrcStateTestCase(SupyTestCase):
         self.failUnless('baz' in st.channels['#foo'].users)
         self.failUnless(st.channels['#foo'].isOp('baz'))
 
+    def testWhichChannelsHad(self):
+        st = irclib.IrcState()
+        for channel in ('#foo', '#bar', '#baz'):
+            st.channels[channel] = irclib.ChannelState()
+        st.channels['#foo'].addUser('@bar')
+        st.channels['#bar'].addUser('bar')
+        st.channels['#baz'].addUser('qux')
+        self.assertEqual(sorted(st.whichChannelsHad('bar')), ['#bar', '#foo'])
+        st.addMsg(self.irc, ircmsgs.IrcMsg(':bar!user@host QUIT :bye'))
+        self.assertEqual(sorted(st.whichChannelsHad('bar')), ['#bar', '#foo'])
+        self.assertEqual(st.whichChannelsHad('qux'), ['#baz'])
+        st.addMsg(self.irc, ircmsgs.IrcMsg(':qux!user@host NICK quux'))
+        self.assertEqual(st.whichChannelsHad('qux'), ['#baz'])
+        self.assertEqual(st.whichChannelsHad('quux'), [])
+        # The changes are forgotten with the next message.
+        st.addMsg(self.irc, ircmsgs.ping('foo'))
+        self.assertEqual(st.whichChannelsHad('qux'), [])
+        self.assertEqual(st.whichChannelsHad('quux'), ['#baz'])
+        st.addMsg(self.irc, ircmsgs.join('#foo', prefix='quux!user@host'))
+        self.assertEqual(st.whichChannelsHad('quux'), ['#baz'])
+        st.addMsg(self.irc, ircmsgs.part('#baz', prefix='quux!user@host'))
+        self.assertEqual(sorted(st.whichChannelsHad('quux')),
+                         ['#baz', '#foo'])
+        st.addMsg(self.irc, ircmsgs.kick('#foo', 'quux',
+                                         prefix=self.irc.prefix))
+        self.assertEqual(st.whichChannelsHad('quux'), ['#foo'])
+
     def testHistory(self):
         if len(msgs) < 10:
             return
@@ -314,6 +486,37 @@ class IrcStateTestCase(SupyTestCase):
                 pass
         self.assertEqual(state, state.copy())
 
+    def testChannelsOf(self):
+        st = irclib.IrcState()
+        st.addMsg(self.irc, ircmsgs.join('#foo,#bar', prefix=self.irc.prefix))
+        st.addMsg(self.irc, ircmsgs.join('#foo', prefix='foo!bar@baz'))
+        st.addMsg(self.irc, ircmsgs.IrcMsg(':server 353 nick = #bar '
+                                           ':@FOO +qux nick'))
+        self.assertEqual(sorted(st.channelsOf('foo')), ['#bar', '#foo'])
+        self.assertEqual(st.channelsOf('qux'), ['#bar'])
+        self.assertEqual(st.channelsOf('nobody'), [])
+        st.addMsg(self.irc, ircmsgs.part('#foo', prefix='foo!bar@baz'))
+        self.assertEqual(st.channelsOf('foo'), ['#bar'])
+        st.addMsg(self.irc, ircmsgs.IrcMsg(':foo!bar@baz NICK baz'))
+        self.assertEqual(st.channelsOf('foo'), [])
+        self.assertEqual(st.channelsOf('baz'), ['#bar'])
+        st.addMsg(self.irc, ircmsgs.kick('#bar', 'qux', prefix='baz!bar@baz'))
+        self.assertEqual(st.channelsOf('qux'), [])
+        st2 = st.copy()
+        st.addMsg(self.irc, ircmsgs.quit(prefix='baz!bar@baz'))
+        self.assertEqual(st.channelsOf('baz'), [])
+        self.assertEqual(st2.channelsOf('baz'), ['#bar'])
+        # Parting a channel ourselves forgets everyone in it.
+        st2.addMsg(self.irc, ircmsgs.part('#bar', prefix=self.irc.prefix))
+        self.assertEqual(st2.channelsOf('baz'), [])
+        self.assertEqual(st2.channelsOf(self.irc.nick), ['#foo'])
+        # Channels added directly are indexed as well.
+        st2.channels['#baz'] = irclib.ChannelState()
+        st2.channels['#baz'].addUser('+qux')
+        self.assertEqual(st2.channelsOf('QUX'), ['#baz'])
+        st2.reset()
+        self.assertEqual(st2.channelsOf('qux'), [])
+
     def testCopyCopiesChannels(self):
         state = irclib.IrcState()
         stateCopy = state.copy()
@@ -434,6 +637,70 @@ class IrcTestCase(SupyTestCase):
         self.assertEqual(list(self.irc.state.history), [msg1, msg2])
 
 
+class LanesTestCase(SupyTestCase):
+    class Recorder(irclib.IrcCallback):
+        commutative = True
+        def __init__(self, name, event=None):
+            self.myName = name
+            self.event = event
+            self.msgs = []
+        def name(self):
+            return self.myName
+        def __call__(self, irc, msg):
+            if self.event is not None:
+                self.event.wait()
+            self.msgs.append(msg)
+
+    def testOrderAndIndependence(self):
+        lanes = irclib.Lanes('test', 2)
+        event = threading.Event()
+        slow = self.Recorder('slow', event)
+        fast = self.Recorder('fast')
+        msgs = [ircmsgs.privmsg('#foo', str(i)) for i in range(50)]
+        try:
+            for msg in msgs:
+                lanes.put(None, slow, msg)
+                lanes.put(None, fast, msg)
+            # The fast callback has its own lane, so the slow one, which
+            # hasn't handled anything yet, isn't holding it up.
+            for _ in range(100):
+                if len(fast.msgs) == len(msgs):
+                    break
+                time.sleep(0.01)
+            self.assertEqual(fast.msgs, msgs)
+            self.assertEqual(slow.msgs, [])
+            event.set()
+            lanes.join()
+            self.assertEqual(slow.msgs, msgs)
+            self.assertEqual(len(lanes.latencies['fast']), len(msgs))
+        finally:
+            event.set()
+            lanes.stop()
+        self.failIf(lanes.threads)
+
+    def testIrcUsesLanes(self):
+        irc = irclib.Irc('test', callbacks=[])
+        irc.lanes = irclib.Lanes('test', 1)
+        laned = self.Recorder('laned')
+        inline = self.Recorder('inline')
+        inline.commutative = False
+        irc.addCallback(laned)
+        irc.addCallback(inline)
+        try:
+            irc.feedMsg(ircmsgs.ping('foo'))
+            self.assertEqual(len(inline.msgs), 1)
+            irc.lanes.join()
+            self.assertEqual(laned.msgs, inline.msgs)
+            latencies = irc.getLatencies()
+            self.assertEqual(len(latencies['laned']), 1)
+            self.assertEqual(len(latencies['inline']), 1)
+            irc.removeCallback('laned')
+            self.failIf(laned in irc.lanes.assigned)
+        finally:
+            irc._reallyDie()
+        self.failIf(irc.lanes.threads)
+
+
 class IrcCallbackTestCase(SupyTestCase):
     class FakeIrc:
         pass
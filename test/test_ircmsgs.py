@@ -30,15 +30,18 @@
 from supybot.test import *
 
 import copy
+import random
 import pickle
+import os.path
 
 import supybot.ircmsgs as ircmsgs
 import supybot.ircutils as ircutils
 
 # The test framework used to provide these, but not it doesn't.  We'll add
-# messages to as we find bugs (if indeed we find bugs).
-msgs = []
-rawmsgs = []
+# messages to ircmsgs.txt as we find bugs (if indeed we find bugs).
+rawmsgs = [line[:-1] for line in
+           file(os.path.join(os.path.dirname(__file__), 'ircmsgs.txt'))]
+msgs = map(ircmsgs.IrcMsg, rawmsgs)
 
 class IrcMsgTestCase(SupyTestCase):
     def testLen(self):
@@ -127,6 +130,119 @@ class IrcMsgTestCase(SupyTestCase):
         m.tag('repliedTo', 12)
         self.assertEqual(m.repliedTo, 12)
 
+    def testCopiesShareData(self):
+        m = ircmsgs.IrcMsg(':foo!bar@baz PRIVMSG #foo :bar baz')
+        m.tag('repliedTo')
+        m2 = ircmsgs.IrcMsg(msg=m)
+        self.failUnless(m2.args is m.args)
+        self.failUnless(str(m2) is str(m))
+        self.assertEqual(m2.nick, 'foo')
+        self.failUnless(m2.repliedTo)
+        m2.tag('repliedTo', False)
+        self.failUnless(m.repliedTo)
+        m3 = ircmsgs.IrcMsg(msg=m, prefix='qux!bar@baz')
+        self.failUnless(m3.args is m.args)
+        self.assertEqual(m3.nick, 'qux')
+        self.assertEqual(m.nick, 'foo')
+
+    def testInterned(self):
+        m = ircmsgs.IrcMsg(':foo!bar@baz PRIVMSG #foo :bar')
+        m2 = ircmsgs.IrcMsg(':foo!bar@baz PRIVMSG #bar :baz')
+        self.failUnless(m.prefix is m2.prefix)
+        self.failUnless(m.command is m2.command)
+
+    def testHostmaskSplitting(self):
+        m = ircmsgs.IrcMsg(':foo!bar@baz PRIVMSG #foo :bar')
+        self.assertEqual((m.nick, m.user, m.host), ('foo', 'bar', 'baz'))
+        m = ircmsgs.IrcMsg(':irc.server.net NOTICE * :hi')
+        self.assertEqual((m.nick, m.user, m.host), ('irc.server.net',)*3)
+
+
+def oldParse(s):
+    """The parser IrcMsg used to have, which the new ones must agree with."""
+    if not s.endswith('\n'):
+        s += '\n'
+    if s[0] == ':':
+        prefix, s = s[1:].split(None, 1)
+    else:
+        prefix = ''
+    if ' :' in s:
+        s, last = s.split(' :', 1)
+        args = s.split()
+        args.append(last.rstrip('\r\n'))
+    else:
+        args = s.split()
+    command = args.pop(0)
+    return (prefix, command, tuple(args))
+
+class ParserTestCase(SupyTestCase):
+    def mutations(self, s, n):
+        """Returns n random mutations of s, biased towards the characters
+        the parsers care about."""
+        random.seed(s)
+        chars = ' :\r\n\t\x0b\x00!@#aZ'
+        L = []
+        for _ in xrange(n):
+            t = list(s)
+            for _ in xrange(random.randint(1, 4)):
+                i = random.randint(0, len(t))
+                r = random.random()
+                if r < 0.4:
+                    t.insert(i, random.choice(chars))
+                elif r < 0.7 and i < len(t):
+                    del t[i]
+                elif i < len(t):
+                    t[i] = random.choice(chars)
+            L.append(''.join(t))
+        return L
+
+    def assertParsesAs(self, parse, s, expected):
+        try:
+            result = parse(s)
+        except ValueError:
+            result = ValueError
+        self.assertEqual(result, expected, '%r parsed as %r, not %r' %
+                         (s, result, expected))
+
+    def testParsersAgree(self):
+        parsers = [ircmsgs._pyParse]
+        if ircmsgs._cParse is not None:
+            parsers.append(ircmsgs._cParse)
+        lines = [':', ' ', ': ', ':foo', ':foo ', ': foo', ' :', ' :foo']
+        for line in rawmsgs:
+            lines.append(line)
+            lines.extend(self.mutations(line, 50))
+        for line in lines:
+            s = line + '\n'
+            try:
+                expected = oldParse(s)
+            except (IndexError, ValueError):
+                expected = ValueError
+            for parse in parsers:
+                self.assertParsesAs(parse, s, expected)
+            if expected is ValueError:
+                self.assertRaises(ircmsgs.MalformedIrcMsg,
+                                  ircmsgs.IrcMsg, line)
+            else:
+                msg = ircmsgs.IrcMsg(line)
+                self.assertEqual((msg.prefix, msg.command, msg.args),
+                                 expected)
+
+    def testParseLines(self):
+        buf = '\r\n\n'.join(rawmsgs) + '\r\n  \n'
+        expected = [ircmsgs.IrcMsg(line.strip()) for line in rawmsgs]
+        parsed = ircmsgs.parseLines(buf)
+        self.assertEqual(parsed, expected)
+        self.assertEqual(map(str, parsed), map(str, expected))
+        self.assertEqual(parsed[0].nick, 'jemfinch')
+        bad = []
+        buf = 'PING :foo\n:foo\nPING :bar'
+        self.assertEqual(ircmsgs.parseLines(buf, bad.append),
+                         [ircmsgs.ping('foo'), ircmsgs.ping('bar')])
+        self.assertEqual(bad, [':foo'])
+        self.assertRaises(ircmsgs.MalformedIrcMsg, ircmsgs.parseLines, buf)
+
+
 class FunctionsTestCase(SupyTestCase):
     def testIsAction(self):
         L = [':jemfinch!~jfincher@ts26-2.homenet.ohio-state.edu PRIVMSG'
@@ -258,6 +258,49 @@ class FunctionsTestCase(SupyTestCase):
             ip = randomIP()
             self.assertEqual(ip, ircutils.unDccIP(ircutils.dccIP(ip)))
 
+    def testWrap(self):
+        f = ircutils.wrap
+        self.assertEqual(f('', 10), [])
+        self.assertEqual(f('   ', 10), [])
+        self.assertEqual(f('foo bar baz', 7), ['foo bar', 'baz'])
+        self.assertEqual(f('  foo\tbar  baz ', 8), ['foo', 'bar  baz'])
+        self.assertEqual(f('foo ' + 'x'*12, 5),
+                         ['foo', 'xxxxx', 'xxxxx', 'xx'])
+        self.assertEqual(f('\x02foo bar\x02 baz', 4),
+                         ['\x02foo\x0f', '\x02bar\x02', 'baz'])
+        self.assertEqual(f('\x0312foo bar', 6),
+                         ['\x0312foo\x0f', '\x0312bar\x0f'])
+
+    def testWrappedText(self):
+        s = 'foo \x02bar baz\tqux\x0f quux  ' + 'x'*25 + ' \x0312green end'
+        for length in (5, 7, 10, 20, 100):
+            expected = ircutils.wrap(s, length)
+            chunks = ircutils.WrappedText(s, length)
+            self.failUnless(chunks)
+            self.assertEqual(chunks.pop(), expected[0])
+            copy = chunks.copy()
+            self.assertEqual(len(chunks), len(expected) - 1)
+            L = expected[:1]
+            while chunks:
+                L.append(chunks.pop())
+            self.assertEqual(L, expected)
+            self.assertRaises(IndexError, chunks.pop)
+            self.assertEqual(len(copy), len(expected) - 1)
+            if len(expected) > 1:
+                self.assertEqual(copy.pop(), expected[1])
+
+    def testWrappedTextIsLazy(self):
+        chunks = ircutils.WrappedText('foo ' * 100000, 10)
+        self.assertEqual(chunks.pop(), 'foo foo')
+        self.failUnless(len(chunks.offsets) <= 4)
+
+    def testWrappedTextSizeCountsUnfoundChunks(self):
+        chunks = ircutils.WrappedText('x' * 100, 10)
+        size = chunks.size()
+        self.failUnless(size >= 100 + 20 * chunks.offsets.itemsize)
+        len(chunks)
+        self.assertEqual(chunks.size(), size)
+
 
 class IrcDictTestCase(SupyTestCase):
     def test(self):
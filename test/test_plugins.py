@@ -30,5 +30,143 @@
 
 from supybot.test import *
 
+import os
+
+import supybot.conf as conf
 import supybot.irclib as irclib
 import supybot.plugins as plugins
+
+class DbiChannelDBTestCase(SupyTestCase):
+    DB = plugins.ChannelIdDatabasePlugin.DB
+    channel = '#dbitest'
+    def setUp(self):
+        SupyTestCase.setUp(self)
+        for type in ('flat', 'indexed'):
+            filename = plugins.makeChannelFilename('DbiTest.%s.db' % type,
+                                                   self.channel)
+            if os.path.exists(filename):
+                os.remove(filename)
+
+    def testIndexedImportsFlat(self):
+        db = self.DB('DbiTest.flat.db')
+        db.add(self.channel, 0, 1, 'foo')
+        db.add(self.channel, 0, 1, 'bar')
+        db.add(self.channel, 0, 1, 'baz')
+        db.remove(self.channel, 3)
+        db.close()
+        db = self.DB('DbiTest.indexed.db', Mapping='indexed')
+        self.assertEqual(db.get(self.channel, 1).text, 'foo')
+        self.assertEqual(db.get(self.channel, 2).text, 'bar')
+        self.assertRaises(KeyError, db.get, self.channel, 3)
+        self.assertEqual(db.add(self.channel, 0, 1, 'qux'), 4)
+        db.close()
+        db = self.DB('DbiTest.indexed.db', Mapping='indexed')
+        self.assertEqual(db.size(self.channel), 3)
+        db.close()
+
+
+class ChannelUserDBTestCase(SupyTestCase):
+    class DB(plugins.ChannelUserDB):
+        def serialize(self, v):
+            return [v]
+
+        def deserialize(self, channel, id, L):
+            return L[0]
+
+    filename = conf.supybot.directories.data.dirize('ChannelUserDBTest.db')
+    def setUp(self):
+        SupyTestCase.setUp(self)
+        for suffix in ('', '.snapshot', '.log', '.log.old'):
+            if os.path.exists(self.filename + suffix):
+                os.remove(self.filename + suffix)
+
+    def testFlushWritesOnlyChanges(self):
+        db = self.DB(self.filename)
+        for i in range(100):
+            db['#foo', 'nick%s' % i] = 'x' * 100
+        db.flush()
+        size = os.path.getsize(db.logFilename)
+        db['#foo', 'nick0'] = 'y'
+        db['#bar', 1] = 'z'
+        del db['#foo', 'nick1']
+        db.flush()
+        self.failUnless(os.path.getsize(db.logFilename) < size * 1.1)
+        db.flush()
+        db.close()
+        db = self.DB(self.filename)
+        self.assertEqual(len(db), 100)
+        self.assertEqual(db['#foo', 'nick0'], 'y')
+        self.assertEqual(db['#foo', 'nick2'], 'x' * 100)
+        self.assertEqual(db['#bar', 1], 'z')
+        self.failIf(('#foo', 'nick1') in db)
+        db.close()
+
+    def testConvertsCsv(self):
+        fd = file(self.filename, 'w')
+        fd.write('#foo,nick,hello\r\n#foo,1,"there, you"\r\n')
+        fd.close()
+        db = self.DB(self.filename)
+        self.assertEqual(db['#foo', 'nick'], 'hello')
+        self.assertEqual(db['#foo', 1], 'there, you')
+        self.failUnless(os.path.exists(db.snapshotFilename))
+        db.close()
+        os.remove(self.filename)
+        db = self.DB(self.filename)
+        self.assertEqual(db['#foo', 1], 'there, you')
+        db.close()
+
+    def testCompaction(self):
+        db = self.DB(self.filename)
+        db.compactionSize = 0
+        db['#foo', 'a'] = '1'
+        db['#foo', 'b'] = '2'
+        db.flush()
+        db.compactor.join()
+        self.failIf(os.path.exists(db.logFilename))
+        self.failIf(os.path.exists(db.oldLogFilename))
+        db['#foo', 'a'] = '3'
+        del db['#foo', 'b']
+        db['#foo', 'c'] = '4'
+        db.close()
+        self.failIf(os.path.exists(db.oldLogFilename))
+        db = self.DB(self.filename)
+        self.assertEqual(sorted(db.items()),
+                         [(('#foo', 'a'), '3'), (('#foo', 'c'), '4')])
+        db.close()
+
+    def testDamagedLog(self):
+        db = self.DB(self.filename)
+        db['#foo', 'a'] = '1'
+        db.flush()
+        db.close()
+        fd = file(db.logFilename, 'ab')
+        fd.write('[\x02\x00\x00\x00(')
+        fd.close()
+        db = self.DB(self.filename)
+        self.assertEqual(db.items(), [(('#foo', 'a'), '1')])
+        db['#foo', 'b'] = '2'
+        db.close()
+        db = self.DB(self.filename)
+        self.assertEqual(len(db), 2)
+        db.close()
+
+    def testMutable(self):
+        class Counter(object):
+            def __init__(self, n=0):
+                self.n = int(n)
+        class DB(plugins.ChannelUserDB):
+            mutable = True
+            def serialize(self, v):
+                return [v.n]
+
+            def deserialize(self, channel, id, L):
+                return Counter(*L)
+        db = DB(self.filename)
+        db['#foo', 'a'] = Counter()
+        db.flush()
+        db['#foo', 'a'].n += 1
+        db.close()
+        db = DB(self.filename)
+        self.assertEqual(db['#foo', 'a'].n, 1)
+        db.close()
+
@@ -118,6 +118,15 @@ class ValuesTestCase(SupyTestCase):
         v.set('0')
         self.assertEqual(v(), 0.0)
 
+    def testNonNegativeFloat(self):
+        v = registry.NonNegativeFloat(1.0, 'help')
+        v.set('0')
+        self.assertEqual(v(), 0.0)
+        v.set('2.5')
+        self.assertEqual(v(), 2.5)
+        self.assertRaises(registry.InvalidRegistryValue, v.set, '-1')
+        self.assertRaises(registry.InvalidRegistryValue, v.setValue, -0.5)
+
     def testString(self):
         v = registry.String('foo', 'help')
         self.assertEqual(v(), 'foo')
@@ -174,4 +183,58 @@ class ValuesTestCase(SupyTestCase):
         registry.open(filename)
         self.assertEqual(conf.supybot.reply.whenAddressedBy.chars(), '\\')
 
+
+class HandleTestCase(SupyTestCase):
+    def setUp(self):
+        SupyTestCase.setUp(self)
+        self.group = registry.Group()
+        self.group.setName('group')
+
+    def testResolvesOnce(self):
+        self.group.register('foo', registry.Integer(1, ''))
+        handle = registry.handle(self.group, ['foo'])
+        self.assertEqual(handle(), 1)
+        node = handle.resolve()
+        self.failUnless(node is self.group.foo)
+        self.group.foo.setValue(2)
+        self.assertEqual(handle(), 2)
+        self.failUnless(handle.resolve() is node)
+
+    def testReresolvesAfterReregistration(self):
+        self.group.register('foo', registry.Integer(1, ''))
+        handle = registry.handle(self.group, ['foo'])
+        self.assertEqual(handle(), 1)
+        self.group.unregister('foo')
+        self.assertRaises(registry.NonExistentRegistryEntry, handle)
+        self.group.register('foo', registry.Integer(2, ''))
+        self.assertEqual(handle(), 2)
+
+    def testChannelValues(self):
+        v = registry.Integer(1, '', supplyDefault=True)
+        self.group.register('foo', v)
+        handle = registry.handle(self.group, ['foo', '#bar'])
+        self.assertEqual(handle(), 1)
+        self.group.foo.get('#bar').setValue(2)
+        self.assertEqual(handle(), 2)
+        self.assertEqual(self.group.foo(), 1)
+        # Setting the parent replaces the children that were just defaults.
+        other = registry.handle(self.group, ['foo', '#baz'])
+        self.assertEqual(other(), 1)
+        self.group.foo.setValue(3)
+        self.assertEqual(other(), 3)
+        self.assertEqual(handle(), 2)
+
+    def testLookupReport(self):
+        self.group.register('foo', registry.Integer(1, ''))
+        original = registry.profiling
+        registry.profiling = True
+        try:
+            handle = registry.handle(self.group, ['foo'])
+        finally:
+            registry.profiling = original
+        for _ in xrange(3):
+            handle()
+        self.failUnless('group.foo' in dict(registry.lookupReport(1000)))
+
+
 # vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -73,6 +73,59 @@ class TestSchedule(SupyTestCase):
         sched.run()
         self.assertEqual(i[0], 1)
 
+    def testNextTime(self):
+        sched = schedule.Schedule()
+        self.assertEqual(sched.nextTime(), None)
+        now = time.time()
+        sched.addEvent(lambda: None, now + 10)
+        n = sched.addEvent(lambda: None, now + 5)
+        self.assertEqual(sched.nextTime(), now + 5)
+        sched.removeEvent(n)
+        self.assertEqual(sched.nextTime(), now + 10)
+
+    def testRemovedEventsDoNotRun(self):
+        sched = schedule.Schedule()
+        i = [0]
+        def inc():
+            i[0] += 1
+        now = time.time()
+        names = [sched.addEvent(inc, now - 1) for _ in range(10)]
+        for name in names[:9]:
+            sched.removeEvent(name)
+        self.failUnless(len(sched.schedule) < 10)
+        sched.run()
+        self.assertEqual(i[0], 1)
+        self.failIf(sched.schedule)
+        self.failIf(sched.events)
+
+    def testNameReusedAfterRemoval(self):
+        sched = schedule.Schedule()
+        i = [0]
+        def add1():
+            i[0] += 1
+        def add10():
+            i[0] += 10
+        sched.addEvent(add1, time.time() - 1, 'foo')
+        sched.addEvent(lambda: None, time.time() + 100) # Keeps foo's entry.
+        sched.removeEvent('foo')
+        sched.addEvent(add10, time.time() + 100, 'foo')
+        sched.run()
+        self.assertEqual(i[0], 0)
+        sched.rescheduleEvent('foo', time.time() - 1)
+        sched.run()
+        self.assertEqual(i[0], 10)
+
+    def testAddEvents(self):
+        sched = schedule.Schedule()
+        L = []
+        now = time.time()
+        sched.addEvent(lambda: L.append(0), now - 3)
+        names = sched.addEvents([(lambda: L.append(2), now - 1),
+                                 (lambda: L.append(1), now - 2, 'one')])
+        self.assertEqual(names[1], 'one')
+        sched.run()
+        self.assertEqual(L, [0, 1, 2])
+
 
 # vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
 
@@ -81,6 +81,18 @@ class FunctionsTestCase(SupyTestCase):
         c = f(self.irc, msg, '$channel')
         self.assertEqual(c, msg.args[0])
 
+    def testEnvAndUnknownVariables(self):
+        f = ircutils.standardSubstitute
+        msg = ircmsgs.privmsg('#foo', 'filler', prefix='biff!quux@xyzzy')
+        self.assertEqual(f(self.irc, msg, 'no variables'), 'no variables')
+        self.assertEqual(f(self.irc, msg, '$Nick $bogus ${also bogus}'),
+                         'biff $bogus ${also bogus}')
+        self.assertEqual(f(self.irc, msg, '$NICK $foo',
+                           env={'nick': 'x', 'Foo': 'y'}), 'x y')
+        msg = ircmsgs.privmsg('foobar', 'filler', prefix='biff!quux@xyzzy')
+        self.assertEqual(f(self.irc, msg, '$channel $randnick'),
+                         'somewhere someone')
+
 
 
 
@@ -30,8 +30,11 @@
 
 from supybot.test import *
 
+import re
 import time
 import pickle
+import threading
+import BaseHTTPServer
 import supybot.utils as utils
 from supybot.utils.structures import *
 
@@ -326,6 +329,34 @@ class StrTest(SupyTestCase):
         self.assertEqual(f(vars, '${b a z}'), 'baz')
         self.assertEqual(f(vars, '$b:$i'), 'c:100')
 
+    def testPerlVariableTemplate(self):
+        template = utils.str.perlVariableTemplate('$a and ${b c}, $a $$d')
+        self.failUnless(utils.str.perlVariableTemplate('$a and ${b c}, $a $$d')
+                        is template)
+        self.assertEqual(template.names, ['a', 'b c', 'a', 'd'])
+        L = []
+        def counter():
+            L.append(None)
+            return str(len(L))
+        self.assertEqual(template.substitute({'a': counter, 'd': 4}),
+                         '1 and ${b c}, 2 $4')
+        self.assertEqual(utils.str.perlVariableTemplate('foo').names, [])
+
+    def testRequiredLiteral(self):
+        f = utils.str.requiredLiteral
+        self.assertEqual(f(r'https?://\S+'), 'http')
+        self.assertEqual(f(r'^google\s+(.*)$', re.I), 'google')
+        self.assertEqual(f('\x01PING ?(.*)\x01'), '\x01PING')
+        self.assertEqual(f('\x01PING ?(.*)\x01', re.I), '\x01ping')
+        self.assertEqual(f('(?i)FooBar'), 'foobar')
+        self.assertEqual(f('(ab)?cd'), 'cd')
+        self.assertEqual(f('(foo)+b'), 'foo')
+        self.assertEqual(f('x(foo)*'), 'x')
+        self.assertEqual(f('foo|bar'), None)
+        self.assertEqual(f(r'\w+'), None)
+        self.assertEqual(f('foo', re.U), None)
+        self.assertEqual(f('(unbalanced'), None)
+
     def testCommaAndify(self):
         f = utils.str.commaAndify
         L = ['foo']
@@ -531,6 +562,109 @@ class WebTest(SupyTestCase):
             url = 'http://slashdot.org/'
             self.failUnless(len(utils.web.getUrl(url, 1024)) == 1024)
 
+
+class TestHTTPRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        self.server.connections += 1
+
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        headers = {'Content-Type': 'text/plain'}
+        body = 'Hello from %s.' % self.path
+        if self.path == '/fresh':
+            headers['Cache-Control'] = 'max-age=60'
+        elif self.path == '/etag':
+            headers['ETag'] = '"v1"'
+            if self.headers.getheader('If-None-Match') == '"v1"':
+                self.send_response(304)
+                for (name, value) in headers.iteritems():
+                    self.send_header(name, value)
+                self.end_headers()
+                return
+        elif self.path == '/uncached':
+            headers['Cache-Control'] = 'no-store'
+        self.send_response(200)
+        headers['Content-Length'] = str(len(body))
+        for (name, value) in headers.iteritems():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+class TestHTTPServer(BaseHTTPServer.HTTPServer):
+    def __init__(self):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0),
+                                           TestHTTPRequestHandler)
+        self.connections = 0
+        self.requests = []
+
+    def handle_error(self, request, address):
+        pass # Clients closing connections we'd have kept alive are fine.
+
+class HTTPClientTest(SupyTestCase):
+    def setUp(self):
+        SupyTestCase.setUp(self)
+        self.originalDirectory = utils.web.cacheDirectory
+        utils.web.cacheDirectory = None
+        utils.web.cache.clear()
+        utils.web.pool.clear()
+        self.server = TestHTTPServer()
+        t = threading.Thread(target=self.server.serve_forever,
+                             kwargs={'poll_interval': 0.05})
+        t.setDaemon(True)
+        t.start()
+        self.thread = t
+        self.url = 'http://127.0.0.1:%s' % self.server.server_port
+
+    def tearDown(self):
+        utils.web.pool.clear()
+        utils.web.cache.clear()
+        utils.web.cacheDirectory = self.originalDirectory
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        SupyTestCase.tearDown(self)
+
+    def testConnectionsAreReused(self):
+        for _ in xrange(3):
+            self.assertEqual(utils.web.getUrl(self.url + '/uncached'),
+                             'Hello from /uncached.')
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertEqual(self.server.connections, 1)
+        self.assertEqual(utils.web.pool.active, {})
+
+    def testPartialReadDoesntReuseConnection(self):
+        fd = utils.web.getUrlFd(self.url + '/uncached')
+        fd.read(3)
+        fd.close()
+        utils.web.getUrl(self.url + '/uncached')
+        self.assertEqual(self.server.connections, 2)
+        self.assertEqual(utils.web.pool.active, {})
+
+    def testFreshResponsesAreCached(self):
+        for _ in xrange(2):
+            self.assertEqual(utils.web.getUrl(self.url + '/fresh'),
+                             'Hello from /fresh.')
+        self.assertEqual(self.server.requests, ['/fresh'])
+
+    def testStaleResponsesAreRevalidated(self):
+        for _ in xrange(2):
+            fd = utils.web.getUrlFd(self.url + '/etag')
+            self.assertEqual(fd.read(), 'Hello from /etag.')
+            self.assertEqual(fd.info().getheader('ETag'), '"v1"')
+            fd.close()
+        self.assertEqual(self.server.requests, ['/etag', '/etag'])
+        self.assertEqual(self.server.connections, 1)
+
+    def testNoStore(self):
+        for _ in xrange(2):
+            utils.web.getUrl(self.url + '/uncached')
+        self.assertEqual(len(self.server.requests), 2)
+
 class FormatTestCase(SupyTestCase):
     def testNormal(self):
         format = utils.str.format
@@ -539,6 +673,21 @@ class FormatTestCase(SupyTestCase):
                          'I have 3 kinds of fruit: '
                          'apples, oranges, and watermelon.')
 
+    def testTemplatesAreCached(self):
+        format = utils.str.format
+        s = 'I have %n%% of %s and %.1f%% of %s.'
+        self.assertEqual(format(s, (3, 'kind'), 'this', 1.25, 'that'),
+                         'I have 3 kinds% of this and 1.2% of that.')
+        template = utils.str.formatTemplate(s)
+        self.failUnless(template is utils.str.formatTemplate(s))
+        self.assertEqual(len(template.formatters), 4)
+        self.assertEqual(format(s, (1, 'kind'), 'x', 2, 'y'),
+                         'I have 1 kind% of x and 2.0% of y.')
+        self.assertEqual(format(u'%s', 'foo'), u'foo')
+        self.failUnless(isinstance(format(u'foo'), unicode))
+        self.assertRaises(ValueError, format, s, (1, 'kind'))
+        self.assertRaises(ValueError, format, '%L', 'foo')
+
 class RingBufferTestCase(SupyTestCase):
     def testInit(self):
         self.assertRaises(ValueError, RingBuffer, -1)
@@ -1123,6 +1272,37 @@ class TestTimeoutQueue(SupyTestCase):
         q.reset()
         self.failIf(1 in q)
 
+class LRUCacheTestCase(SupyTestCase):
+    def testLeastRecentlyUsedIsDropped(self):
+        d = LRUCache(3)
+        for i in xrange(3):
+            d[i] = str(i)
+        self.assertEqual(d[0], '0')
+        d[3] = '3'
+        self.failIf(1 in d)
+        self.assertEqual(d.keys(), [2, 0, 3])
+        self.assertEqual(d.get(2), '2')
+        d[4] = '4'
+        self.assertEqual(d.keys(), [3, 2, 4])
+        self.assertEqual(d.get(0), None)
+        self.assertRaises(KeyError, d.__getitem__, 0)
+        del d[3]
+        self.assertEqual(d.keys(), [2, 4])
+        d.clear()
+        self.assertEqual(len(d), 0)
+        self.assertEqual(d.keys(), [])
+
+    def testDropped(self):
+        dropped = []
+        class Cache(LRUCache):
+            def dropped(self, key, value):
+                dropped.append((key, value))
+        d = Cache(2)
+        for i in xrange(4):
+            d[i] = str(i)
+        self.assertEqual(dropped, [(0, '0'), (1, '1')])
+
+
 class TestCacheDict(SupyTestCase):
     def testMaxNeverExceeded(self):
         max = 10